@@ -0,0 +1,87 @@
+"""
+Micro-benchmark for bedrock-runtime client reuse.
+
+Compares the per-call cost of creating a new boto3 client for every request
+(the previous behaviour of call_bedrock_api) with fetching the shared client
+from get_bedrock_client. No request is sent to AWS unless --invoke is given.
+
+Usage:
+    python benchmarks/bench_client_reuse.py --iterations 50
+    python benchmarks/bench_client_reuse.py --iterations 10 --invoke path/to/image.jpeg
+"""
+
+import argparse
+import statistics
+import time
+
+import boto3
+
+from shutterstock_tagger.bedrock_client import (
+    call_bedrock_api,
+    encode_image,
+    get_aws_region,
+    get_bedrock_client,
+)
+
+
+def time_calls(func, iterations):
+    """
+    Time repeated calls of a function.
+
+    Args:
+        func (callable): Function to call without arguments
+        iterations (int): Number of calls
+
+    Returns:
+        list: Duration of each call in milliseconds
+    """
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def report(label, durations):
+    """Print mean and median of a list of durations in milliseconds."""
+    print(
+        f"{label:<28} mean {statistics.mean(durations):8.2f} ms  "
+        f"median {statistics.median(durations):8.2f} ms"
+    )
+
+
+def main():
+    """Main entry point for the client reuse benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark bedrock-runtime client reuse")
+    parser.add_argument("--iterations", type=int, default=50, help="Number of iterations")
+    parser.add_argument(
+        "--invoke", metavar="IMAGE", help="Also time real Bedrock calls with this image"
+    )
+    args = parser.parse_args()
+
+    region = get_aws_region()
+
+    report(
+        "new client per call",
+        time_calls(lambda: boto3.client("bedrock-runtime", region_name=region), args.iterations),
+    )
+    report("shared client", time_calls(lambda: get_bedrock_client(region), args.iterations))
+
+    if args.invoke:
+        image_base64 = encode_image(args.invoke)
+        prompt = "Describe this image in one sentence."
+
+        def new_client_call():
+            client = boto3.client("bedrock-runtime", region_name=region)
+            call_bedrock_api(image_base64, "", prompt, region, client=client)
+
+        def shared_client_call():
+            call_bedrock_api(image_base64, "", prompt, region)
+
+        report("invoke, new client", time_calls(new_client_call, args.iterations))
+        report("invoke, shared client", time_calls(shared_client_call, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark for HEIC to JPEG conversion.
+
+Generates a synthetic corpus of HEIC files with an embedded ICC profile and
+times convert_images.convert_files serially and with a process pool.
+
+Usage:
+    python benchmarks/bench_convert.py --count 32 --megapixels 12 --workers 8
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pillow_heif
+from PIL import Image, ImageCms
+
+from shutterstock_tagger.convert_images import convert_files
+
+pillow_heif.register_heif_opener()
+
+
+def make_corpus(folder, count, megapixels, image_format="heic", seed=0):
+    """
+    Write synthetic images to a folder.
+
+    Args:
+        folder (str): Destination folder
+        count (int): Number of files
+        megapixels (float): Size of each image in megapixels (4:3 aspect ratio)
+        image_format (str, optional): "heic", "jpeg" or "png"
+        seed (int, optional): Random seed for reproducible content
+
+    Returns:
+        list: Paths of the generated files
+    """
+    rng = np.random.default_rng(seed)
+    height = int((megapixels * 1_000_000 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    icc_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+
+    # Smooth gradients with noise compress like photos rather than pure noise
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], -1)
+
+    paths = []
+    for index in range(count):
+        noise = rng.integers(0, 32, size=(height, width, 3))
+        pixels = ((base + noise) % 256).astype(np.uint8)
+        path = os.path.join(folder, f"IMG_{index:04d}.{image_format}")
+        if image_format == "png":
+            Image.fromarray(pixels).save(path, icc_profile=icc_profile)
+        else:
+            Image.fromarray(pixels).save(path, quality=90, icc_profile=icc_profile)
+        paths.append(path)
+    return paths
+
+
+def make_heic_corpus(folder, count, megapixels, seed=0):
+    """
+    Write synthetic HEIC files to a folder.
+
+    Args:
+        folder (str): Destination folder
+        count (int): Number of files
+        megapixels (float): Size of each image in megapixels (4:3 aspect ratio)
+        seed (int, optional): Random seed for reproducible content
+
+    Returns:
+        list: Paths of the generated files
+    """
+    return make_corpus(folder, count, megapixels, "heic", seed)
+
+
+def time_conversion(template_folder, workers):
+    """
+    Time converting a fresh copy of the corpus.
+
+    Args:
+        template_folder (str): Folder with the generated corpus
+        workers (int): Number of worker processes
+
+    Returns:
+        float: Elapsed time in seconds
+    """
+    work_folder = tempfile.mkdtemp()
+    try:
+        paths = []
+        for filename in sorted(os.listdir(template_folder)):
+            paths.append(shutil.copy(os.path.join(template_folder, filename), work_folder))
+        start = time.perf_counter()
+        convert_files(paths, workers)
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_folder)
+
+
+def main():
+    """Main entry point for the conversion benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark HEIC to JPEG conversion")
+    parser.add_argument("--count", type=int, default=32, help="Number of synthetic images")
+    parser.add_argument("--megapixels", type=float, default=12, help="Megapixels per image")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="Worker processes to compare"
+    )
+    args = parser.parse_args()
+
+    corpus_folder = tempfile.mkdtemp()
+    try:
+        print(f"Generating {args.count} HEIC files of {args.megapixels} MP...")
+        make_heic_corpus(corpus_folder, args.count, args.megapixels)
+
+        serial = time_conversion(corpus_folder, 1)
+        parallel = time_conversion(corpus_folder, args.workers)
+
+        print(f"serial:               {serial:7.2f} s  ({args.count / serial:6.2f} images/s)")
+        print(
+            f"{args.workers:>2} worker processes:  {parallel:7.2f} s  "
+            f"({args.count / parallel:6.2f} images/s)"
+        )
+        print(f"speedup:              {serial / parallel:7.2f}x")
+    finally:
+        shutil.rmtree(corpus_folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Benchmark for the startup cost of the command line entry points.
+
+Imports each CLI module in a fresh interpreter with ``python -X importtime``
+and sums the cumulative time of the imports it triggers, leaving out the
+interpreter's own startup. The median over several runs is compared with a
+budget, and heavy dependencies (boto3, Pillow, pandas, ...) that were
+imported just by loading the module are listed, since those should only be
+imported by the functions that use them.
+
+Exits with status 1 when a module is over budget, so it can be used as a check.
+
+Usage:
+    python benchmarks/bench_import_time.py
+    python benchmarks/bench_import_time.py --budget_ms 150 --runs 7 --top 5
+"""
+
+import argparse
+import subprocess
+import sys
+
+CLI_MODULES = [
+    "shutterstock_tagger.workflow",
+    "shutterstock_tagger.convert_images",
+    "shutterstock_tagger.clean_files",
+    "shutterstock_tagger.binary_classifier",
+    "shutterstock_tagger.tag_generator",
+    "shutterstock_tagger.file_organizer",
+    "shutterstock_tagger.folder_cleanup",
+    "shutterstock_tagger.result_analyzer",
+    "shutterstock_tagger.batch_splitter",
+]
+
+HEAVY_MODULES = ["boto3", "botocore", "PIL", "pillow_heif", "pandas", "numpy", "tqdm"]
+
+
+def parse_importtime(stderr):
+    """
+    Parse the output of ``-X importtime`` for an import run with ``-c``.
+
+    Args:
+        stderr (str): Standard error of the interpreter
+
+    Returns:
+        tuple: (total_us, entries) - total cumulative microseconds of the
+            top-level imports, and (self_us, name) for every module imported
+    """
+    lines = [line for line in stderr.splitlines() if line.startswith("import time:")]
+    rows = [line[len("import time:"):].split("|") for line in lines[1:]]
+    # A module is listed after the modules it imports, so interpreter startup
+    # ends with the top-level import of site
+    start = 0
+    for index, (_, _, name) in enumerate(rows):
+        if name.rstrip() == " site":
+            start = index + 1
+    entries = []
+    total_us = 0
+    for self_us, cumulative_us, name in rows[start:]:
+        entries.append((int(self_us), name.strip()))
+        if not name.startswith("  "):
+            total_us += int(cumulative_us)
+    return total_us, entries
+
+
+def measure(module, runs):
+    """
+    Measure the import time of a module in fresh interpreters.
+
+    Args:
+        module (str): Dotted module name
+        runs (int): Number of interpreters to start
+
+    Returns:
+        dict: Median and minimum milliseconds, modules with the most self time
+            in the median run and heavy modules that were imported
+    """
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    results = []
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        total_us, entries = parse_importtime(completed.stderr)
+        results.append((total_us, entries, completed.stdout.strip()))
+    results.sort(key=lambda result: result[0])
+    total_us, entries, heavy = results[len(results) // 2]
+    return {
+        "median_ms": total_us / 1000,
+        "min_ms": results[0][0] / 1000,
+        "heaviest": sorted(entries, reverse=True),
+        "heavy": [name for name in heavy.split(",") if name],
+    }
+
+
+def main():
+    """Main entry point for the import time benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark CLI import time")
+    parser.add_argument(
+        "--modules", nargs="+", default=CLI_MODULES, help="Modules to import"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Interpreters to start per module")
+    parser.add_argument(
+        "--budget_ms", type=float, default=200, help="Maximum median import time per module"
+    )
+    parser.add_argument(
+        "--top", type=int, default=3, help="Number of slowest imports to list per module"
+    )
+    args = parser.parse_args()
+
+    over_budget = []
+    print(f"{'module':<38}{'median ms':>10}{'min ms':>9}  slowest imports (self ms)")
+    for module in args.modules:
+        result = measure(module, args.runs)
+        slowest = ", ".join(
+            f"{name} {self_us / 1000:.1f}" for self_us, name in result["heaviest"][:args.top]
+        )
+        print(f"{module:<38}{result['median_ms']:>10.1f}{result['min_ms']:>9.1f}  {slowest}")
+        if result["heavy"]:
+            print(f"{'':<38}imports heavy dependencies: {', '.join(result['heavy'])}")
+        if result["median_ms"] > args.budget_ms:
+            over_budget.append(module)
+
+    if over_budget:
+        print(f"\nOver the {args.budget_ms:g} ms budget: {', '.join(over_budget)}")
+        sys.exit(1)
+    print(f"\nAll modules within the {args.budget_ms:g} ms budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,573 @@
+"""
+Benchmark suite for the workflow stages and the end-to-end workflow.
+
+Generates reproducible synthetic corpora of HEIC, JPEG and PNG files at
+several sizes, then runs each hot path on them: conversion
+(convert_to_jpeg), validation (is_valid_jpeg and the header-only
+check_image), proxy building (make_proxy) and encoding (encode_image),
+organizing (move_files), response parsing (extract_content_sections),
+result analysis (analyze_output_files, serially, in parallel and from a
+response store) and batch splitting (split_batches), followed by the
+whole workflow against the mock model backend. Each stage runs in a fresh process so its
+peak RSS is its own.
+
+Results are printed and written as JSON with throughput (images/s, MB/s),
+peak RSS and latency percentiles per stage. Stages that handle images one
+by one report per-image latencies; stages timed as a whole report one
+latency per repeat. Pass a previous result file with --compare to print
+the change in throughput.
+
+Usage:
+    python benchmarks/bench_pipeline.py --count 8 --megapixels 6 12 --output bench.json
+    python benchmarks/bench_pipeline.py --stages encode parse --compare bench.json
+    python benchmarks/bench_pipeline.py --stages proxy --formats jpeg --megapixels 4.5 24
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from bench_convert import make_corpus
+
+FORMATS = ["heic", "jpeg", "png"]
+
+# Stages in the order they run, and the corpus formats each one reads
+STAGE_FORMATS = {
+    "convert": ["heic", "png"],
+    "is_valid_jpeg": ["jpeg"],
+    "check_image": ["jpeg"],
+    "proxy": ["jpeg"],
+    "encode": ["jpeg"],
+    "organize": ["jpeg"],
+    "parse": [],
+    "analyze": [],
+    "analyze_parallel": [],
+    "analyze_store": [],
+    "split_batches": ["jpeg"],
+    "workflow": FORMATS,
+    "workflow_stream": FORMATS,
+}
+
+# Prompts of the end-to-end runs, so results do not depend on local prompt files
+BENCH_PROMPTS = {
+    "system_prompt_binary.txt": "You review photos for a stock photography agency.",
+    "prompt_binary.txt": "Is this image suitable for upload, and how likely is it to be accepted?",
+    "system_prompt.txt": "You write metadata for stock photos.",
+    "prompt.txt": "Write a title, keywords and a category for this image.",
+    "system_prompt_combined.txt": "You review photos and write metadata for stock photos.",
+    "prompt_combined.txt": "Is this image suitable for upload? Write a title, keywords and a category.",
+}
+
+TAG_RESPONSE = (
+    "Title: Golden evening light over a quiet harbour with fishing boats\n\n"
+    "Keywords: harbour, boats, sunset, evening, golden hour, water, reflection, coast, "
+    "fishing, travel, nautical, calm, sea, sky, village\n\n"
+    "Category: Nature"
+)
+
+
+def list_files(folder):
+    """Return the sorted paths of the files in a folder."""
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder))]
+
+
+def total_bytes(paths):
+    """Return the total size of files in bytes."""
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def timed(func, *args, **kwargs):
+    """Call a function and return its duration in seconds."""
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def peak_rss_mb():
+    """
+    Get the peak resident set size of this process and of its waited-for children.
+
+    On Linux the peak of this process is read from VmHWM, which starts over
+    in a new process, while ru_maxrss keeps the peak of the parent it was
+    forked from.
+
+    Returns:
+        tuple: (self, children) in MB, or (None, None) where unavailable
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    own = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return round(own, 1), round(children, 1)
+
+
+def percentiles(latencies):
+    """
+    Summarize latencies in milliseconds.
+
+    Args:
+        latencies (list): Durations in seconds
+
+    Returns:
+        dict: Mean, p50, p90, p95, p99 and max in milliseconds
+    """
+    values = np.array(latencies) * 1000
+    summary = {"mean": float(values.mean())}
+    for p in (50, 90, 95, 99):
+        summary[f"p{p}"] = float(np.percentile(values, p))
+    summary["max"] = float(values.max())
+    return {key: round(value, 3) for key, value in summary.items()}
+
+
+def bench_convert(corpus, work_folder, args):
+    """Convert each file to JPEG with convert_to_jpeg."""
+    from shutterstock_tagger.convert_images import convert_to_jpeg
+
+    paths = list_files(corpus)
+    latencies = []
+    for path in paths:
+        output = os.path.join(work_folder, os.path.basename(path) + ".jpeg")
+        latencies.append(timed(convert_to_jpeg, path, output))
+    return latencies, "image", len(paths), total_bytes(paths)
+
+
+def bench_is_valid_jpeg(corpus, work_folder, args):
+    """Check each file's size with is_valid_jpeg, which opens it with Pillow."""
+    from shutterstock_tagger.clean_files import is_valid_jpeg
+
+    paths = list_files(corpus)
+    latencies = [timed(is_valid_jpeg, path) for path in paths]
+    return latencies, "image", len(paths), total_bytes(paths)
+
+
+def bench_check_image(corpus, work_folder, args):
+    """Check each file with check_image, which reads only the JPEG header."""
+    from shutterstock_tagger.clean_files import check_image
+
+    paths = list_files(corpus)
+    latencies = [timed(check_image, path, os.path.getsize(path)) for path in paths]
+    return latencies, "image", len(paths), total_bytes(paths)
+
+
+def bench_proxy(corpus, work_folder, args):
+    """Decode, downscale and re-encode each file as a JPEG proxy with make_proxy."""
+    from shutterstock_tagger.bedrock_client import DEFAULT_MAX_EDGE, make_proxy
+
+    paths = list_files(corpus)
+    latencies = [timed(make_proxy, path, DEFAULT_MAX_EDGE) for path in paths]
+    return latencies, "image", len(paths), total_bytes(paths)
+
+
+def bench_encode(corpus, work_folder, args):
+    """Build the base64 request proxy of each file with encode_image."""
+    from shutterstock_tagger.bedrock_client import DEFAULT_MAX_EDGE, encode_image
+
+    paths = list_files(corpus)
+    latencies = [timed(encode_image, path, DEFAULT_MAX_EDGE) for path in paths]
+    return latencies, "image", len(paths), total_bytes(paths)
+
+
+def bench_organize(corpus, work_folder, args):
+    """Organize the corpus into result folders with move_files, once per repeat."""
+    from shutterstock_tagger.bedrock_client import write_response
+    from shutterstock_tagger.file_organizer import move_files
+
+    paths = list_files(corpus)
+    label_folder = os.path.join(work_folder, "2_binary_output")
+    os.makedirs(label_folder)
+    likelihoods = ["HIGH", "MEDIUM", "LOW"]
+    for index, path in enumerate(paths):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        write_response(
+            os.path.join(label_folder, f"{stem}_binary_response.txt"),
+            f"Suitable for Upload: YES\nLikelihood of Acceptance: {likelihoods[index % 3]}",
+        )
+
+    latencies = []
+    for repeat in range(args.repeat):
+        dest_folder = os.path.join(work_folder, f"3_copied_dest_{repeat}")
+        latencies.append(timed(move_files, corpus, label_folder, dest_folder, args.link_mode))
+    return latencies, "run", len(paths) * args.repeat, total_bytes(paths) * args.repeat
+
+
+def bench_parse(corpus, work_folder, args):
+    """Parse tag responses, as stored in response files, with extract_content_sections."""
+    from shutterstock_tagger.result_analyzer import extract_content_sections
+
+    texts = [json.dumps(TAG_RESPONSE.replace("quiet", f"quiet {index}")) for index in range(1000)]
+    latencies = [timed(extract_content_sections, text) for text in texts]
+    return latencies, "response", len(texts), sum(len(text) for text in texts)
+
+
+def run_analyze(work_folder, args, workers, processes, store=None):
+    """Write --responses tag responses to files or a store and analyze them, once per repeat."""
+    from shutterstock_tagger.result_analyzer import analyze_output_files
+
+    response_folder = os.path.join(work_folder, "5_tag_output")
+    os.makedirs(response_folder)
+    size = 0
+    for index in range(args.responses):
+        response = TAG_RESPONSE.replace("quiet", f"quiet {index}")
+        if store is not None:
+            store.put(f"IMG_{index:06d}.jpeg", "tag", response)
+        else:
+            with open(os.path.join(response_folder, f"IMG_{index:06d}_response.txt"), "w") as f:
+                json.dump(response, f)
+        size += len(json.dumps(response))
+    if store is not None:
+        store.flush()
+
+    csv_file = os.path.join(work_folder, "6_image_tags.csv")
+    latencies = [
+        timed(
+            analyze_output_files, response_folder, csv_file, False, workers, processes, None, store
+        )
+        for _ in range(args.repeat)
+    ]
+    details = {"workers": workers, "processes": processes, "store": store is not None}
+    return latencies, "run", args.responses * args.repeat, size * args.repeat, details
+
+
+def bench_analyze(corpus, work_folder, args):
+    """Read and parse response files into the tag CSV with analyze_output_files, serially."""
+    return run_analyze(work_folder, args, 1, 1)
+
+
+def bench_analyze_parallel(corpus, work_folder, args):
+    """Read response files in threads and parse them in processes with analyze_output_files."""
+    return run_analyze(work_folder, args, 16, os.cpu_count() or 1)
+
+
+def bench_analyze_store(corpus, work_folder, args):
+    """Read tag responses from a response store and parse them with analyze_output_files."""
+    from shutterstock_tagger.response_store import ResponseStore
+
+    store = ResponseStore(os.path.join(work_folder, "responses.sqlite"))
+    try:
+        return run_analyze(work_folder, args, 1, 1, store)
+    finally:
+        store.close()
+
+
+def bench_split_batches(corpus, work_folder, args):
+    """Split the corpus into upload batches with split_batches, once per repeat."""
+    from shutterstock_tagger.batch_splitter import split_batches
+    from shutterstock_tagger.result_analyzer import CSV_COLUMNS, make_row
+
+    paths = list_files(corpus)
+    csv_file = os.path.join(work_folder, "6_image_tags.csv")
+    rows = [make_row(os.path.basename(path), json.dumps(TAG_RESPONSE)) for path in paths]
+    with open(csv_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS, lineterminator=os.linesep)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    latencies = []
+    for repeat in range(args.repeat):
+        output_folder = os.path.join(work_folder, f"7_batch_output_{repeat}")
+        latencies.append(
+            timed(
+                split_batches,
+                corpus,
+                csv_file,
+                output_folder,
+                batch_size=max(1, len(paths) // 4),
+                link_mode=args.link_mode,
+            )
+        )
+    return latencies, "run", len(paths) * args.repeat, total_bytes(paths) * args.repeat
+
+
+def run_workflow(corpora, work_folder, args, stream):
+    """Run the workflow on all corpora against the mock backend, once per repeat."""
+    from shutterstock_tagger import binary_classifier, tag_generator, workflow
+    from shutterstock_tagger.mock_backend import MockBackend
+
+    config_folder = os.path.join(work_folder, "config")
+    os.makedirs(config_folder)
+    for name, text in BENCH_PROMPTS.items():
+        with open(os.path.join(config_folder, name), "w") as f:
+            f.write(text)
+    binary_classifier.CONFIG_DIR = tag_generator.CONFIG_DIR = config_folder
+
+    paths = [path for corpus in corpora for path in list_files(corpus)]
+    latencies = []
+    steps = {}
+    for repeat in range(args.repeat):
+        base_folder = os.path.join(work_folder, f"shoot_{repeat}")
+        raw_folder = os.path.join(base_folder, "1_raw_export")
+        os.makedirs(raw_folder)
+        for path in paths:
+            corpus_name = os.path.basename(os.path.dirname(path))
+            shutil.copy(path, os.path.join(raw_folder, f"{corpus_name}_{os.path.basename(path)}"))
+
+        backend = MockBackend(
+            latency=args.mock_latency, throttle_rate=args.mock_throttle_rate, seed=repeat
+        )
+        # The folder cleanup asks for confirmation on stdin
+        sys.stdin = io.StringIO("yes\n" * 100)
+        start = time.perf_counter()
+        results = workflow.process_images(
+            base_folder,
+            concurrency=args.concurrency,
+            link_mode=args.link_mode,
+            stream=stream,
+            backend=backend,
+            cache=None,
+        )
+        latencies.append(time.perf_counter() - start)
+        for result in results:
+            steps.setdefault(result.name, []).append(result.duration)
+    details = {
+        "step_seconds": {name: round(float(np.mean(values)), 4) for name, values in steps.items()}
+    }
+    return latencies, "run", len(paths) * args.repeat, total_bytes(paths) * args.repeat, details
+
+
+def bench_workflow(corpora, work_folder, args):
+    """Run the step by step workflow on all corpora against the mock backend."""
+    return run_workflow(corpora, work_folder, args, stream=False)
+
+
+def bench_workflow_stream(corpora, work_folder, args):
+    """Run the streaming workflow on all corpora against the mock backend."""
+    return run_workflow(corpora, work_folder, args, stream=True)
+
+
+STAGES = {
+    "convert": bench_convert,
+    "is_valid_jpeg": bench_is_valid_jpeg,
+    "check_image": bench_check_image,
+    "proxy": bench_proxy,
+    "encode": bench_encode,
+    "organize": bench_organize,
+    "parse": bench_parse,
+    "analyze": bench_analyze,
+    "analyze_parallel": bench_analyze_parallel,
+    "analyze_store": bench_analyze_store,
+    "split_batches": bench_split_batches,
+    "workflow": bench_workflow,
+    "workflow_stream": bench_workflow_stream,
+}
+
+
+def run_stage(stage, corpus, args):
+    """
+    Run one stage on one corpus and summarize it. Runs in a fresh process.
+
+    Args:
+        stage (str): Name of the stage
+        corpus (str or list): Corpus folder, or a list of folders for the workflow stages
+        args (argparse.Namespace): Benchmark options
+
+    Returns:
+        dict: Throughput, latency percentiles and peak RSS of the stage
+    """
+    work_folder = tempfile.mkdtemp(prefix=f"bench_{stage}_")
+    try:
+        # Stage output goes to the void so printing does not skew the timings
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(
+            devnull
+        ), contextlib.redirect_stderr(devnull):
+            start = time.perf_counter()
+            latencies, unit, images, size, *details = STAGES[stage](corpus, work_folder, args)
+            elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    busy = sum(latencies)
+    own_rss, children_rss = peak_rss_mb()
+    summary = {
+        "items": images,
+        "latency_unit": unit,
+        "seconds": round(busy, 4),
+        "wall_seconds": round(elapsed, 4),
+        "items_per_s": round(images / busy, 3) if busy else None,
+        "mb_per_s": round(size / (1024 * 1024) / busy, 3) if busy else None,
+        "input_mb": round(size / (1024 * 1024), 3),
+        "latency_ms": percentiles(latencies),
+        "peak_rss_mb": own_rss,
+        "peak_rss_children_mb": children_rss,
+    }
+    if details:
+        summary.update(details[0])
+    return summary
+
+
+def build_corpora(root, args):
+    """
+    Generate the corpora of every format and size.
+
+    Runs in a separate process, so the memory used for generating the
+    images does not count towards the peak RSS of the stages.
+
+    Args:
+        root (str): Folder to generate the corpora in
+        args (argparse.Namespace): Benchmark options
+
+    Returns:
+        dict: Mapping of corpus name (e.g. "heic_12mp") to its folder
+    """
+    corpora = {}
+    for image_format in args.formats:
+        for megapixels in args.megapixels:
+            name = f"{image_format}_{megapixels:g}mp"
+            folder = os.path.join(root, name)
+            os.makedirs(folder)
+            print(f"Generating {args.count} {image_format.upper()} files of {megapixels:g} MP...")
+            make_corpus(folder, args.count, megapixels, image_format, seed=args.seed)
+            corpora[name] = folder
+    return corpora
+
+
+def get_git_commit():
+    """Return the commit of the working tree, or None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    """
+    Print a table of the results.
+
+    Args:
+        results (dict): Mapping of "stage/corpus" to stage summary
+        baseline (dict, optional): Results of an earlier run to compare with
+    """
+    print(
+        f"\n{'stage/corpus':<34} {'items/s':>10} {'MB/s':>9} {'p50 ms':>9} "
+        f"{'p99 ms':>9} {'RSS MB':>8}" + ("  vs baseline" if baseline else "")
+    )
+    for key, summary in results.items():
+        latency = summary["latency_ms"]
+        line = (
+            f"{key:<34} {summary['items_per_s'] or 0:>10.2f} {summary['mb_per_s'] or 0:>9.2f} "
+            f"{latency['p50']:>9.2f} {latency['p99']:>9.2f} {summary['peak_rss_mb'] or 0:>8.1f}"
+        )
+        previous = (baseline or {}).get(key)
+        if previous and previous.get("items_per_s") and summary["items_per_s"]:
+            line += f"  {summary['items_per_s'] / previous['items_per_s']:6.2f}x"
+        print(line)
+
+
+def main():
+    """Main entry point for the pipeline benchmark suite."""
+    parser = argparse.ArgumentParser(description="Benchmark the workflow stages")
+    parser.add_argument("--count", type=int, default=8, help="Images per format and size")
+    parser.add_argument(
+        "--megapixels", type=float, nargs="+", default=[6, 12], help="Image sizes in megapixels"
+    )
+    parser.add_argument(
+        "--formats", nargs="+", choices=FORMATS, default=FORMATS, help="Corpus formats"
+    )
+    parser.add_argument(
+        "--stages", nargs="+", choices=list(STAGES), default=list(STAGES), help="Stages to run"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of the whole-run stages")
+    parser.add_argument(
+        "--link_mode",
+        choices=["hardlink", "reflink", "copy"],
+        default="hardlink",
+        help="How organize, split_batches and the workflow place images",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Concurrent requests in the workflow stages"
+    )
+    parser.add_argument(
+        "--mock_latency",
+        default="lognormal:0.05,0.3",
+        help="Latency distribution of the mock backend (see mock_backend.py)",
+    )
+    parser.add_argument(
+        "--mock_throttle_rate", type=float, default=0.0, help="Share of throttled mock requests"
+    )
+    parser.add_argument(
+        "--responses", type=int, default=5000, help="Response files of the analyze stages"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpora")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    corpus_root = tempfile.mkdtemp(prefix="bench_corpus_")
+    results = {}
+    try:
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            corpora = executor.submit(build_corpora, corpus_root, args).result()
+        for stage in args.stages:
+            formats = STAGE_FORMATS[stage]
+            if not formats:
+                jobs = {stage: None}
+            elif stage.startswith("workflow"):
+                jobs = {f"{stage}/all": [corpora[name] for name in corpora]}
+            else:
+                jobs = {
+                    f"{stage}/{name}": folder
+                    for name, folder in corpora.items()
+                    if name.split("_")[0] in formats
+                }
+            for key, corpus in jobs.items():
+                print(f"Running {key}...")
+                # A fresh process per stage, so peak RSS is measured per stage
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                    results[key] = executor.submit(run_stage, stage, corpus, args).result()
+    finally:
+        shutil.rmtree(corpus_root)
+
+    print_results(results, baseline)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": get_git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "options": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark for the memory used to build Bedrock request bodies.
+
+Compares the previous request path (read the file, base64 encode it into a
+str, embed it in a request dict and json.dumps it, which botocore then
+encodes to bytes) with build_request_body, which base64 encodes a memory
+map or the in-memory proxy straight into a pre-sized body. Peak memory is
+measured with tracemalloc, so it covers Python allocations only; pages of
+memory-mapped files belong to the page cache and are not counted.
+
+"held" is what an in-flight request keeps referenced while it waits for
+Bedrock and retries, which is what adds up under --concurrency.
+
+Usage:
+    python benchmarks/bench_request_memory.py --megapixels 12 24 --concurrency 8
+"""
+
+import argparse
+import base64
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from bench_convert import make_corpus
+
+from shutterstock_tagger.bedrock_client import (
+    DEFAULT_MAX_EDGE,
+    build_request,
+    build_request_body,
+    open_image_data,
+    prepare_image,
+)
+
+SYSTEM_PROMPT = "You are an expert stock photographer."
+PROMPT = "Give a title, keywords and a category for this image."
+
+
+def previous_request(image_path, max_edge):
+    """
+    Build a request body the way call_bedrock_api used to.
+
+    Returns:
+        tuple: Objects an in-flight request kept referenced
+    """
+    if max_edge:
+        binary_data = prepare_image(image_path, max_edge)
+    else:
+        with open(image_path, "rb") as image_file:
+            binary_data = image_file.read()
+    image_base64 = base64.b64encode(binary_data).decode("utf-8")
+    body = json.dumps(build_request(image_base64, SYSTEM_PROMPT, PROMPT))
+    # botocore encodes str bodies before sending them
+    return image_base64, body, body.encode("utf-8")
+
+
+def current_request(image_path, max_edge):
+    """
+    Build a request body with build_request_body.
+
+    Returns:
+        tuple: Objects an in-flight request keeps referenced
+    """
+    with open_image_data(image_path, max_edge) as image_data:
+        return (build_request_body(image_data, SYSTEM_PROMPT, PROMPT),)
+
+
+def measure(build, image_path, max_edge, concurrency):
+    """
+    Measure building one request, and holding ``concurrency`` of them.
+
+    Args:
+        build (callable): previous_request or current_request
+        image_path (str): Image to send
+        max_edge (int): Longest edge of the proxy, 0 for the original file
+        concurrency (int): Number of in-flight requests to hold
+
+    Returns:
+        dict: Peak and held MB of one request, peak MB of all of them and
+            milliseconds per request
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    held = build(image_path, max_edge)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    in_flight = [held] + [build(image_path, max_edge) for _ in range(concurrency - 1)]
+    _, peak_all = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del in_flight
+    return {
+        "peak_mb": peak / 1e6,
+        "held_mb": current / 1e6,
+        "peak_in_flight_mb": peak_all / 1e6,
+        "ms": elapsed * 1000,
+    }
+
+
+def main():
+    """Main entry point for the request memory benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark request body memory")
+    parser.add_argument(
+        "--megapixels", type=float, nargs="+", default=[12, 24], help="Image sizes to test"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Number of in-flight requests to hold"
+    )
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        print(
+            f"{'image':<16}{'sent':<10}{'path':<10}{'peak MB':>10}{'held MB':>10}"
+            f"{f'{args.concurrency} in flight':>14}{'ms':>9}"
+        )
+        for megapixels in args.megapixels:
+            image_path = make_corpus(
+                folder, 1, megapixels, "jpeg", seed=int(megapixels)
+            )[0]
+            image_mb = os.path.getsize(image_path) / 1e6
+            label = f"{megapixels:g} MP {image_mb:.1f} MB"
+            for max_edge, sent in [(0, "original"), (DEFAULT_MAX_EDGE, "proxy")]:
+                for name, build in [("previous", previous_request), ("current", current_request)]:
+                    result = measure(build, image_path, max_edge, args.concurrency)
+                    print(
+                        f"{label:<16}{sent:<10}{name:<10}{result['peak_mb']:>10.1f}"
+                        f"{result['held_mb']:>10.1f}{result['peak_in_flight_mb']:>14.1f}"
+                        f"{result['ms']:>9.1f}"
+                    )
+            os.remove(image_path)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -34,7 +34,6 @@ setup(
     python_requires=">=3.8",
     install_requires=[
         "boto3>=1.26.0",
-        "pandas>=1.5.0",
         "Pillow>=9.0.0",
         "pillow-heif>=0.10.0",
         "tqdm>=4.64.0",
@@ -48,6 +47,12 @@ setup(
             "pytest>=7.2.0",
             "pytest-cov>=4.0.0",
         ],
+        "json": [
+            "orjson>=3.6.0",
+        ],
+        "bench": [
+            "numpy>=1.21.0",
+        ],
     },
     entry_points={
         "console_scripts": [
@@ -8,19 +8,39 @@ __version__ = "1.0.0"
 __author__ = "Shutterstock Image Tagger Contributors"
 __license__ = "MIT"
 
-from .bedrock_client import (
-    call_bedrock_api,
-    encode_image,
-    read_prompt,
-    get_aws_region,
-    get_bedrock_model_id,
-)
+# Attributes loaded from their module on first access (PEP 562), so that
+# importing the package, or running one of its modules, does not import
+# every dependency up front
+_LAZY_ATTRIBUTES = {
+    "call_bedrock_api": "bedrock_client",
+    "encode_image": "bedrock_client",
+    "read_prompt": "bedrock_client",
+    "get_aws_region": "bedrock_client",
+    "get_bedrock_client": "bedrock_client",
+    "get_bedrock_model_id": "bedrock_client",
+}
 
 __all__ = [
     "call_bedrock_api",
     "encode_image",
     "read_prompt",
     "get_aws_region",
+    "get_bedrock_client",
     "get_bedrock_model_id",
 ]
 
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+
+    value = getattr(import_module(f".{module_name}", __name__), name)
+    # Cache the attribute so __getattr__ is not called for it again
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
@@ -0,0 +1,573 @@
+"""
+Batch inference module.
+
+Sends images to Bedrock as batch inference jobs instead of one on-demand
+request per image. Requests are written as JSONL records, submitted as
+jobs, polled until the jobs finish, and the output records are fanned out
+into the usual response files. Jobs are run by a backend: Bedrock with S3
+for real shoots, or a local folder for testing the flow without AWS.
+"""
+
+import os
+import json
+import time
+import shutil
+import threading
+from urllib.parse import urlparse
+from .bedrock_client import (
+    INFERENCE_PARAMS,
+    build_request_body,
+    get_aws_profile,
+    get_aws_region,
+    get_bedrock_model_id,
+    get_usage,
+    is_readable,
+    open_image_data,
+    parse_response,
+    write_response,
+)
+from .response_cache import hash_file, make_cache_key
+from .response_store import hash_prompt
+from .structured_output import SchemaError
+
+
+# Jobs submitted by a run, kept in the output folder so an interrupted run
+# resumes polling them instead of submitting the images again
+BATCH_STATE_FILE = ".batch_jobs.json"
+
+# Bedrock job statuses mapped to "running", "completed" or "failed"
+BEDROCK_JOB_STATUS = {
+    "Completed": "completed",
+    "PartiallyCompleted": "completed",
+    "Failed": "failed",
+    "Stopped": "failed",
+    "Expired": "failed",
+}
+
+
+class BatchBackend:
+    """
+    Interface of a batch inference service.
+
+    A job runs over a JSONL file of Bedrock batch records
+    ({"recordId": ..., "modelInput": ...}) and produces a JSONL file with a
+    record per input record, holding either "modelOutput" or "error".
+
+    Attributes:
+        model_id (str): Identifier of the model, part of the response cache key.
+            None uses the configured Bedrock model
+        min_records (int): Fewest records a job may have
+        max_records (int): Most records a job may have
+        max_bytes (int): Largest input file a job may have
+    """
+
+    model_id = None
+    min_records = 1
+    max_records = 50000
+    max_bytes = 1024 * 1024 * 1024
+
+    def submit(self, job_name, input_file):
+        """
+        Submit a job.
+
+        Args:
+            job_name (str): Unique name of the job
+            input_file (str): Path of the JSONL input file
+
+        Returns:
+            str: Identifier of the job
+        """
+        raise NotImplementedError
+
+    def status(self, job_id):
+        """
+        Get the status of a job.
+
+        Args:
+            job_id (str): Identifier returned by submit
+
+        Returns:
+            tuple: (status, message), where status is "running", "completed" or "failed"
+        """
+        raise NotImplementedError
+
+    def download(self, job_id, output_file):
+        """
+        Save the output records of a completed job.
+
+        Args:
+            job_id (str): Identifier returned by submit
+            output_file (str): Path of the JSONL file to write
+        """
+        raise NotImplementedError
+
+
+class BedrockBatchBackend(BatchBackend):
+    """
+    Runs jobs with Bedrock batch inference, staging files in S3.
+
+    Bedrock reads the input from and writes the output to the S3 location,
+    with a service role that grants it access to the bucket.
+    """
+
+    min_records = 100
+
+    def __init__(self, s3_uri, role_arn, region=None, model_id=None, profile=None):
+        """
+        Create a backend.
+
+        Args:
+            s3_uri (str): S3 location for job files, e.g. s3://bucket/prefix
+            role_arn (str): ARN of the service role Bedrock assumes to access S3
+            region (str, optional): AWS region. Defaults to environment variable or us-east-1
+            model_id (str, optional): Model ID. Defaults to environment variable or default model
+            profile (str, optional): AWS profile. Defaults to the AWS_PROFILE environment variable
+        """
+        import boto3
+
+        if not s3_uri or not role_arn:
+            raise ValueError(
+                "Batch inference needs an S3 location and a service role "
+                "(--batch_s3_uri and --batch_role_arn)"
+            )
+        parsed = urlparse(s3_uri)
+        if parsed.scheme != "s3":
+            raise ValueError(f"Not an S3 URI: {s3_uri}")
+        self.bucket = parsed.netloc
+        self.prefix = parsed.path.strip("/")
+        self.role_arn = role_arn
+        self.model_id = model_id or get_bedrock_model_id()
+        session = boto3.session.Session(
+            profile_name=profile or get_aws_profile(), region_name=region or get_aws_region()
+        )
+        self._bedrock = session.client("bedrock")
+        self._s3 = session.client("s3")
+
+    def _key(self, *parts):
+        return "/".join(part for part in (self.prefix, *parts) if part)
+
+    def submit(self, job_name, input_file):
+        input_key = self._key(job_name, "input", os.path.basename(input_file))
+        self._s3.upload_file(input_file, self.bucket, input_key)
+        response = self._bedrock.create_model_invocation_job(
+            jobName=job_name,
+            roleArn=self.role_arn,
+            modelId=self.model_id,
+            inputDataConfig={
+                "s3InputDataConfig": {
+                    "s3Uri": f"s3://{self.bucket}/{input_key}",
+                    "s3InputFormat": "JSONL",
+                }
+            },
+            outputDataConfig={
+                "s3OutputDataConfig": {
+                    "s3Uri": f"s3://{self.bucket}/{self._key(job_name, 'output')}/"
+                }
+            },
+        )
+        return response["jobArn"]
+
+    def status(self, job_id):
+        job = self._bedrock.get_model_invocation_job(jobIdentifier=job_id)
+        return BEDROCK_JOB_STATUS.get(job["status"], "running"), job.get("message")
+
+    def download(self, job_id, output_file):
+        job = self._bedrock.get_model_invocation_job(jobIdentifier=job_id)
+        input_uri = urlparse(job["inputDataConfig"]["s3InputDataConfig"]["s3Uri"])
+        output_uri = urlparse(job["outputDataConfig"]["s3OutputDataConfig"]["s3Uri"])
+        # Bedrock writes <output prefix>/<job id>/<input file name>.out
+        output_key = "/".join(
+            part
+            for part in (
+                output_uri.path.strip("/"),
+                job_id.rsplit("/", 1)[-1],
+                os.path.basename(input_uri.path) + ".out",
+            )
+            if part
+        )
+        self._s3.download_file(output_uri.netloc, output_key, output_file)
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Runs jobs in a local folder, for testing the batch flow without AWS.
+
+    Each job is a subfolder holding its input file. A job completes on the
+    first status check at least ``duration`` seconds after it was submitted,
+    when each record is answered by ``respond``.
+    """
+
+    def __init__(self, folder, respond, duration=0.0, min_records=1, model_id="local"):
+        """
+        Create a backend.
+
+        Args:
+            folder (str): Folder holding the jobs
+            respond (callable): Called with a record's model input, returns its model
+                output, e.g. MockBackend.answer. Exceptions become error records
+            duration (float, optional): Seconds a job stays running
+            min_records (int, optional): Fewest records a job may have
+            model_id (str, optional): Identifier of the responder in the response cache
+        """
+        self.folder = folder
+        self.model_id = model_id
+        self.respond = respond
+        self.duration = duration
+        self.min_records = min_records
+        os.makedirs(folder, exist_ok=True)
+
+    def _job_folder(self, job_id):
+        return os.path.join(self.folder, job_id)
+
+    def submit(self, job_name, input_file):
+        job_folder = self._job_folder(job_name)
+        os.makedirs(job_folder)
+        shutil.copyfile(input_file, os.path.join(job_folder, "input.jsonl"))
+        write_response(os.path.join(job_folder, "job.json"), {"submitted": time.time()})
+        return job_name
+
+    def status(self, job_id):
+        job_folder = self._job_folder(job_id)
+        if not os.path.isdir(job_folder):
+            return "failed", f"Unknown job {job_id}"
+        output_file = os.path.join(job_folder, "input.jsonl.out")
+        if os.path.exists(output_file):
+            return "completed", None
+        with open(os.path.join(job_folder, "job.json")) as f:
+            submitted = json.load(f)["submitted"]
+        if time.time() - submitted < self.duration:
+            return "running", None
+
+        temp_file = output_file + ".tmp"
+        with open(os.path.join(job_folder, "input.jsonl")) as src, open(temp_file, "w") as dst:
+            for line in src:
+                record = json.loads(line)
+                output = {"recordId": record["recordId"], "modelInput": record["modelInput"]}
+                try:
+                    output["modelOutput"] = self.respond(record["modelInput"])
+                except Exception as e:
+                    output["error"] = {"errorCode": 500, "errorMessage": str(e)}
+                dst.write(json.dumps(output) + "\n")
+        os.replace(temp_file, output_file)
+        return "completed", None
+
+    def download(self, job_id, output_file):
+        shutil.copyfile(os.path.join(self._job_folder(job_id), "input.jsonl.out"), output_file)
+
+
+def load_jobs(output_folder):
+    """
+    Load the jobs that an earlier run submitted but did not collect.
+
+    Args:
+        output_folder (str): Folder of the response files
+
+    Returns:
+        list: Job entries with id, name and records
+    """
+    state_file = os.path.join(output_folder, BATCH_STATE_FILE)
+    if not os.path.exists(state_file):
+        return []
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def save_jobs(output_folder, jobs):
+    """
+    Save the jobs that are not collected yet, removing the file when none are left.
+
+    Args:
+        output_folder (str): Folder of the response files
+        jobs (list): Job entries with id, name and records
+    """
+    state_file = os.path.join(output_folder, BATCH_STATE_FILE)
+    if jobs:
+        write_response(state_file, jobs)
+    elif os.path.exists(state_file):
+        os.remove(state_file)
+
+
+def run_batch_jobs(
+    backend,
+    pending,
+    image_folder,
+    output_folder,
+    system_prompt,
+    prompt,
+    results,
+    skip_existing=False,
+    max_edge=None,
+    quality=None,
+    save_response=write_response,
+    cache=None,
+    ledger=None,
+    stage="bedrock",
+    poll_interval=60,
+    schema=None,
+    store=None,
+):
+    """
+    Process images with batch inference jobs.
+
+    Jobs left by an interrupted run are collected first; their images are
+    not submitted again. Images with a cached or up-to-date response are
+    handled without a job. If fewer images remain than a job needs, they
+    are returned to be processed on demand, as are images whose structured
+    answer does not match the schema, so they are asked again.
+
+    Args:
+        backend (BatchBackend): Service running the jobs
+        pending (list): (image filename, response file) pairs to process
+        image_folder (str): Folder containing the images
+        output_folder (str): Folder of the response files
+        system_prompt (str): System prompt for the AI
+        prompt (str): User prompt for the AI
+        results (dict): Mapping of image filename to (status, message) to update
+        skip_existing (bool, optional): Skip images whose response is up to date in the ledger
+        max_edge (int, optional): Longest edge of the image sent to Bedrock. 0 sends the original
+        quality (int, optional): JPEG quality of the downscaled image
+        save_response (callable, optional): Called with (output_file, response) to
+            save each response. Defaults to write_response
+        cache (ResponseCache, optional): Cache of previous responses
+        ledger (Ledger, optional): Records the result and content hash of each image
+        stage (str, optional): Name of the stage in the ledger
+        poll_interval (float, optional): Seconds between job status checks
+        schema (ResponseSchema, optional): Ask for JSON answers matching this schema
+            and save the validated objects
+        store (ResponseStore, optional): Save the responses in this store instead of
+            writing response files
+
+    Returns:
+        list: (image filename, response file) pairs left to process on demand
+    """
+    error_file = os.path.join(os.path.dirname(output_folder), "error_log.txt")
+    error_lock = threading.Lock()
+    if schema is not None:
+        prompt = schema.prompt(prompt)
+    prompt_hash = hash_prompt(system_prompt, prompt) if store is not None else None
+    invalid = []
+
+    def finish(entry, status, response=None, error=None, usage=(None, None)):
+        image_file, output_file, image_hash, cache_key = entry
+        image_path = os.path.join(image_folder, image_file)
+        if status == "processed":
+            record = {}
+            if store is not None:
+                record = {
+                    "store": store,
+                    "image": image_file,
+                    "stage": stage,
+                    "prompt_hash": prompt_hash,
+                    "input_tokens": usage[0],
+                    "output_tokens": usage[1],
+                }
+            data = response
+            if schema is not None:
+                try:
+                    data = schema.parse(response)
+                except SchemaError as e:
+                    print(f"Invalid answer for {image_file} ({e}), asking again on demand")
+                    invalid.append((image_file, output_file))
+                    return
+            try:
+                save_response(output_file, data, **record)
+            except Exception as e:
+                finish(entry, "failed", error=e)
+                return
+            if (
+                cache is not None
+                and cache_key is not None
+                and (schema is not None or is_readable(response, stage))
+            ):
+                cache.put(cache_key, response)
+            if ledger is not None:
+                ledger.record(image_file, stage, "done", None, image_path, image_hash)
+            results[image_file] = ("processed", None)
+            return
+        err_msg = f"Error processing {image_file}: {error}"
+        print(err_msg)
+        with error_lock:
+            with open(error_file, "a") as ef:
+                ef.write(err_msg + "\n")
+        if ledger is not None:
+            ledger.record(image_file, stage, "failed", None, image_path, image_hash, str(error))
+        results[image_file] = ("failed", str(error))
+
+    jobs = load_jobs(output_folder)
+    if jobs:
+        print(f"Resuming {len(jobs)} batch jobs submitted by an earlier run")
+    submitted = {entry[0] for job in jobs for entry in job["records"].values()}
+
+    # Handle images that need no job
+    entries = []
+    for image_file, output_file in pending:
+        if image_file in submitted:
+            continue
+        image_path = os.path.join(image_folder, image_file)
+        image_hash = cache_key = None
+        try:
+            if ledger is not None:
+                up_to_date, image_hash = ledger.is_up_to_date(
+                    image_file, stage, image_path, output_file, store
+                )
+                if skip_existing and up_to_date:
+                    print(f"Skipping {image_file}, response already exists.")
+                    results[image_file] = ("skipped", None)
+                    continue
+            if cache is not None:
+                cache_key = make_cache_key(
+                    image_hash or hash_file(image_path),
+                    system_prompt,
+                    prompt,
+                    backend.model_id or get_bedrock_model_id(),
+                    INFERENCE_PARAMS,
+                    max_edge=max_edge,
+                    quality=quality,
+                )
+                response = cache.get(cache_key)
+                if response is not None:
+                    print(f"Using cached response for {image_path}")
+                    finish((image_file, output_file, image_hash, cache_key), "processed", response)
+                    continue
+        except Exception as e:
+            finish((image_file, output_file, image_hash, cache_key), "failed", error=e)
+            continue
+        entries.append([image_file, output_file, image_hash, cache_key])
+
+    # Jobs resumed from an earlier run are still waited for below
+    on_demand = []
+    if 0 < len(entries) < backend.min_records:
+        print(
+            f"Only {len(entries)} images to send, a batch job needs at least "
+            f"{backend.min_records}. Processing them on demand."
+        )
+        on_demand = [(entry[0], entry[1]) for entry in entries]
+        entries = []
+
+    # Write the records and submit a job whenever a file is full
+    job_prefix = f"{stage}-{time.strftime('%Y%m%d-%H%M%S')}"
+    input_file = None
+    records = {}
+    size = 0
+
+    def submit():
+        nonlocal input_file, records, size
+        input_file.close()
+        job_name = f"{job_prefix}-{len(jobs) + 1}"
+        try:
+            job_id = backend.submit(job_name, input_file.name)
+        except Exception as e:
+            for entry in records.values():
+                finish(entry, "failed", error=e)
+        else:
+            print(f"Submitted batch job {job_name} with {len(records)} images")
+            jobs.append({"id": job_id, "name": job_name, "records": records})
+            save_jobs(output_folder, jobs)
+        finally:
+            os.remove(input_file.name)
+        input_file = None
+        records = {}
+        size = 0
+
+    for index, entry in enumerate(entries):
+        image_file = entry[0]
+        image_path = os.path.join(image_folder, image_file)
+        try:
+            with open_image_data(image_path, max_edge, quality) as image_data:
+                body = build_request_body(image_data, system_prompt, prompt)
+        except Exception as e:
+            finish(entry, "failed", error=e)
+            continue
+        record_id = f"IMG{index:08d}"
+        # The request body is written as is rather than decoded into the record
+        prefix = json.dumps({"recordId": record_id, "modelInput": None})[:-len("null}")]
+        line = [prefix.encode(), body, b"}\n"]
+        line_size = sum(len(part) for part in line)
+        if input_file is not None and (
+            len(records) >= backend.max_records or size + line_size > backend.max_bytes
+        ):
+            submit()
+        if input_file is None:
+            input_file = open(
+                os.path.join(output_folder, f".{job_prefix}-{len(jobs) + 1}.jsonl"), "wb"
+            )
+        input_file.writelines(line)
+        records[record_id] = entry
+        size += line_size
+    if input_file is not None:
+        submit()
+
+    # Wait for the jobs and fan their output out into response files
+    while jobs:
+        for job in list(jobs):
+            try:
+                status, message = backend.status(job["id"])
+            except Exception as e:
+                print(f"Error checking batch job {job['name']}: {e}")
+                continue
+            if status == "running":
+                continue
+            if status == "completed":
+                try:
+                    collect_job(backend, job, output_folder, finish)
+                except Exception as e:
+                    # A finished job is not collected again; its images are retried on the next run
+                    print(f"Error collecting batch job {job['name']}: {e}")
+                    collected = set(results) | {image_file for image_file, _ in invalid}
+                    for entry in job["records"].values():
+                        if entry[0] not in collected:
+                            finish(entry, "failed", error=f"Batch job output not collected: {e}")
+            else:
+                print(f"Batch job {job['name']} failed: {message}")
+                for entry in job["records"].values():
+                    finish(entry, "failed", error=f"Batch job failed: {message}")
+            jobs.remove(job)
+            save_jobs(output_folder, jobs)
+        if jobs:
+            print(f"Waiting for {len(jobs)} batch jobs...")
+            time.sleep(poll_interval)
+
+    if ledger is not None:
+        ledger.flush()
+    return invalid + on_demand
+
+
+def collect_job(backend, job, output_folder, finish):
+    """
+    Download the output of a completed job and save a response per record.
+
+    Args:
+        backend (BatchBackend): Service that ran the job
+        job (dict): Job entry with id, name and records
+        output_folder (str): Folder of the response files
+        finish (callable): Called with (entry, status, response, error, usage) per record
+    """
+    output_file = os.path.join(output_folder, f".{job['name']}.jsonl.out")
+    backend.download(job["id"], output_file)
+    records = dict(job["records"])
+    try:
+        with open(output_file) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                entry = records.pop(record.get("recordId"), None)
+                if entry is None:
+                    continue
+                if "modelOutput" in record:
+                    try:
+                        response = parse_response(record["modelOutput"])
+                    except (KeyError, IndexError, TypeError) as e:
+                        finish(entry, "failed", error=f"Unexpected model output: {e}")
+                    else:
+                        usage = get_usage(record["modelOutput"])
+                        finish(entry, "processed", response, usage=usage)
+                else:
+                    error = record.get("error") or {}
+                    finish(entry, "failed", error=error.get("errorMessage", "No model output"))
+    finally:
+        os.remove(output_file)
+
+    for entry in records.values():
+        finish(entry, "failed", error="No output record in batch job")
+    print(f"Collected batch job {job['name']}")
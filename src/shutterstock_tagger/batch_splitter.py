@@ -4,12 +4,15 @@ Batch splitting module.
 Splits images and their metadata into batches of 100 for Shutterstock upload.
 """
 
+import io
 import os
 import sys
+import csv
 import shutil
 import argparse
-import pandas as pd
 from pathlib import Path
+from .file_linker import LINK_MODES, LinkStats, is_linked, link_file
+from .step_result import StepResult
 
 
 def create_parser():
@@ -32,87 +35,385 @@ def create_parser():
     parser.add_argument(
         "--batch_output_folder", help="Destination folder for batched outputs"
     )
+    parser.add_argument(
+        "--link_mode",
+        choices=LINK_MODES,
+        default="copy",
+        help="How images are placed in batch folders. Hard links share their content with "
+        "the source, so editing one edits the other. Falls back to copy when linking fails.",
+    )
     return parser
 
 
-def main():
-    """Main entry point for the batch splitter script."""
-    # Parse command line arguments
-    parser = create_parser()
-    args = parser.parse_args()
+def split_batches(input_folder, csv_file, output_folder, batch_size=100, link_mode="copy"):
+    """
+    Split images and their tag rows into batch folders.
+
+    Batches from an earlier run whose rows and images did not change are
+    left alone, so a re-run after adding or changing a few images only
+    rewrites the affected batches.
 
-    # Get paths from arguments
-    input_folder = Path(args.single_output_folder)
-    csv_file = Path(args.tag_files)
-    output_folder = Path(args.batch_output_folder)
+    Args:
+        input_folder (str): Folder containing all the images
+        csv_file (str): CSV file with filenames in its first column
+        output_folder (str): Destination folder for batched outputs
+        batch_size (int, optional): Number of images per batch
+        link_mode (str, optional): One of "hardlink", "reflink", "symlink" or "copy"
+
+    Returns:
+        dict: Number of files, batches and files not found in the input folder
+            and bytes linked instead of copied, or None if the inputs are invalid
+    """
+    input_folder = Path(input_folder)
+    csv_file = Path(csv_file)
+    output_folder = Path(output_folder)
 
     # Check if paths are valid
     if not input_folder.exists() or not input_folder.is_dir():
         print(
             f"Error: Input folder '{input_folder}' does not exist or is not a directory"
         )
-        sys.exit(1)
+        return None
 
     if not csv_file.exists() or not csv_file.is_file():
         print(f"Error: CSV file '{csv_file}' does not exist or is not a file")
-        sys.exit(1)
+        return None
 
     # Create output folder if it doesn't exist
     output_folder.mkdir(parents=True, exist_ok=True)
 
-    # Read CSV file using pandas
     try:
-        df = pd.read_csv(csv_file)
-        print(f"Read CSV with {len(df)} rows and columns: {', '.join(df.columns)}")
+        header, total_files = count_rows(csv_file)
+        print(f"Read CSV with {total_files} rows and columns: {', '.join(header)}")
     except Exception as e:
         print(f"Error reading CSV file: {e}")
-        sys.exit(1)
-
-    # Get the filename column (assuming it's the first column)
-    filename_col = df.columns[0]
+        return None
 
     # Create batches of 100 files
-    batch_size = 100
-    total_files = len(df)
     total_batches = (total_files + batch_size - 1) // batch_size  # Ceiling division
 
     print(f"Found {total_files} files to process. Will create {total_batches} batches.")
+    stats = LinkStats()
+    unchanged = 0
+    missing = 0
 
-    for batch_num in range(1, total_batches + 1):
+    for batch_num, batch_rows in enumerate(read_batches(csv_file, batch_size), 1):
         # Create batch folder
         batch_folder = output_folder / f"batch_{batch_num}"
         batch_folder.mkdir(exist_ok=True)
 
-        # Get rows for this batch
-        start_idx = (batch_num - 1) * batch_size
-        end_idx = min(batch_num * batch_size, total_files)
-        batch_df = df.iloc[start_idx:end_idx].copy()
+        # The filename is the first column
+        csv_text = format_csv(header, batch_rows)
+        filenames = [row[0] for row in batch_rows]
+
+        # Skip batches whose CSV and files are already up to date
+        csv_output_path = output_folder / f"batch_{batch_num}_tags.csv"
+        if is_batch_current(input_folder, batch_folder, csv_output_path, csv_text, filenames):
+            unchanged += 1
+            continue
 
         print(
-            f"Processing batch {batch_num}/{total_batches} with {len(batch_df)} files..."
+            f"Processing batch {batch_num}/{total_batches} with {len(batch_rows)} files..."
         )
 
         # Create CSV file for this batch
-        csv_output_path = output_folder / f"batch_{batch_num}_tags.csv"
-        batch_df.to_csv(csv_output_path, index=False)
+        with open(csv_output_path, "w", newline="") as f:
+            f.write(csv_text)
         print(f"Created CSV file {csv_output_path}")
 
-        # Copy files to batch folder
-        for filename in batch_df[filename_col]:
+        # Remove files that moved to another batch or were dropped
+        for stale_file in set(os.listdir(batch_folder)) - set(filenames):
+            os.remove(batch_folder / stale_file)
+
+        # Place files in batch folder
+        for filename in filenames:
             source_file = input_folder / filename
             if source_file.exists():
+                if is_linked(source_file, batch_folder / filename):
+                    continue
                 try:
-                    shutil.copy2(source_file, batch_folder)
+                    link_file(source_file, batch_folder / filename, link_mode, stats)
                 except Exception as e:
                     print(f"Error copying {filename}: {e}")
             else:
-                print(f"Warning: File {filename} not found in input folder")
+                print(f"Error: File {filename} not found in input folder")
+                missing += 1
 
         print(f"Completed batch {batch_num}")
 
-    print(f"All batches created successfully in {output_folder}")
+    # Remove batches left over from a run with more images
+    removed = remove_extra_batches(output_folder, total_batches)
+
+    if unchanged:
+        print(f"Skipped {unchanged} unchanged batches")
+    if removed:
+        print(f"Removed {removed} leftover batches")
+    if missing:
+        print(f"Batches created in {output_folder}, but {missing} files were not found")
+    else:
+        print(f"All batches created successfully in {output_folder}")
+    stats.print_summary()
+    return {
+        "files": total_files,
+        "batches": total_batches,
+        "unchanged_batches": unchanged,
+        "removed_batches": removed,
+        "missing": missing,
+        "bytes_saved": stats.bytes_saved,
+    }
+
+
+def iter_rows(csv_file):
+    """
+    Read the rows of a CSV file one at a time, skipping blank lines.
+
+    Args:
+        csv_file (Path): CSV file to read
+
+    Yields:
+        list: Header, then each row, as lists of strings
+    """
+    with open(csv_file, "r", newline="") as f:
+        for row in csv.reader(f):
+            if row:
+                yield row
+
+
+def count_rows(csv_file):
+    """
+    Read the header of a CSV file and count its rows without keeping them.
+
+    Args:
+        csv_file (Path): CSV file to read
+
+    Returns:
+        tuple: (header, number of rows)
+
+    Raises:
+        ValueError: If the file has no header
+    """
+    rows = iter_rows(csv_file)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("No columns to parse from file")
+    return header, sum(1 for _ in rows)
+
+
+def read_batches(csv_file, batch_size):
+    """
+    Read the rows of a CSV file in batches, holding one batch at a time.
+
+    Args:
+        csv_file (Path): CSV file to read
+        batch_size (int): Number of rows per batch
+
+    Yields:
+        list: Rows of each batch, without the header
+    """
+    rows = iter_rows(csv_file)
+    next(rows, None)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def format_csv(header, rows):
+    """
+    Format a header and rows as CSV text in the format of the tag CSV files.
+
+    Args:
+        header (list): Column names
+        rows (list): Rows as lists of strings
+
+    Returns:
+        str: CSV text with ``os.linesep`` line endings and minimal quoting
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator=os.linesep)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def is_batch_current(input_folder, batch_folder, csv_path, csv_text, filenames):
+    """
+    Check whether a batch from an earlier run already matches its new content.
+
+    Args:
+        input_folder (Path): Folder containing all the images
+        batch_folder (Path): Folder of the batch
+        csv_path (Path): Tag CSV file of the batch
+        csv_text (str): New content of the tag CSV file
+        filenames (list): Filenames of the images in the batch
+
+    Returns:
+        bool: True if the CSV file is unchanged and the folder holds exactly
+            the batch's images, placed from their current sources
+    """
+    if not csv_path.is_file():
+        return False
+    with open(csv_path, "r", newline="") as f:
+        if f.read() != csv_text:
+            return False
+    if sorted(os.listdir(batch_folder)) != sorted(filenames):
+        return False
+    return all(is_linked(input_folder / name, batch_folder / name) for name in filenames)
+
+
+def remove_extra_batches(output_folder, total_batches):
+    """
+    Remove batch folders and CSV files numbered above the current batch count.
+
+    Args:
+        output_folder (Path): Destination folder for batched outputs
+        total_batches (int): Number of batches of the current run
+
+    Returns:
+        int: Number of batches removed
+    """
+    removed = 0
+    for entry in os.listdir(output_folder):
+        name = entry[:-len("_tags.csv")] if entry.endswith("_tags.csv") else entry
+        number = name[len("batch_"):]
+        if not name.startswith("batch_") or not number.isdigit() or int(number) <= total_batches:
+            continue
+        path = output_folder / entry
+        if path.is_dir():
+            shutil.rmtree(path)
+            removed += 1
+        else:
+            path.unlink()
+    return removed
+
+
+class BatchWriter:
+    """
+    Fills batch folders and their tag CSV files one image at a time.
+
+    Used by the streaming workflow, where images become ready for upload one
+    by one. The CSV files are written in the same format as split_batches.
+    Not thread-safe; feed it from a single thread.
+    """
+
+    def __init__(self, output_folder, columns, batch_size=100, link_mode="copy"):
+        """
+        Create a writer starting at batch 1.
+
+        Args:
+            output_folder (str): Destination folder for batched outputs
+            columns (list): CSV column names
+            batch_size (int, optional): Number of images per batch
+            link_mode (str, optional): One of "hardlink", "reflink", "symlink" or "copy"
+        """
+        self.output_folder = Path(output_folder)
+        self.output_folder.mkdir(parents=True, exist_ok=True)
+        self.columns = columns
+        self.batch_size = batch_size
+        self.link_mode = link_mode
+        self.stats = LinkStats()
+        self.batches = 0
+        self.files = 0
+        self._batch_files = 0
+        self._csv = None
+        self._writer = None
+
+    def _start_batch(self):
+        self.batches += 1
+        self._batch_files = 0
+        (self.output_folder / f"batch_{self.batches}").mkdir(exist_ok=True)
+        csv_output_path = self.output_folder / f"batch_{self.batches}_tags.csv"
+        self._csv = open(csv_output_path, "w", newline="")
+        self._writer = csv.DictWriter(self._csv, fieldnames=self.columns, lineterminator=os.linesep)
+        self._writer.writeheader()
+
+    def _finish_batch(self):
+        self._csv.close()
+        self._csv = None
+        self._writer = None
+        return self.batches
+
+    def add(self, image_file, row):
+        """
+        Place an image in the current batch and append its tag row.
+
+        Args:
+            image_file (str): Path of the image
+            row (dict): CSV row of the image
+
+        Returns:
+            int: Number of the batch completed by this image, or None
+        """
+        if self._csv is None:
+            self._start_batch()
+        batch_folder = self.output_folder / f"batch_{self.batches}"
+        dest_file = batch_folder / os.path.basename(image_file)
+        link_file(image_file, dest_file, self.link_mode, self.stats)
+        self._writer.writerow(row)
+        self._csv.flush()
+        self.files += 1
+        self._batch_files += 1
+        if self._batch_files >= self.batch_size:
+            return self._finish_batch()
+        return None
+
+    def close(self):
+        """
+        Close the last, partially filled batch.
+
+        Returns:
+            int: Number of the batch closed, or None if no batch was open
+        """
+        if self._csv is None:
+            return None
+        return self._finish_batch()
+
+
+def run_step(input_folder, csv_file, output_folder, link_mode="copy"):
+    """
+    Run the batch splitting as a workflow step.
+
+    Args:
+        input_folder (str): Folder containing all the images
+        csv_file (str): CSV file with filenames in its first column
+        output_folder (str): Destination folder for batched outputs
+        link_mode (str, optional): One of "hardlink", "reflink", "symlink" or "copy"
+
+    Returns:
+        StepResult: Result with the number of files and batches
+    """
+    counts = split_batches(input_folder, csv_file, output_folder, link_mode=link_mode)
+    if counts is None:
+        return StepResult("batch_splitter", success=False, error="Invalid input folder or CSV file")
+    if counts["missing"]:
+        return StepResult(
+            "batch_splitter",
+            success=False,
+            counts=counts,
+            error=f"{counts['missing']} files in the CSV were not found in {input_folder}",
+        )
+    return StepResult("batch_splitter", counts=counts)
+
+
+def main():
+    """Main entry point for the batch splitter script."""
+    # Parse command line arguments
+    parser = create_parser()
+    args = parser.parse_args()
+
+    counts = split_batches(
+        args.single_output_folder,
+        args.tag_files,
+        args.batch_output_folder,
+        link_mode=args.link_mode,
+    )
+    if counts is None or counts["missing"]:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
     main()
-
@@ -6,11 +6,28 @@ Uses AWS Bedrock to determine if images are suitable for stock photography platf
 
 import os
 import argparse
+from functools import partial
 from pathlib import Path
-from .bedrock_client import read_prompt, process_images, get_aws_region
+from .step_result import StepResult
+from .bedrock_client import (
+    add_processing_arguments,
+    count_results,
+    get_processing_options,
+    read_prompt,
+    process_images,
+    get_aws_region,
+    write_response,
+)
+from .structured_output import CLASSIFY_FIELDS, COMBINED_FIELDS, TAG_FIELDS, ResponseSchema
 
 
-def process_binary_classification(image_folder, output_folder, system_prompt_file, prompt_file, region=None):
+# Prompt files live in the config directory at the repository root
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "config")
+
+
+def process_binary_classification(
+    image_folder, output_folder, system_prompt_file, prompt_file, region=None, **options
+):
     """
     Process images for binary classification (suitable/not suitable for upload).
     
@@ -20,84 +37,220 @@ def process_binary_classification(image_folder, output_folder, system_prompt_fil
         system_prompt_file (str): Path to system prompt file
         prompt_file (str): Path to prompt file
         region (str, optional): AWS region
+        **options: Keyword arguments passed to process_images, e.g. concurrency
+
+    Returns:
+        dict: Mapping of image filename to (status, message)
     """
     system_prompt = read_prompt(system_prompt_file)
     prompt = read_prompt(prompt_file)
-    
-    # Create output folder if it doesn't exist
-    os.makedirs(output_folder, exist_ok=True)
-    
-    # Process images and save results with _binary_response suffix
-    error_file = os.path.join(os.path.dirname(output_folder), "error_log.txt")
-    
-    from .bedrock_client import encode_image, call_bedrock_api
-    import json
-    
-    # Process each image in the folder
-    image_list = sorted(os.listdir(image_folder))
-    total_size = len(image_list)
-    print(f"Total images to process: {total_size}")
-
-    for index, image_file in enumerate(image_list):
-        # Show progress in percentage
-        if index % 10 == 0:
-            progress_percentage = (index + 1) / total_size * 100
-            print(f"Processing {index + 1}/{total_size} images ({progress_percentage:.2f}%)")
-
-        # Check if file is an image
-        if any(image_file.lower().endswith(ext) for ext in [".jpg", ".jpeg"]):
-            output_file = os.path.join(
-                output_folder, f"{Path(image_file).stem}_binary_response.txt"
-            )
-            if os.path.exists(output_file):
-                print(f"Skipping {image_file}, response already exists.")
-                continue
-                
-            image_path = os.path.join(image_folder, image_file)
-            print(f"Processing {image_path}...")
-
-            # Encode image
-            image_base64 = encode_image(image_path)
-
-            # Call Bedrock API
-            try:
-                response = call_bedrock_api(image_base64, system_prompt, prompt, region)
-            except Exception as e:
-                err_msg = f"Error processing {image_file}: {e}"
-                print(err_msg)
-                with open(error_file, "a") as ef:
-                    ef.write(err_msg + "\n")
-                continue
-
-            # Save response
-            with open(output_file, "w") as f:
-                json.dump(response, f, indent=2)
-
-            print(f"Response saved to {output_file}")
+
+    # Process images and save results with _binary_response suffix,
+    # skipping images that were already classified
+    return process_images(
+        image_folder,
+        output_folder,
+        system_prompt,
+        prompt,
+        region,
+        response_suffix="_binary_response.txt",
+        skip_existing=True,
+        stage="classify",
+        **options,
+    )
+
+
+def split_combined_response(text):
+    """
+    Split a combined classification and tagging response.
+
+    The combined prompt asks for five lines: upload decision, likelihood of
+    acceptance, title, keywords and category.
+
+    Args:
+        text (str): Raw response text from AI
+
+    Returns:
+        tuple: (binary_text, tag_text) in the formats written by the separate
+            binary classification and tag generation steps
+
+    Raises:
+        ValueError: If the response does not contain exactly five lines
+    """
+    lines = [line.strip() for line in text.strip().splitlines() if line.strip()]
+    if len(lines) != 5:
+        raise ValueError(f"Expected five lines in the combined response, but found: {len(lines)}")
+
+    binary_text = "\n".join(lines[:2])
+    tag_text = "\n\n".join(lines[2:])
+    return binary_text, tag_text
+
+
+def save_combined_response(output_file, response, tag_output_folder, store=None, **record):
+    """
+    Save a combined response as a binary classification and, if rated high, a tag response.
+
+    The tag response is written first, so an existing binary response file
+    always means the image is fully processed.
+
+    Args:
+        output_file (str): Path of the ``_binary_response.txt`` file to write
+        response (str or dict): Combined response text from the API, or the
+            validated object in structured mode
+        tag_output_folder (str): Folder to save tag generation results
+        store (ResponseStore, optional): Save both responses in this store instead,
+            the tag response under the "tag" stage. The usage of the request is
+            recorded with the classification only
+        **record: With a store, the image, stage and other keyword arguments of
+            ResponseStore.put
+    """
+    if isinstance(response, dict):
+        binary_response = {name: response[name] for name in CLASSIFY_FIELDS}
+        tag_response = {name: response[name] for name in TAG_FIELDS}
+        high = response["likelihood"] == "HIGH"
+    else:
+        binary_response, tag_response = split_combined_response(response)
+        high = "high" in binary_response.splitlines()[1].lower()
+    if high:
+        stem = Path(output_file).name[: -len("_binary_response.txt")]
+        tag_record = {}
+        if store is not None:
+            tag_record = {
+                "image": record["image"],
+                "stage": "tag",
+                "prompt_hash": record.get("prompt_hash"),
+            }
+        tag_file = os.path.join(tag_output_folder, f"{stem}_response.txt")
+        write_response(tag_file, tag_response, store, **tag_record)
+    write_response(output_file, binary_response, store, **record)
+
+
+def process_combined_classification(
+    image_folder,
+    output_folder,
+    tag_output_folder,
+    system_prompt_file,
+    prompt_file,
+    region=None,
+    **options,
+):
+    """
+    Classify and tag images with a single Bedrock request per image.
+
+    Writes the same ``_binary_response.txt`` files as the binary classification
+    and, for images rated with a high likelihood of acceptance (the ones that
+    file_organizer copies to the "high" folder), the ``_response.txt`` files
+    that tag generation would write.
+
+    Args:
+        image_folder (str): Folder containing images to classify
+        output_folder (str): Folder to save classification results
+        tag_output_folder (str): Folder to save tag generation results
+        system_prompt_file (str): Path to the combined system prompt file
+        prompt_file (str): Path to the combined prompt file
+        region (str, optional): AWS region
+        **options: Keyword arguments passed to process_images, e.g. concurrency
+
+    Returns:
+        dict: Mapping of image filename to (status, message)
+    """
+    system_prompt = read_prompt(system_prompt_file)
+    prompt = read_prompt(prompt_file)
+
+    os.makedirs(tag_output_folder, exist_ok=True)
+
+    return process_images(
+        image_folder,
+        output_folder,
+        system_prompt,
+        prompt,
+        region,
+        response_suffix="_binary_response.txt",
+        skip_existing=True,
+        stage="classify",
+        save_response=partial(save_combined_response, tag_output_folder=tag_output_folder),
+        **options,
+    )
+
+
+def run_step(
+    image_folder, output_folder, tag_output_folder=None, region=None, structured=False, **options
+):
+    """
+    Run the binary classification as a workflow step.
+
+    Args:
+        image_folder (str): Folder containing images to classify
+        output_folder (str): Folder to save classification results
+        tag_output_folder (str, optional): If given, classify and generate tags in a
+            single request and save the tag results to this folder
+        region (str, optional): AWS region. Defaults to environment variable or us-east-1
+        structured (bool, optional): Ask for JSON answers validated against a schema
+            and save them as JSON objects (see structured_output.py)
+        **options: Keyword arguments passed to process_images, e.g. concurrency
+
+    Returns:
+        StepResult: Result with the number of processed, skipped and failed images
+    """
+    if region is None:
+        region = get_aws_region()
+    if structured:
+        fields = COMBINED_FIELDS if tag_output_folder else CLASSIFY_FIELDS
+        options["schema"] = ResponseSchema(fields)
+
+    if tag_output_folder:
+        results = process_combined_classification(
+            image_folder,
+            output_folder,
+            tag_output_folder,
+            os.path.join(CONFIG_DIR, "system_prompt_combined.txt"),
+            os.path.join(CONFIG_DIR, "prompt_combined.txt"),
+            region,
+            **options,
+        )
+    else:
+        results = process_binary_classification(
+            image_folder,
+            output_folder,
+            os.path.join(CONFIG_DIR, "system_prompt_binary.txt"),
+            os.path.join(CONFIG_DIR, "prompt_binary.txt"),
+            region,
+            **options,
+        )
+    return StepResult("binary_classifier", counts=count_results(results))
 
 
 def main():
     """Main entry point for the binary classifier script."""
-    # Get config directory relative to this file
-    config_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "config")
-    
-    system_prompt_file = os.path.join(config_dir, "system_prompt_binary.txt")
-    prompt_file = os.path.join(config_dir, "prompt_binary.txt")
     region = get_aws_region()
 
     parser = argparse.ArgumentParser(description="Process images with AWS Bedrock for binary classification")
     parser.add_argument("--image_folder", required=True, help="Folder containing images")
     parser.add_argument("--output_folder", required=True, help="Folder to save responses")
+    parser.add_argument(
+        "--combined",
+        action="store_true",
+        help="Classify and generate tags with one request per image",
+    )
+    parser.add_argument(
+        "--tag_output_folder", help="Folder to save tag responses (required with --combined)"
+    )
+    add_processing_arguments(parser)
 
     args = parser.parse_args()
 
-    process_binary_classification(
+    if args.combined and not args.tag_output_folder:
+        parser.error("--tag_output_folder is required with --combined")
+
+    options = get_processing_options(args)
+    run_step(
         args.image_folder,
         args.output_folder,
-        system_prompt_file,
-        prompt_file,
-        region
+        args.tag_output_folder if args.combined else None,
+        region,
+        **options,
     )
+    options["metrics"].report(args.metrics_file)
 
 
 if __name__ == "__main__":
@@ -8,8 +8,22 @@ Removes images that don't meet minimum requirements for stock photography:
 """
 
 import os
-from PIL import Image
+import csv
+import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
 import argparse
+from .step_result import StepResult
+
+
+MIN_PIXELS = 4_000_000
+MAX_SIZE_MB = 15
+
+# Start-of-frame markers carrying the image dimensions (excluding DHT, JPG and DAC)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Markers without a length field
+STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
 
 
 def is_valid_jpeg(filepath):
@@ -27,19 +41,185 @@ def is_valid_jpeg(filepath):
     if ext not in [".jpg", ".jpeg"]:
         return False, 0
 
+    from PIL import Image
+
     try:
         # Open the image and get dimensions
         with Image.open(filepath) as img:
             width, height = img.size
             pixel_count = width * height
             # Check if image has at least 4 million pixels
-            return pixel_count >= 4_000_000, pixel_count / 1_000_000
+            return pixel_count >= MIN_PIXELS, pixel_count / 1_000_000
     except Exception as e:
         print(f"Error processing {filepath}: {e}")
         return False, 0
 
 
-def clean_directory(directory):
+def read_jpeg_size(filepath):
+    """
+    Read the dimensions of a JPEG from its start-of-frame header.
+
+    Only the marker segments before the first SOF marker are read, which is
+    usually a few kilobytes at the start of the file.
+
+    Args:
+        filepath (str): Path to the JPEG file
+
+    Returns:
+        tuple: (width, height), or None if no valid header was found
+    """
+    with open(filepath, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            byte = f.read(1)
+            if not byte:
+                return None
+            if byte != b"\xff":
+                continue
+            marker = f.read(1)
+            # Skip fill bytes
+            while marker == b"\xff":
+                marker = f.read(1)
+            if not marker:
+                return None
+            marker = marker[0]
+            if marker in STANDALONE_MARKERS:
+                continue
+            if marker == 0xD9:
+                return None
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                return None
+            length = struct.unpack(">H", length_bytes)[0]
+            if marker in SOF_MARKERS:
+                header = f.read(5)
+                if len(header) < 5:
+                    return None
+                _, height, width = struct.unpack(">BHH", header)
+                return width, height
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def check_image(filepath, size):
+    """
+    Check whether a file meets the requirements, reading only its header.
+
+    Falls back to opening the image with Pillow if the header cannot be
+    parsed, so the result matches is_valid_jpeg.
+
+    Args:
+        filepath (str): Path to the file
+        size (int): Size of the file in bytes
+
+    Returns:
+        dict: path, size_mb, megapixels, delete flag and reason
+    """
+    size_mb = size / (1024 * 1024)
+    ext = os.path.splitext(filepath)[1].lower()
+
+    megapixel = 0
+    big_enough = False
+    if ext in [".jpg", ".jpeg"]:
+        try:
+            dimensions = read_jpeg_size(filepath)
+        except OSError:
+            dimensions = None
+        if dimensions is None:
+            big_enough, megapixel = is_valid_jpeg(filepath)
+        else:
+            pixel_count = dimensions[0] * dimensions[1]
+            big_enough, megapixel = pixel_count >= MIN_PIXELS, pixel_count / 1_000_000
+
+    reason = None
+    # Remove files that don't meet minimum pixel requirements
+    if not big_enough:
+        if ext not in [".jpg", ".jpeg"]:
+            reason = "not a JPEG"
+        else:
+            reason = "too few pixels" if megapixel else "unreadable"
+    # Remove files larger than 15MB, which will cause issues with Bedrock API
+    elif size_mb > MAX_SIZE_MB:
+        reason = "too large"
+
+    return {
+        "path": filepath,
+        "size_mb": size_mb,
+        "megapixels": megapixel,
+        "delete": reason is not None,
+        "reason": reason,
+    }
+
+
+def check_file(entry):
+    """
+    Check whether a directory entry meets the requirements.
+
+    Args:
+        entry (os.DirEntry): Directory entry of the file; its cached stat result is reused
+
+    Returns:
+        dict: path, size_mb, megapixels, delete flag and reason
+    """
+    return check_image(entry.path, entry.stat().st_size)
+
+
+def iter_files(directory):
+    """
+    Recursively yield the directory entries of all files under a directory.
+
+    Args:
+        directory (str): Directory path to scan
+
+    Yields:
+        os.DirEntry: Entry of each file
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_files(entry.path)
+            elif entry.is_file():
+                yield entry
+
+
+def scan_directory(directory, workers=16):
+    """
+    Check all files under a directory in parallel.
+
+    Args:
+        directory (str): Directory path to scan
+        workers (int, optional): Number of threads opening and reading files
+
+    Returns:
+        list: Result of check_file for each file, sorted by path
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        records = list(executor.map(check_file, iter_files(directory)))
+    return sorted(records, key=lambda record: record["path"])
+
+
+def write_report(records, report_path):
+    """
+    Write scan results as JSON or CSV, chosen by the file extension.
+
+    Args:
+        records (list): Results of check_file
+        report_path (str): Path of the report file (.json or .csv)
+    """
+    if report_path.lower().endswith(".csv"):
+        with open(report_path, "w", newline="") as f:
+            writer = csv.DictWriter(
+                f, fieldnames=["path", "size_mb", "megapixels", "delete", "reason"]
+            )
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(report_path, "w") as f:
+            json.dump(records, f, indent=2)
+    print(f"Report saved to {report_path}")
+
+
+def clean_directory(directory, workers=16, report_path=None):
     """
     Find files to delete and ask for confirmation.
     
@@ -50,35 +230,30 @@ def clean_directory(directory):
     
     Args:
         directory (str): Directory path to clean
-    """
-    files_to_delete = []
+        workers (int, optional): Number of threads used to scan files
+        report_path (str, optional): Write the scan results to this JSON or CSV file
 
+    Returns:
+        dict: Number of scanned and deleted files
+    """
     print(f"Scanning directory: {directory}")
 
-    # Walk through the directory
-    for root, _, files in os.walk(directory):
-        for filename in files:
-            filepath = os.path.join(root, filename)
+    records = scan_directory(directory, workers)
+    if report_path:
+        write_report(records, report_path)
 
-            # Skip directories and non-image files
-            if os.path.isdir(filepath):
-                continue
+    files_to_delete = [
+        (record["path"], record["size_mb"], record["megapixels"])
+        for record in records
+        if record["delete"]
+    ]
 
-            # Check if it's a valid JPEG with sufficient size
-            big_enough, megapixel = is_valid_jpeg(filepath)
-            size_mb = os.path.getsize(filepath) / (1024 * 1024)
-            
-            # Remove files that don't meet minimum pixel requirements
-            if not big_enough:
-                files_to_delete.append((filepath, size_mb, megapixel))
-            # Remove files larger than 15MB, which will cause issues with Bedrock API
-            elif size_mb > 15:
-                files_to_delete.append((filepath, size_mb, megapixel))
+    counts = {"scanned": len(records), "deleted": 0}
 
     # Show files to be deleted
     if not files_to_delete:
         print("No files to delete.")
-        return
+        return counts
 
     print(f"\nFound {len(files_to_delete)} files to delete:")
     for filepath, size_mb, megapixel in files_to_delete:
@@ -93,12 +268,30 @@ def clean_directory(directory):
             try:
                 os.remove(filepath)
                 print(f"Deleted: {filepath}")
+                counts["deleted"] += 1
             except Exception as e:
                 print(f"Error deleting {filepath}: {e}")
         print(f"\nSuccessfully deleted {len(files_to_delete)} files.")
     else:
         print("Operation cancelled. No files were deleted.")
 
+    return counts
+
+
+def run_step(directory, workers=16, report_path=None):
+    """
+    Run the file cleaning as a workflow step.
+
+    Args:
+        directory (str): Directory path to clean
+        workers (int, optional): Number of threads used to scan files
+        report_path (str, optional): Write the scan results to this JSON or CSV file
+
+    Returns:
+        StepResult: Result with the number of scanned and deleted files
+    """
+    return StepResult("clean_files", counts=clean_directory(directory, workers, report_path))
+
 
 def main():
     """Main entry point for the clean_files script."""
@@ -106,9 +299,13 @@ def main():
         description="Clean directory by removing non-JPEG files and JPEGs smaller than 4 million pixels."
     )
     parser.add_argument("directory", help="Directory to clean")
+    parser.add_argument(
+        "--workers", type=int, default=16, help="Number of threads used to scan files"
+    )
+    parser.add_argument("--report", help="Write scan results to this JSON or CSV file")
 
     args = parser.parse_args()
-    clean_directory(args.directory)
+    clean_directory(args.directory, args.workers, args.report)
 
 
 if __name__ == "__main__":
@@ -7,13 +7,66 @@ and removes unsupported formats like PNG.
 
 import os
 import io
-from PIL import Image, ImageCms
-import pillow_heif
+import time
+import hashlib
+from functools import lru_cache
 import argparse
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .step_result import StepResult
 
-# Register HEIF opener with Pillow
-pillow_heif.register_heif_opener()
+# LittleCMS transforms to sRGB, keyed by (hash of input ICC profile, image mode)
+_srgb_transforms = {}
+
+
+@lru_cache(maxsize=None)
+def register_heif_opener():
+    """
+    Register the HEIF opener with Pillow, once per process.
+
+    pillow_heif is imported on first use rather than with this module, so
+    commands that do not open images start quickly.
+    """
+    import pillow_heif
+
+    pillow_heif.register_heif_opener()
+
+
+@lru_cache(maxsize=None)
+def get_srgb_profile():
+    """
+    Get the sRGB target profile, created once per process.
+
+    Returns:
+        ImageCms.ImageCmsProfile: sRGB profile
+    """
+    from PIL import ImageCms
+
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+
+
+def get_srgb_transform(icc_profile, mode):
+    """
+    Get a transform from an embedded ICC profile to sRGB.
+
+    Images from the same camera share a handful of profiles, so transforms
+    are built once per distinct profile and reused.
+
+    Args:
+        icc_profile (bytes): Embedded ICC profile of the image
+        mode (str): Image mode, used for both input and output
+
+    Returns:
+        ImageCms.ImageCmsTransform: Colour transform
+    """
+    from PIL import ImageCms
+
+    key = (hashlib.sha256(icc_profile).digest(), mode)
+    transform = _srgb_transforms.get(key)
+    if transform is None:
+        input_profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+        transform = ImageCms.buildTransform(input_profile, get_srgb_profile(), mode, mode)
+        _srgb_transforms[key] = transform
+    return transform
 
 
 def convert_to_jpeg(input_path, output_path):
@@ -27,6 +80,9 @@ def convert_to_jpeg(input_path, output_path):
     Returns:
         bool: True if conversion successful, False otherwise
     """
+    from PIL import Image, ImageCms
+
+    register_heif_opener()
     try:
         with Image.open(input_path) as img:
             # Convert to RGB if needed (for PNG with transparency, HEIC, etc.)
@@ -42,11 +98,10 @@ def convert_to_jpeg(input_path, output_path):
             
             # Apply sRGB color profile
             try:
-                srgb_profile = ImageCms.createProfile('sRGB')
                 if img.info.get('icc_profile'):
                     # Convert from current profile to sRGB
-                    input_profile = ImageCms.ImageCmsProfile(io.BytesIO(img.info['icc_profile']))
-                    img = ImageCms.profileToProfile(img, input_profile, srgb_profile)
+                    transform = get_srgb_transform(img.info['icc_profile'], img.mode)
+                    ImageCms.applyTransform(img, transform, inPlace=True)
                 # If no profile exists, just ensure RGB mode (sRGB is assumed)
             except Exception as e:
                 print(f"Warning: Could not apply sRGB profile to {input_path}: {e}")
@@ -59,6 +114,97 @@ def convert_to_jpeg(input_path, output_path):
         return False
 
 
+def convert_file(filepath):
+    """
+    Convert a HEIC/HEIF file to a JPEG next to it and remove the original.
+
+    Args:
+        filepath (str): Path to the file to convert
+
+    Returns:
+        tuple: (success, error_message) - error_message is None on success
+    """
+    # Generate output filename (replace extension with .jpeg)
+    base_name = os.path.splitext(filepath)[0]
+    output_path = base_name + ".jpeg"
+
+    if not convert_to_jpeg(filepath, output_path):
+        return False, f"Failed to convert: {filepath}"
+
+    # Remove original file after successful conversion
+    try:
+        os.remove(filepath)
+    except Exception as e:
+        return False, f"Error removing original {filepath}: {e}"
+    return True, None
+
+
+def convert_file_measured(filepath):
+    """
+    Convert a file like convert_file and measure the conversion.
+
+    Args:
+        filepath (str): Path to the file to convert
+
+    Returns:
+        tuple: (success, error_message, seconds, bytes_read, bytes_written)
+    """
+    start = time.perf_counter()
+    bytes_read = os.path.getsize(filepath)
+    success, error = convert_file(filepath)
+    output_path = os.path.splitext(filepath)[0] + ".jpeg"
+    bytes_written = os.path.getsize(output_path) if success else 0
+    return success, error, time.perf_counter() - start, bytes_read, bytes_written
+
+
+def convert_files(files_to_convert, workers=1, metrics=None):
+    """
+    Convert files to JPEG, optionally in parallel worker processes.
+
+    Args:
+        files_to_convert (list): Paths of the files to convert
+        workers (int, optional): Number of worker processes. 1 converts in this process
+        metrics (Metrics, optional): Records the conversion time and file sizes per image
+
+    Returns:
+        int: Number of files converted successfully
+    """
+    from tqdm import tqdm
+
+    converted_count = 0
+
+    def finish(success, error, seconds=0.0, bytes_read=0, bytes_written=0):
+        nonlocal converted_count
+        if success:
+            converted_count += 1
+        else:
+            print(error)
+        if metrics is not None:
+            metrics.observe("stage_seconds", seconds, stage="convert", phase="image")
+            metrics.count("bytes_read_total", bytes_read, stage="convert")
+            metrics.count("bytes_written_total", bytes_written, stage="convert")
+            metrics.count(
+                "images_total", stage="convert", status="processed" if success else "failed"
+            )
+
+    if workers <= 1:
+        for filepath in tqdm(files_to_convert):
+            finish(*convert_file_measured(filepath))
+        return converted_count
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(convert_file_measured, filepath): filepath
+            for filepath in files_to_convert
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                finish(*future.result())
+            except Exception as e:
+                finish(False, f"Error converting {futures[future]}: {e}")
+    return converted_count
+
+
 def is_convertible_format(filepath):
     """
     Check if file is in a format we can convert to JPEG.
@@ -87,15 +233,21 @@ def is_deletable_format(filepath):
     return ext in ['.png']
 
 
-def convert_directory(directory):
+def convert_directory(directory, workers=1, metrics=None):
     """
     Convert HEIC images to JPEG, and remove invalid files.
     
     Args:
         directory (str): Directory path containing images to process
+        workers (int, optional): Number of worker processes used for conversion
+        metrics (Metrics, optional): Records the conversion time and file sizes per image
+
+    Returns:
+        dict: Number of converted and deleted files
     """
     files_to_convert = []
     files_to_delete = []
+    counts = {"converted": 0, "deleted": 0}
 
     print(f"Scanning directory: {directory}")
 
@@ -129,7 +281,8 @@ def convert_directory(directory):
 
     if not files_to_convert and not files_to_delete:
         print("No files to convert or delete.")
-        return
+        normalize_extensions(directory)
+        return counts
 
     # Ask for confirmation
     if files_to_convert or files_to_delete:
@@ -137,23 +290,8 @@ def convert_directory(directory):
         
         if confirmation.lower() in ["yes", "y"]:
             # Convert files
-            converted_count = 0
-
             print(f"\nConverting {len(files_to_convert)} files to JPEG...")
-            for filepath in tqdm(files_to_convert):
-                # Generate output filename (replace extension with .jpeg)
-                base_name = os.path.splitext(filepath)[0]
-                output_path = base_name + ".jpeg"
-                
-                if convert_to_jpeg(filepath, output_path):
-                    # Remove original file after successful conversion
-                    try:
-                        os.remove(filepath)
-                        converted_count += 1
-                    except Exception as e:
-                        print(f"Error removing original {filepath}: {e}")
-                else:
-                    print(f"Failed to convert: {filepath}")
+            converted_count = convert_files(files_to_convert, workers, metrics)
 
             # Delete invalid files
             deleted_count = 0
@@ -167,10 +305,21 @@ def convert_directory(directory):
             print(f"\nOperation completed:")
             print(f"  - Converted {converted_count} files to JPEG")
             print(f"  - Deleted {deleted_count} invalid files")
+            counts = {"converted": converted_count, "deleted": deleted_count}
         else:
             print("Operation cancelled. No files were modified.")
 
-    # Normalize .JPEG extensions to .jpeg
+    normalize_extensions(directory)
+    return counts
+
+
+def normalize_extensions(directory):
+    """
+    Rename .jpg and .JPEG files to .jpeg, the extension the later steps expect.
+
+    Args:
+        directory (str): Directory path containing images to process
+    """
     for root, _, files in os.walk(directory):
         for filename in files:
             filename_parts = filename.split('.')
@@ -192,15 +341,36 @@ def convert_directory(directory):
                 print(f"Unsupported extension: {filename}")
 
 
+def run_step(directory, workers=1, metrics=None):
+    """
+    Run the conversion as a workflow step.
+
+    Args:
+        directory (str): Directory path containing images to process
+        workers (int, optional): Number of worker processes used for conversion
+        metrics (Metrics, optional): Records the conversion time and file sizes per image
+
+    Returns:
+        StepResult: Result with the number of converted and deleted files
+    """
+    return StepResult("convert_images", counts=convert_directory(directory, workers, metrics))
+
+
 def main():
     """Main entry point for the convert_images script."""
     parser = argparse.ArgumentParser(
         description="Convert PNG/HEIC images to high-quality JPEG and clean invalid files."
     )
     parser.add_argument("directory", help="Directory to process")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes for conversion (1 converts serially)",
+    )
 
     args = parser.parse_args()
-    convert_directory(args.directory)
+    convert_directory(args.directory, args.workers)
 
 
 if __name__ == "__main__":
@@ -5,8 +5,14 @@ Moves and organizes images based on classification results.
 """
 
 import os
-import shutil
+import time
 import argparse
+from .file_linker import LINK_MODES, LinkStats, link_file
+from .step_result import StepResult
+from .structured_output import load_response
+
+
+RESULT_FOLDERS = ["yes", "no", "low", "medium", "high"]
 
 
 def create_folder_if_not_exists(folder_path):
@@ -23,31 +29,130 @@ def create_folder_if_not_exists(folder_path):
         print(f"Folder already exists: {folder_path}")
 
 
-def move_files(source_dir, label_dir, base_dest_dir):
+def create_result_folders(base_dest_dir):
+    """
+    Create the destination folders for each classification.
+
+    Args:
+        base_dest_dir (str): Base destination directory for organized files
+    """
+    # Create base destination directory if it doesn't exist
+    os.makedirs(base_dest_dir, exist_ok=True)
+
+    # Create subdirectories for different classifications
+    for folder in RESULT_FOLDERS:
+        create_folder_if_not_exists(f"{base_dest_dir}/{folder}")
+
+
+def read_classification(txt_file):
+    """
+    Read the upload decision and likelihood from a binary classification result.
+
+    Args:
+        txt_file (str): Path of the ``_binary_response.txt`` file
+
+    Returns:
+        tuple: (upload_decision, likelihood) in lower case, or None if the file
+            holds fewer than two lines
+    """
+    with open(txt_file, "r") as f:
+        return parse_classification(f.read())
+
+
+def parse_classification(content):
+    """
+    Parse the upload decision and likelihood from a binary classification result.
+
+    Args:
+        content (str): Content of a ``_binary_response.txt`` file, text or a
+            structured response
+
+    Returns:
+        tuple: (upload_decision, likelihood) in lower case, or None if the
+            response holds fewer than two lines
+    """
+    data = load_response(content)
+    if data is not None:
+        return data["decision"].lower(), data["likelihood"].lower()
+    lines = content.split("\n", 1)[0].strip().split("\\n")
+    if len(lines) < 2:
+        return None
+    return lines[0].strip().lower(), lines[1].strip().lower()
+
+
+def organize_file(source_file, upload_decision, likelihood, base_dest_dir, link_mode, stats=None):
+    """
+    Place one file in the folders matching its classification.
+
+    Args:
+        source_file (str): Path of the image
+        upload_decision (str): Upload decision line of the classification, in lower case
+        likelihood (str): Likelihood line of the classification, in lower case
+        base_dest_dir (str): Base destination directory for organized files
+        link_mode (str): One of "hardlink", "reflink", "symlink" or "copy"
+        stats (LinkStats, optional): Counters to update
+
+    Returns:
+        list: Names of the folders the file was placed in
+    """
+    filename = os.path.basename(source_file)
+    folders = []
+
+    # Place in appropriate folders based on classification
+    if "yes" in upload_decision:
+        folders.append("yes")
+    elif "no" in upload_decision:
+        folders.append("no")
+
+    if "low" in likelihood:
+        folders.append("low")
+    elif "medium" in likelihood:
+        folders.append("medium")
+    elif "high" in likelihood:
+        folders.append("high")
+
+    for folder in folders:
+        dest_file = os.path.join(base_dest_dir, folder, filename)
+        link_file(source_file, dest_file, link_mode, stats)
+    return folders
+
+
+def move_files(
+    source_dir, label_dir, base_dest_dir, link_mode="copy", metrics=None, store=None
+):
     """
     Move files based on binary classification results.
     
     Organizes images into folders based on:
     - Upload decision (yes/no)
     - Likelihood of acceptance (low/medium/high)
+
+    Files are placed with file_linker.link_file. They are copied by default;
+    hard links and reflinks save disk writes, but a hard link shares its
+    content with the source image, so editing one edits the other.
     
     Args:
         source_dir (str): Directory containing source images
         label_dir (str): Directory containing classification results
         base_dest_dir (str): Base destination directory for organized files
+        link_mode (str, optional): One of "hardlink", "reflink", "symlink" or "copy"
+        metrics (Metrics, optional): Records the time per image and the bytes copied
+            and linked
+        store (ResponseStore, optional): Read the classifications from this store
+            instead of label_dir
+
+    Returns:
+        dict: Number of files placed in each folder, number of missing results
+            and bytes linked instead of copied
     """
     # Get the error log file
     error_log_file = os.path.join(os.path.dirname(source_dir), "error_log.txt")
 
-    # Create base destination directory if it doesn't exist
-    os.makedirs(base_dest_dir, exist_ok=True)
+    create_result_folders(base_dest_dir)
 
-    # Create subdirectories for different classifications
-    create_folder_if_not_exists(f"{base_dest_dir}/yes")
-    create_folder_if_not_exists(f"{base_dest_dir}/no")
-    create_folder_if_not_exists(f"{base_dest_dir}/low")
-    create_folder_if_not_exists(f"{base_dest_dir}/medium")
-    create_folder_if_not_exists(f"{base_dest_dir}/high")
+    counts = {folder: 0 for folder in RESULT_FOLDERS}
+    counts["missing"] = 0
+    stats = LinkStats()
 
     # Process files in source directory
     for filename in os.listdir(source_dir):
@@ -63,47 +168,73 @@ def move_files(source_dir, label_dir, base_dest_dir):
         # Find matching txt file in labels directory
         txt_file = os.path.join(label_dir, base_name + "_binary_response.txt")
 
-        if not os.path.exists(txt_file):
+        if store is not None:
+            content = store.get(filename, "classify")
+        elif os.path.exists(txt_file):
+            with open(txt_file, "r") as f:
+                content = f.read()
+        else:
+            content = None
+        if content is None:
             print(f"No results file found for {filename}")
             with open(error_log_file, "a") as error_log:
                 error_log.write(f"No results file found for {filename}\n")
+            counts["missing"] += 1
             continue
 
         # Read classification from the txt file
-        with open(txt_file, "r") as f:
-            lines = f.readline().strip().split("\\n")
-            if len(lines) < 2:
-                print(f"Insufficient classification data in {txt_file}")
-                with open(error_log_file, "a") as error_log:
-                    error_log.write(f"Insufficient classification data in {txt_file}\n")
-                continue
-
-            upload_decision = lines[0].strip().lower()
-            likelihood = lines[1].strip().lower()
-
-            # Copy to appropriate folders based on classification
-            if "yes" in upload_decision:
-                dest_dir = os.path.join(base_dest_dir, "yes")
-                dest_file = os.path.join(dest_dir, filename)
-                shutil.copy2(source_file, dest_file)
-
-            elif "no" in upload_decision:
-                dest_dir = os.path.join(base_dest_dir, "no")
-                dest_file = os.path.join(dest_dir, filename)
-                shutil.copy2(source_file, dest_file)
-
-            if "low" in likelihood:
-                dest_dir = os.path.join(base_dest_dir, "low")
-                dest_file = os.path.join(dest_dir, filename)
-                shutil.copy2(source_file, dest_file)
-            elif "medium" in likelihood:
-                dest_dir = os.path.join(base_dest_dir, "medium")
-                dest_file = os.path.join(dest_dir, filename)
-                shutil.copy2(source_file, dest_file)
-            elif "high" in likelihood:
-                dest_dir = os.path.join(base_dest_dir, "high")
-                dest_file = os.path.join(dest_dir, filename)
-                shutil.copy2(source_file, dest_file)
+        classification = parse_classification(content)
+        if classification is None:
+            print(f"Insufficient classification data in {txt_file}")
+            with open(error_log_file, "a") as error_log:
+                error_log.write(f"Insufficient classification data in {txt_file}\n")
+            counts["missing"] += 1
+            continue
+
+        upload_decision, likelihood = classification
+        start = time.perf_counter()
+        for folder in organize_file(
+            source_file, upload_decision, likelihood, base_dest_dir, link_mode, stats
+        ):
+            counts[folder] += 1
+        if metrics is not None:
+            metrics.observe(
+                "stage_seconds", time.perf_counter() - start, stage="organize", phase="image"
+            )
+
+    print(f"Placed files in {base_dest_dir}:")
+    stats.print_summary()
+    counts["bytes_saved"] = stats.bytes_saved
+    if metrics is not None:
+        metrics.count("bytes_written_total", stats.bytes.get("copy", 0), stage="organize")
+        metrics.count("bytes_linked_total", stats.bytes_saved, stage="organize")
+        metrics.count("images_total", counts["missing"], stage="organize", status="failed")
+    return counts
+
+
+def run_step(
+    source_dir, label_dir, base_dest_dir, link_mode="copy", metrics=None, store=None
+):
+    """
+    Run the file organization as a workflow step.
+
+    Args:
+        source_dir (str): Directory containing source images
+        label_dir (str): Directory containing classification results
+        base_dest_dir (str): Base destination directory for organized files
+        link_mode (str, optional): One of "hardlink", "reflink", "symlink" or "copy"
+        metrics (Metrics, optional): Records the time per image and the bytes copied
+            and linked
+        store (ResponseStore, optional): Read the classifications from this store
+            instead of label_dir
+
+    Returns:
+        StepResult: Result with the number of files placed in each folder
+    """
+    return StepResult(
+        "file_organizer",
+        counts=move_files(source_dir, label_dir, base_dest_dir, link_mode, metrics, store),
+    )
 
 
 def main():
@@ -122,13 +253,31 @@ def main():
     parser.add_argument(
         "--results_dir", type=str, help="Directory containing classification results."
     )
+    parser.add_argument(
+        "--link_mode",
+        choices=LINK_MODES,
+        default="copy",
+        help="How files are placed in the result folders. Hard links share their content "
+        "with the source, so editing one edits the other; symlinks break if the source "
+        "directory is deleted. Falls back to copy when linking fails.",
+    )
+    parser.add_argument(
+        "--response_store",
+        help="SQLite file holding the classifications instead of the label directory "
+        "(see response_store.py)",
+    )
     args = parser.parse_args()
     
     print(f"Source directory: {args.source_dir}")
     print(f"Label directory: {args.label_dir}")
     print(f"Results directory: {args.results_dir}")
 
-    move_files(args.source_dir, args.label_dir, args.results_dir)
+    store = None
+    if args.response_store:
+        from .response_store import ResponseStore
+
+        store = ResponseStore(args.response_store)
+    move_files(args.source_dir, args.label_dir, args.results_dir, args.link_mode, store=store)
 
 
 if __name__ == "__main__":
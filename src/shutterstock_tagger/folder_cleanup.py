@@ -7,6 +7,7 @@ Handles deletion of temporary folders and files after processing.
 import os
 import shutil
 import argparse
+from .step_result import StepResult
 
 
 def delete_folder(folder_path):
@@ -15,6 +16,9 @@ def delete_folder(folder_path):
     
     Args:
         folder_path (str): Path to the folder to delete
+
+    Returns:
+        bool: True if the folder was deleted
     """
     if os.path.exists(folder_path):
         # Confirm deletion
@@ -23,15 +27,17 @@ def delete_folder(folder_path):
         )
         if confirm.lower() != "yes":
             print("Deletion cancelled.")
-            return
+            return False
 
         try:
             shutil.rmtree(folder_path)
             print(f"Deleted folder: {folder_path}")
+            return True
         except Exception as e:
             print(f"Error deleting folder {folder_path}: {e}")
     else:
         print(f"Folder does not exist: {folder_path}")
+    return False
 
 
 def delete_sub_folders(base_dest_dir):
@@ -40,11 +46,16 @@ def delete_sub_folders(base_dest_dir):
     
     Args:
         base_dest_dir (str): Base destination directory
+
+    Returns:
+        int: Number of deleted folders
     """
-    delete_folder(f"{base_dest_dir}/yes")
-    delete_folder(f"{base_dest_dir}/no")
-    delete_folder(f"{base_dest_dir}/low")
-    delete_folder(f"{base_dest_dir}/medium")
+    deleted = 0
+    deleted += delete_folder(f"{base_dest_dir}/yes")
+    deleted += delete_folder(f"{base_dest_dir}/no")
+    deleted += delete_folder(f"{base_dest_dir}/low")
+    deleted += delete_folder(f"{base_dest_dir}/medium")
+    return deleted
 
 
 def delete_folders(base_folder):
@@ -53,13 +64,30 @@ def delete_folders(base_folder):
     
     Args:
         base_folder (str): Base folder containing all processing directories
+
+    Returns:
+        int: Number of deleted folders
     """
     copied_dir = os.path.join(base_folder, "3_copied_dest")
-    delete_sub_folders(copied_dir)
+    deleted = delete_sub_folders(copied_dir)
     print(f"Deleted subfolders in {copied_dir}")
 
-    delete_folder(os.path.join(base_folder, "1_raw_export"))
+    deleted += delete_folder(os.path.join(base_folder, "1_raw_export"))
     print(f"Deleted folder: {os.path.join(base_folder, '1_raw_export')}")
+    return deleted
+
+
+def run_step(base_folder):
+    """
+    Run the folder cleanup as a workflow step.
+
+    Args:
+        base_folder (str): Base folder containing all processing directories
+
+    Returns:
+        StepResult: Result with the number of deleted folders
+    """
+    return StepResult("folder_cleanup", counts={"deleted_folders": delete_folders(base_folder)})
 
 
 def main():
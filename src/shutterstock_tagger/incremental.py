@@ -0,0 +1,185 @@
+"""
+Incremental run module.
+
+Detects files added to, modified in or deleted from the raw export folder
+since the last run by comparing them with fingerprints (size, modification
+time and content hash) kept in the ledger, and removes the outputs of
+modified and deleted files so that only the changes are processed again.
+"""
+
+import os
+from dataclasses import dataclass, field
+from .file_organizer import RESULT_FOLDERS
+
+
+# Ledger stage holding the fingerprints of the raw export folder
+RAW_EXPORT_STAGE = "raw_export"
+
+# Files in the raw export folder that the workflow turns into upload images
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".heic", ".heif"]
+
+
+@dataclass
+class InputChanges:
+    """
+    Changes of the raw export folder since its fingerprints were recorded.
+
+    Evaluates as True when anything changed.
+
+    Attributes:
+        added (list): Filenames of new files
+        modified (list): Filenames of files whose content changed, or that replace
+            a recorded file with the same stem (e.g. a new HEIC export of a converted image)
+        deleted (list): Filenames of recorded files that are gone
+    """
+
+    added: list = field(default_factory=list)
+    modified: list = field(default_factory=list)
+    deleted: list = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.modified or self.deleted)
+
+
+def list_inputs(folder):
+    """
+    List the image files of the raw export folder.
+
+    Args:
+        folder (str): Raw export folder
+
+    Returns:
+        list: Filenames, sorted
+    """
+    if not os.path.isdir(folder):
+        return []
+    return sorted(
+        filename
+        for filename in os.listdir(folder)
+        if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+        and os.path.isfile(os.path.join(folder, filename))
+    )
+
+
+def record_inputs(ledger, folder):
+    """
+    Record the fingerprints of the files in the raw export folder.
+
+    Called once the files are converted and cleaned, so the fingerprints
+    are those of the JPEGs that the later steps read. Files whose size and
+    modification time did not change are not hashed again.
+
+    Args:
+        ledger (Ledger): Ledger of the shoot
+        folder (str): Raw export folder
+
+    Returns:
+        int: Number of files recorded
+    """
+    filenames = list_inputs(folder)
+    for filename in filenames:
+        path = os.path.join(folder, filename)
+        input_hash = ledger.hash_input(filename, RAW_EXPORT_STAGE, path)
+        ledger.record(filename, RAW_EXPORT_STAGE, "present", None, path, input_hash)
+    ledger.flush()
+    return len(filenames)
+
+
+def archive_inputs(ledger):
+    """
+    Mark the recorded files as removed by the folder cleanup.
+
+    Archived files are not reported as deleted, so new files can be
+    exported into a fresh raw export folder after a completed run.
+
+    Args:
+        ledger (Ledger): Ledger of the shoot
+
+    Returns:
+        int: Number of files archived
+    """
+    return ledger.set_status(RAW_EXPORT_STAGE, "present", "archived")
+
+
+def detect_changes(ledger, folder):
+    """
+    Compare the raw export folder with its recorded fingerprints.
+
+    Files are matched by filename without extension, since HEIC files are
+    replaced by JPEGs during conversion. A file is only hashed if its size
+    or modification time differs from the record.
+
+    Args:
+        ledger (Ledger): Ledger of the shoot
+        folder (str): Raw export folder
+
+    Returns:
+        InputChanges: Added, modified and deleted files
+    """
+    changes = InputChanges()
+    if not os.path.isdir(folder):
+        return changes
+
+    recorded = ledger.records(RAW_EXPORT_STAGE, "present")
+    recorded_by_stem = {os.path.splitext(name)[0]: name for name in recorded}
+    seen = set()
+    for filename in list_inputs(folder):
+        stem = os.path.splitext(filename)[0]
+        recorded_name = recorded_by_stem.get(stem)
+        if recorded_name is None:
+            changes.added.append(filename)
+            continue
+        seen.add(stem)
+        if filename != recorded_name:
+            changes.modified.append(filename)
+            continue
+        path = os.path.join(folder, filename)
+        if ledger.hash_input(filename, RAW_EXPORT_STAGE, path) != recorded[filename]["input_hash"]:
+            changes.modified.append(filename)
+
+    changes.deleted = sorted(
+        name for name in recorded if os.path.splitext(name)[0] not in seen
+    )
+    return changes
+
+
+def remove_outputs(ledger, base_folder, filenames, store=None):
+    """
+    Remove the responses, organized copies and ledger records of images.
+
+    Batch folders are left to the batch splitter, which regenerates the
+    batches whose images changed.
+
+    Args:
+        ledger (Ledger): Ledger of the shoot
+        base_folder (str): Base working directory
+        filenames (list): Filenames of the images in the raw export folder
+        store (ResponseStore, optional): Response store of the shoot
+
+    Returns:
+        int: Number of files and stored responses removed
+    """
+    stems = {os.path.splitext(filename)[0] for filename in filenames}
+    paths = []
+    for stem in stems:
+        paths.append(os.path.join(base_folder, "2_binary_output", f"{stem}_binary_response.txt"))
+        paths.append(os.path.join(base_folder, "5_tag_output", f"{stem}_response.txt"))
+    # Organized copies keep the extension of the image, whichever it was
+    for folder in RESULT_FOLDERS:
+        result_folder = os.path.join(base_folder, "3_copied_dest", folder)
+        if os.path.isdir(result_folder):
+            paths += [
+                os.path.join(result_folder, filename)
+                for filename in os.listdir(result_folder)
+                if os.path.splitext(filename)[0] in stems
+            ]
+
+    removed = 0
+    for path in paths:
+        if os.path.lexists(path):
+            os.remove(path)
+            removed += 1
+    if store is not None:
+        removed += store.remove(stems)
+    ledger.forget(stems)
+    return removed
@@ -0,0 +1,415 @@
+"""
+Workflow ledger module.
+
+Records the progress of a shoot in a SQLite database in the base folder:
+the status of each workflow step, and the status, duration, input hash and
+error of each image in each stage. Re-runs use it to skip images that are
+already done and to pick up images added after the last run.
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+import threading
+from .response_cache import hash_file
+
+
+LEDGER_FILE = "ledger.sqlite"
+
+
+class Ledger:
+    """
+    Thread-safe record of workflow steps and per-image stage results.
+
+    Image records are committed in batches of ``commit_every`` records or
+    every ``commit_interval`` seconds, whichever comes first, so a large
+    shoot does not pay for a disk sync per image. Step records are committed
+    immediately.
+    """
+
+    def __init__(self, path, commit_every=50, commit_interval=1.0):
+        """
+        Open (or create) the ledger database.
+
+        Args:
+            path (str): Path of the SQLite database file
+            commit_every (int, optional): Maximum number of uncommitted image records
+            commit_interval (float, optional): Maximum seconds between commits of image records
+        """
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self._pending = 0
+        self._committed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "image TEXT NOT NULL, stage TEXT NOT NULL, status TEXT NOT NULL, "
+            "input_hash TEXT, input_size INTEGER, input_mtime INTEGER, "
+            "duration REAL, error TEXT, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (image, stage))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS steps ("
+            "step INTEGER PRIMARY KEY, name TEXT NOT NULL, status TEXT NOT NULL, "
+            "duration REAL, error TEXT, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _commit_if_due(self):
+        self._pending += 1
+        now = time.monotonic()
+        if self._pending >= self.commit_every or now - self._committed_at >= self.commit_interval:
+            self._conn.commit()
+            self._pending = 0
+            self._committed_at = now
+
+    def get(self, image, stage):
+        """
+        Look up the record of an image in a stage.
+
+        Args:
+            image (str): Filename of the image
+            stage (str): Name of the stage, e.g. "classify"
+
+        Returns:
+            dict: The record's columns, or None if the image has no record
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT * FROM images WHERE image = ? AND stage = ?", (image, stage)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def hash_input(self, image, stage, image_path):
+        """
+        Get the content hash of an image, reusing the recorded hash if the file is unchanged.
+
+        Args:
+            image (str): Filename of the image
+            stage (str): Name of the stage
+            image_path (str): Path of the image
+
+        Returns:
+            str: SHA-256 hex digest of the image content
+        """
+        stat = os.stat(image_path)
+        record = self.get(image, stage)
+        if (
+            record is not None
+            and record["input_hash"]
+            and record["input_size"] == stat.st_size
+            and record["input_mtime"] == stat.st_mtime_ns
+        ):
+            return record["input_hash"]
+        return hash_file(image_path)
+
+    def is_done(self, image, stage, input_hash=None):
+        """
+        Check whether an image completed a stage with the same input.
+
+        Args:
+            image (str): Filename of the image
+            stage (str): Name of the stage
+            input_hash (str, optional): Current hash of the input. Records without
+                a hash, and checks without one, only compare the status
+
+        Returns:
+            bool: True if the stage is done for this image
+        """
+        record = self.get(image, stage)
+        if record is None or record["status"] != "done":
+            return False
+        return input_hash is None or record["input_hash"] in (None, input_hash)
+
+    def is_up_to_date(self, image, stage, image_path, output_file, store=None):
+        """
+        Check whether the output of an image in a stage can be reused.
+
+        The output is reused if it exists and the image completed the stage
+        with the same content. An output without a record, e.g. written before
+        the ledger existed, is adopted and recorded as done.
+
+        Args:
+            image (str): Filename of the image
+            stage (str): Name of the stage
+            image_path (str): Path of the image
+            output_file (str): Path of the stage's output for the image
+            store (ResponseStore, optional): Store holding the output instead of output_file
+
+        Returns:
+            tuple: (up_to_date, input_hash)
+        """
+        input_hash = self.hash_input(image, stage, image_path)
+        exists = store.has(image, stage) if store is not None else os.path.exists(output_file)
+        if not exists:
+            return False, input_hash
+        if self.get(image, stage) is None:
+            self.record(image, stage, "done", 0.0, image_path, input_hash)
+            return True, input_hash
+        return self.is_done(image, stage, input_hash), input_hash
+
+    def record(
+        self,
+        image,
+        stage,
+        status,
+        duration=None,
+        input_path=None,
+        input_hash=None,
+        error=None,
+    ):
+        """
+        Record the result of an image in a stage, replacing any earlier record.
+
+        Args:
+            image (str): Filename of the image
+            stage (str): Name of the stage
+            status (str): "done", "dropped" or "failed"
+            duration (float, optional): Time spent on the image in seconds
+            input_path (str, optional): Path of the input, whose size and modification
+                time are stored to reuse the hash on the next run
+            input_hash (str, optional): Hash of the input content
+            error (str, optional): Error message if the image failed
+        """
+        size = mtime = None
+        if input_path is not None and input_hash is not None:
+            try:
+                stat = os.stat(input_path)
+                size, mtime = stat.st_size, stat.st_mtime_ns
+            except OSError:
+                pass
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (image, stage, status, input_hash, input_size, "
+                "input_mtime, duration, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (image, stage, status, input_hash, size, mtime, duration, error, time.time()),
+            )
+            self._commit_if_due()
+
+    def done_images(self, stage):
+        """
+        Get the images that completed a stage.
+
+        Args:
+            stage (str): Name of the stage
+
+        Returns:
+            set: Filenames of the images
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT image FROM images WHERE stage = ? AND status = 'done'", (stage,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def records(self, stage, status=None):
+        """
+        Get the records of all images in a stage.
+
+        Args:
+            stage (str): Name of the stage
+            status (str, optional): Only return records with this status
+
+        Returns:
+            dict: Mapping of image filename to its record's columns
+        """
+        query = "SELECT * FROM images WHERE stage = ?"
+        params = [stage]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        with self._lock:
+            cursor = self._conn.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            return {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+
+    def set_status(self, stage, old_status, new_status):
+        """
+        Change the status of all images of a stage that have a given status.
+
+        Args:
+            stage (str): Name of the stage
+            old_status (str): Status to change
+            new_status (str): New status
+
+        Returns:
+            int: Number of records changed
+        """
+        with self._lock:
+            changed = self._conn.execute(
+                "UPDATE images SET status = ?, updated_at = ? WHERE stage = ? AND status = ?",
+                (new_status, time.time(), stage, old_status),
+            ).rowcount
+            self._conn.commit()
+        return changed
+
+    def forget(self, stems):
+        """
+        Remove all records of images, in every stage.
+
+        Images are matched by filename without extension, so the records of
+        a HEIC file and the JPEG converted from it are both removed.
+
+        Args:
+            stems (iterable): Filenames without extension
+
+        Returns:
+            int: Number of records removed
+        """
+        stems = set(stems)
+        with self._lock:
+            images = [
+                row[0]
+                for row in self._conn.execute("SELECT DISTINCT image FROM images").fetchall()
+                if os.path.splitext(row[0])[0] in stems
+            ]
+            removed = 0
+            for image in images:
+                removed += self._conn.execute(
+                    "DELETE FROM images WHERE image = ?", (image,)
+                ).rowcount
+            self._conn.commit()
+        return removed
+
+    def record_step(self, step, name, status, duration=None, error=None):
+        """
+        Record the result of a workflow step.
+
+        Args:
+            step (int): Step number
+            name (str): Name of the step
+            status (str): "done", "partial" (done, but some images failed) or "failed"
+            duration (float, optional): Duration of the step in seconds
+            error (str, optional): Error message if the step failed
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO steps (step, name, status, duration, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (step, name, status, duration, error, time.time()),
+            )
+            self._conn.commit()
+            self._pending = 0
+            self._committed_at = time.monotonic()
+
+    def step_status(self, step):
+        """
+        Get the recorded status of a workflow step.
+
+        Args:
+            step (int): Step number
+
+        Returns:
+            str: "done", "partial" or "failed", or None if the step has not run
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM steps WHERE step = ?", (step,)).fetchone()
+        return row[0] if row else None
+
+    def steps(self):
+        """
+        List the recorded workflow steps.
+
+        Returns:
+            list: (step, name, status, duration, error) tuples sorted by step
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT step, name, status, duration, error FROM steps ORDER BY step"
+            ).fetchall()
+
+    def has_steps(self):
+        """
+        Check whether any workflow step was recorded.
+
+        Returns:
+            bool: True if at least one step was recorded
+        """
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM steps LIMIT 1").fetchone() is not None
+
+    def reset_steps(self):
+        """Forget the workflow steps so they run again; image records are kept."""
+        with self._lock:
+            self._conn.execute("DELETE FROM steps")
+            self._conn.commit()
+
+    def summary(self):
+        """
+        Count the images of each stage by status.
+
+        Returns:
+            dict: Mapping of stage name to a mapping of status to count
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, status, COUNT(*) FROM images GROUP BY stage, status"
+            ).fetchall()
+        counts = {}
+        for stage, status, count in rows:
+            counts.setdefault(stage, {})[status] = count
+        return counts
+
+    def failures(self):
+        """
+        List the images whose last result in a stage was a failure.
+
+        Returns:
+            list: (image, stage, error) tuples sorted by image and stage
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT image, stage, error FROM images WHERE status = 'failed' "
+                "ORDER BY image, stage"
+            ).fetchall()
+
+    def flush(self):
+        """Commit pending image records."""
+        with self._lock:
+            self._conn.commit()
+            self._pending = 0
+            self._committed_at = time.monotonic()
+
+    def close(self):
+        """Commit pending records and close the database connection."""
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+def main():
+    """Main entry point for the ledger script."""
+    parser = argparse.ArgumentParser(description="Show the workflow ledger of a shoot")
+    parser.add_argument("--base_folder", required=True, help="Base folder of the shoot")
+    args = parser.parse_args()
+
+    path = os.path.join(args.base_folder, LEDGER_FILE)
+    if not os.path.exists(path):
+        print(f"No ledger found at {path}")
+        return
+    ledger = Ledger(path)
+    print("Steps:")
+    for step, name, status, duration, error in ledger.steps():
+        line = f"  - {step} {name}: {status} ({duration or 0:.1f}s)"
+        print(line + (f" - {error}" if error else ""))
+    print("Images:")
+    for stage, counts in sorted(ledger.summary().items()):
+        counts = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+        print(f"  - {stage}: {counts}")
+    for image, stage, error in ledger.failures():
+        print(f"    - {image} ({stage}): {error}")
+    ledger.close()
+
+
+if __name__ == "__main__":
+    main()
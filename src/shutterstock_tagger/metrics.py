@@ -0,0 +1,374 @@
+"""
+Metrics module.
+
+Collects timings, byte and token counts and error counters of a run in
+memory, prints a summary at the end and exports them as JSON or as a
+Prometheus textfile (for node_exporter's textfile collector).
+
+Metrics recorded by the workflow modules:
+
+- ``stage_seconds{stage, phase}``: histogram of the time spent per image,
+  e.g. phase "encode", "request", "parse", "save" and "image" (the whole
+  image) of the "classify" and "tag" stages, or "convert" and "organize".
+  In the streaming workflow, phase "stream" is the time an image spent in
+  each pipeline stage
+- ``step_seconds{step}``: duration of each workflow step
+- ``images_total{stage, status}``: images by outcome, e.g. processed,
+  cached, skipped or failed. Each image is counted once, so processed
+  images do not include the cached ones
+- ``requests_total{stage, outcome}``: model requests, including retries
+- ``request_errors_total{stage, code}``: failed requests by AWS error code
+  or exception type
+- ``bytes_sent_total{stage}``: request body bytes sent to the model
+- ``bytes_received_total{stage}``: response text bytes received
+- ``bytes_read_total{stage}`` and ``bytes_written_total{stage}``: file sizes
+  read and written by conversion, and copied by organization
+- ``bytes_linked_total{stage}``: bytes organization linked instead of copying
+- ``tokens_total{stage, type}``: input and output tokens from the usage block
+  of the model responses
+- ``schema_violations_total{stage}``: structured answers that did not match
+  the schema and were asked again
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+# Prefix of the metric names in the Prometheus export
+METRIC_PREFIX = "shutterstock_tagger_"
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0
+)
+
+
+class Histogram:
+    """
+    Distribution of observed values in fixed buckets.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Create an empty histogram.
+
+        Args:
+            buckets (tuple, optional): Sorted upper bounds of the buckets. Values
+                above the last bound are counted in an implicit +Inf bucket
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """
+        Add a value.
+
+        Args:
+            value (float): Observed value
+        """
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimate a quantile by interpolating within its bucket.
+
+        Args:
+            q (float): Quantile between 0 and 1
+
+        Returns:
+            float: Estimated value, or 0.0 if nothing was observed
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / count
+                return min(estimate, self.max)
+            seen += count
+        return self.max
+
+    def to_dict(self):
+        """
+        Get the histogram as a dictionary.
+
+        Returns:
+            dict: Count, sum, mean, max, p50, p95 and p99, and the cumulative
+                count per bucket upper bound
+        """
+        cumulative = {}
+        total = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            cumulative[str(bound)] = total
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": cumulative,
+        }
+
+
+def format_labels(labels):
+    """
+    Format labels in the Prometheus exposition format.
+
+    Args:
+        labels (tuple): Sorted (name, value) pairs
+
+    Returns:
+        str: e.g. ``{stage="tag",phase="request"}``, or "" without labels
+    """
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and histograms, identified by name and labels.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Create an empty registry.
+
+        Args:
+            buckets (tuple, optional): Upper bounds of the histogram buckets in seconds
+        """
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1, **labels):
+        """
+        Increase a counter.
+
+        Args:
+            name (str): Name of the counter, e.g. "images_total"
+            amount (float, optional): Amount to add
+            **labels: Labels of the counter, e.g. stage="tag"
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """
+        Add a value to a histogram.
+
+        Args:
+            name (str): Name of the histogram, e.g. "stage_seconds"
+            value (float): Observed value, usually seconds
+            **labels: Labels of the histogram
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Time a block of code into a histogram, also when it raises.
+
+        Args:
+            name (str): Name of the histogram
+            **labels: Labels of the histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get(self, name, **labels):
+        """
+        Get the value of a counter.
+
+        Args:
+            name (str): Name of the counter
+            **labels: Labels of the counter. Counters with additional labels are summed
+
+        Returns:
+            float: Value of the counter, 0 if it was never increased
+        """
+        wanted = set(labels.items())
+        with self._lock:
+            return sum(
+                value
+                for (key_name, key_labels), value in self.counters.items()
+                if key_name == name and wanted <= set(key_labels)
+            )
+
+    def to_dict(self):
+        """
+        Get all metrics as a JSON serializable dictionary.
+
+        Returns:
+            dict: Start time, and lists of counters and histograms with their labels
+        """
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            histograms = [
+                {"name": name, "labels": dict(labels), **histogram.to_dict()}
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ]
+        return {"started_at": self.started_at, "counters": counters, "histograms": histograms}
+
+    def to_prometheus(self):
+        """
+        Format all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: Metrics text
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+
+            typed = set()
+            for (name, labels), value in counters:
+                metric = METRIC_PREFIX + name
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{format_labels(labels)} {value}")
+
+            for (name, labels), histogram in histograms:
+                metric = METRIC_PREFIX + name
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                total = 0
+                for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                    total += count
+                    bucket_labels = labels + (("le", bound),)
+                    lines.append(f"{metric}_bucket{format_labels(bucket_labels)} {total}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+
+        metric = METRIC_PREFIX + "run_start_timestamp_seconds"
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {self.started_at}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Export the metrics to a file.
+
+        Files ending in ``.prom`` are written in the Prometheus text format,
+        all others as JSON. The file is replaced atomically, so a collector
+        never reads a partial export.
+
+        Args:
+            path (str): Path of the file to write
+        """
+        if path.endswith(".prom"):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_dict(), indent=2) + "\n"
+
+        folder, name = os.path.split(path)
+        fd, temp_file = tempfile.mkstemp(dir=folder or ".", prefix=f".{name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            os.replace(temp_file, path)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+        print(f"Metrics saved to {path}")
+
+    def print_summary(self):
+        """Print the latency percentiles, traffic, tokens and errors of the run."""
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+
+        timings = sorted(
+            (dict(labels).get("stage", ""), labels, histogram)
+            for (name, labels), histogram in histograms
+            if name == "stage_seconds"
+        )
+        if timings:
+            print("\nLatency per image:")
+            for _, labels, histogram in timings:
+                values = histogram.to_dict()
+                labels = dict(labels)
+                label = "/".join(
+                    str(value) for value in [labels.pop("stage", None), *labels.values()] if value
+                )
+                print(
+                    f"  - {label}: {values['count']} x, mean {values['mean'] * 1000:.0f}ms, "
+                    f"p50 {values['p50'] * 1000:.0f}ms, p95 {values['p95'] * 1000:.0f}ms, "
+                    f"max {values['max'] * 1000:.0f}ms"
+                )
+
+        sent = self.get("bytes_sent_total")
+        received = self.get("bytes_received_total")
+        if sent or received:
+            print(
+                f"Traffic: {sent / 1e6:.1f} MB sent, {received / 1e3:.1f} kB received, "
+                f"{self.get('requests_total')} requests"
+            )
+        input_tokens = self.get("tokens_total", type="input")
+        output_tokens = self.get("tokens_total", type="output")
+        if input_tokens or output_tokens:
+            print(f"Tokens: {input_tokens} input, {output_tokens} output")
+
+        with self._lock:
+            errors = sorted(
+                (labels, value)
+                for (name, labels), value in self.counters.items()
+                if name == "request_errors_total"
+            )
+        if errors:
+            print("Request errors:")
+            for labels, value in errors:
+                labels = dict(labels)
+                print(f"  - {labels.get('stage')}: {labels.get('code')}: {value}")
+
+    def report(self, path=None):
+        """
+        Print the summary at the end of a run and export the metrics.
+
+        Args:
+            path (str, optional): File to export to, see write. None only prints the summary
+        """
+        self.print_summary()
+        if path:
+            self.write(path)
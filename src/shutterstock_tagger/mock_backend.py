@@ -0,0 +1,456 @@
+"""
+Mock model backend module.
+
+Answers Bedrock requests locally with canned responses after a simulated
+latency, throttling or failing a configurable share of requests, so the
+concurrency, retry and caching behaviour of the workflow can be measured
+without AWS. The mock runs in process (MockBackend) or as an HTTP server
+speaking the bedrock-runtime InvokeModel protocol (MockServer), which the
+boto3 client reaches through the AWS_BEDROCK_ENDPOINT_URL variable.
+"""
+
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .bedrock_client import ModelBackend
+
+
+# Default answers in the formats of the classification, tag and combined
+# prompts. The format is chosen by what the prompts ask for.
+DEFAULT_CLASSIFICATION = "Suitable for Upload: YES\nLikelihood of Acceptance: HIGH"
+DEFAULT_TAGS = (
+    "Title: Golden evening light over a quiet harbour with fishing boats\n\n"
+    "Keywords: harbour, boats, sunset, evening, golden hour, water, reflection, coast, "
+    "fishing, travel, nautical, calm, sea, sky, village\n\n"
+    "Category: Nature"
+)
+DEFAULT_STRUCTURED = {
+    "decision": "YES",
+    "likelihood": "HIGH",
+    "title": "Golden evening light over a quiet harbour with fishing boats",
+    "keywords": [
+        "harbour", "boats", "sunset", "evening", "golden hour", "water", "reflection",
+        "coast", "fishing", "travel", "nautical", "calm", "sea", "sky", "village",
+    ],
+    "categories": ["Nature"],
+}
+
+
+def default_response(prompt_text):
+    """
+    Choose the default answer for a request.
+
+    Args:
+        prompt_text (str): System prompt and user prompt of the request
+
+    Returns:
+        str: A classification if the prompts ask about suitability, tags if they
+            ask for keywords, and the five-line combined answer if they ask for both.
+            A JSON object with the fields of the schema if the prompts include one
+    """
+    if "JSON schema" in prompt_text:
+        fields = [name for name in DEFAULT_STRUCTURED if f'"{name}"' in prompt_text]
+        return json.dumps({name: DEFAULT_STRUCTURED[name] for name in fields})
+    prompt_text = prompt_text.lower()
+    classify = "suitable" in prompt_text
+    tag = "keyword" in prompt_text
+    if classify and not tag:
+        return DEFAULT_CLASSIFICATION
+    if tag and not classify:
+        return DEFAULT_TAGS
+    return DEFAULT_CLASSIFICATION + "\n" + DEFAULT_TAGS.replace("\n\n", "\n")
+
+
+# Rough token counts reported in the usage block of mock responses
+IMAGE_TOKENS = 1300
+CHARS_PER_TOKEN = 4
+
+
+class MockError(Exception):
+    """
+    Error returned by the mock, shaped like a botocore ClientError.
+
+    The ``response`` attribute carries the error code and HTTP status, so the
+    rate limiter classifies it like the corresponding Bedrock error.
+    """
+
+    def __init__(self, code, status, message):
+        super().__init__(f"An error occurred ({code}): {message}")
+        self.code = code
+        self.status = status
+        self.response = {
+            "Error": {"Code": code, "Message": message},
+            "ResponseMetadata": {"HTTPStatusCode": status},
+        }
+
+
+class LatencyDistribution:
+    """
+    Distribution of simulated request latencies in seconds.
+
+    Specs are written as ``name:param,param``:
+
+    - ``constant:0.5`` (or just ``0.5``)
+    - ``uniform:0.2,1.5`` (low, high)
+    - ``normal:1.0,0.3`` (mean, standard deviation; clipped at 0)
+    - ``lognormal:1.0,0.5`` (median, sigma of the underlying normal)
+    - ``exponential:1.0`` (mean)
+    """
+
+    PARAMS = {"constant": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exponential": 1}
+
+    def __init__(self, name, *params):
+        """
+        Create a distribution.
+
+        Args:
+            name (str): One of "constant", "uniform", "normal", "lognormal" or "exponential"
+            *params (float): Parameters of the distribution
+        """
+        if name not in self.PARAMS:
+            raise ValueError(f"Unknown latency distribution: {name}")
+        if len(params) != self.PARAMS[name]:
+            raise ValueError(f"{name} latency takes {self.PARAMS[name]} parameters")
+        self.name = name
+        self.params = tuple(float(param) for param in params)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Parse a latency spec.
+
+        Args:
+            spec (str): Spec such as "lognormal:1.0,0.5" or "0.5"
+
+        Returns:
+            LatencyDistribution: The distribution
+        """
+        name, _, params = str(spec).partition(":")
+        if not params:
+            return cls("constant", name)
+        return cls(name, *params.split(","))
+
+    def sample(self, rng):
+        """
+        Draw a latency.
+
+        Args:
+            rng (random.Random): Random number generator
+
+        Returns:
+            float: Latency in seconds
+        """
+        if self.name == "constant":
+            return self.params[0]
+        if self.name == "uniform":
+            return rng.uniform(*self.params)
+        if self.name == "normal":
+            return max(0.0, rng.gauss(*self.params))
+        if self.name == "lognormal":
+            median, sigma = self.params
+            return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+        return rng.expovariate(1.0 / self.params[0]) if self.params[0] > 0 else 0.0
+
+    def __repr__(self):
+        return f"{self.name}:{','.join(f'{param:g}' for param in self.params)}"
+
+
+def load_responses(responses_file):
+    """
+    Load canned responses from a JSON file.
+
+    The file maps a text to look for in the request's prompts to the
+    response text to return, e.g. {"Suitable for Upload": "..."}. The first
+    match in file order wins.
+
+    Args:
+        responses_file (str): Path of the JSON file
+
+    Returns:
+        list: (match, response text) pairs
+    """
+    with open(responses_file) as f:
+        return list(json.load(f).items())
+
+
+class MockBackend(ModelBackend):
+    """
+    In-process model backend with simulated latency, throttling and errors.
+
+    Each request draws its latency, throttle and error outcome from its own
+    random generator seeded with the backend seed and the request number,
+    so a run with the same seed sees the same sequence of outcomes.
+    Thread-safe.
+    """
+
+    model_id = "mock"
+
+    def __init__(
+        self,
+        responses=None,
+        latency="0",
+        throttle_rate=0.0,
+        error_rate=0.0,
+        seed=0,
+    ):
+        """
+        Create a mock.
+
+        Args:
+            responses (list, optional): (match, response text) pairs; the first pair whose
+                match occurs in the request's prompts answers it. Other requests get
+                the default answer for their prompts
+            latency (str or LatencyDistribution, optional): Latency of each request
+            throttle_rate (float, optional): Share of requests rejected with ThrottlingException
+            error_rate (float, optional): Share of requests failing with ServiceUnavailableException
+            seed (int, optional): Seed of the simulated outcomes
+        """
+        self.responses = list(responses or [])
+        if not isinstance(latency, LatencyDistribution):
+            latency = LatencyDistribution.from_spec(latency)
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.seed = seed
+        self.requests = 0
+        self.throttles = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def answer(self, native_request):
+        """
+        Build the response to a request immediately, without latency or failures.
+
+        Args:
+            native_request (dict): Request body in the messages-v1 schema
+
+        Returns:
+            dict: Response body in the Nova format, with a usage block
+        """
+        texts = [item["text"] for item in native_request.get("system", [])]
+        for message in native_request.get("messages", []):
+            texts += [item["text"] for item in message["content"] if "text" in item]
+        prompt_text = "\n".join(texts)
+
+        text = default_response(prompt_text)
+        for match, response in self.responses:
+            if match in prompt_text:
+                text = response
+                break
+
+        input_tokens = IMAGE_TOKENS + len(prompt_text) // CHARS_PER_TOKEN
+        output_tokens = len(text) // CHARS_PER_TOKEN + 1
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+            "stopReason": "end_turn",
+            "usage": {
+                "inputTokens": input_tokens,
+                "outputTokens": output_tokens,
+                "totalTokens": input_tokens + output_tokens,
+            },
+        }
+
+    def invoke(self, native_request):
+        with self._lock:
+            self.requests += 1
+            rng = random.Random(f"{self.seed}:{self.requests}")
+
+        if rng.random() < self.throttle_rate:
+            with self._lock:
+                self.throttles += 1
+            raise MockError("ThrottlingException", 429, "Too many requests, please wait")
+
+        time.sleep(self.latency.sample(rng))
+        if rng.random() < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            raise MockError("ServiceUnavailableException", 503, "Service unavailable")
+        return self.answer(native_request)
+
+    def stats(self):
+        """
+        Get mock statistics.
+
+        Returns:
+            dict: Number of requests, throttled requests and failed requests
+        """
+        with self._lock:
+            return {"requests": self.requests, "throttles": self.throttles, "errors": self.errors}
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """Answers InvokeModel requests (POST /model/<model id>/invoke) with the server's mock."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.endswith("/invoke"):
+            self._send(404, {"message": f"Unknown path {self.path}"}, "ResourceNotFoundException")
+            return
+        try:
+            response = self.server.backend.invoke(json.loads(body))
+        except MockError as e:
+            self._send(e.status, {"message": str(e)}, e.code)
+            return
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {"message": f"Malformed request: {e}"}, "ValidationException")
+            return
+        self._send(200, response)
+
+    def _send(self, status, payload, error_type=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if error_type:
+            self.send_header("x-amzn-ErrorType", error_type)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer:
+    """
+    HTTP server answering bedrock-runtime InvokeModel requests with a MockBackend.
+
+    Can be used as a context manager, which starts the server in a background
+    thread and stops it on exit.
+    """
+
+    def __init__(self, backend=None, host="127.0.0.1", port=0):
+        """
+        Create a server.
+
+        Args:
+            backend (MockBackend, optional): Mock answering the requests. Defaults to
+                a mock with default settings
+            host (str, optional): Address to listen on
+            port (int, optional): Port to listen on. 0 picks a free port
+        """
+        self.backend = backend or MockBackend()
+        self._server = ThreadingHTTPServer((host, port), MockRequestHandler)
+        self._server.daemon_threads = True
+        self._server.backend = self.backend
+        self._thread = None
+
+    @property
+    def url(self):
+        """str: Endpoint URL of the server, for AWS_BEDROCK_ENDPOINT_URL."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Serve requests in a background thread.
+
+        Returns:
+            str: Endpoint URL of the server
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self):
+        """Serve requests in this thread until interrupted."""
+        self._server.serve_forever()
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def add_mock_arguments(parser):
+    """
+    Add the command line options configuring a MockBackend.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to add the options to
+    """
+    parser.add_argument(
+        "--mock_latency",
+        default="lognormal:1.0,0.4",
+        help="Latency distribution of mock requests, e.g. constant:0.5, uniform:0.2,1.5, "
+        "normal:1.0,0.3, lognormal:1.0,0.4 or exponential:1.0",
+    )
+    parser.add_argument(
+        "--mock_throttle_rate",
+        type=float,
+        default=0.0,
+        help="Share of mock requests rejected with ThrottlingException",
+    )
+    parser.add_argument(
+        "--mock_error_rate",
+        type=float,
+        default=0.0,
+        help="Share of mock requests failing with ServiceUnavailableException",
+    )
+    parser.add_argument(
+        "--mock_responses",
+        help="JSON file mapping text in the prompts to the response to return",
+    )
+    parser.add_argument("--mock_seed", type=int, default=0, help="Seed of the mock outcomes")
+
+
+def create_mock_backend(args):
+    """
+    Build a MockBackend from parsed command line options.
+
+    Args:
+        args (argparse.Namespace): Options added by add_mock_arguments
+
+    Returns:
+        MockBackend: The mock
+    """
+    return MockBackend(
+        responses=load_responses(args.mock_responses) if args.mock_responses else None,
+        latency=args.mock_latency,
+        throttle_rate=args.mock_throttle_rate,
+        error_rate=args.mock_error_rate,
+        seed=args.mock_seed,
+    )
+
+
+def main():
+    """Main entry point for the mock server script."""
+    parser = argparse.ArgumentParser(
+        description="Serve a mock of the Bedrock InvokeModel API for offline load testing"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockServer(create_mock_backend(args), args.host, args.port)
+    print(f"Mock Bedrock endpoint listening on {server.url}")
+    print(f"Point the tagger at it with: export AWS_BEDROCK_ENDPOINT_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        stats = server.backend.stats()
+        print(
+            f"Served {stats['requests']} requests ({stats['throttles']} throttled, "
+            f"{stats['errors']} failed)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,565 @@
+"""
+Streaming workflow module.
+
+Runs the workflow one image at a time instead of one step at a time: each
+image moves through conversion, validation, classification, organization,
+tag generation and the upload CSV as soon as the previous stage is done
+with it. Stages are connected by bounded queues, so HEIC conversion overlaps
+with Bedrock requests and upload batches are written as they fill up.
+"""
+
+import os
+import csv
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from . import binary_classifier, tag_generator
+from .batch_splitter import BatchWriter
+from .bedrock_client import (
+    get_aws_region,
+    get_bedrock_client,
+    process_image,
+    read_prompt,
+    remove_temp_files,
+    write_response,
+)
+from .clean_files import check_image
+from .convert_images import convert_file, is_convertible_format
+from .file_organizer import (
+    create_result_folders,
+    organize_file,
+    parse_classification,
+    read_classification,
+)
+from .rate_limiter import RateLimiter
+from .result_analyzer import CSV_COLUMNS, make_row
+from .step_result import StepResult
+from .structured_output import CLASSIFY_FIELDS, COMBINED_FIELDS, TAG_FIELDS, ResponseSchema
+
+
+# Put on a queue after the last item
+_DONE = object()
+
+
+@dataclass
+class ImageItem:
+    """
+    An image moving through the streaming workflow.
+
+    Attributes:
+        name (str): Filename of the image in the raw export folder
+        path (str): Current path of the image
+        input_hash (str): Content hash of the image, once computed for the ledger
+    """
+
+    name: str
+    path: str
+    input_hash: str = None
+
+    @property
+    def stem(self):
+        """str: Filename of the current image without extension."""
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+
+class Stage:
+    """
+    Worker threads applying a function to the items of an input queue.
+
+    The function returns the item to pass on to the next stage, or None to
+    drop it. Items whose function raises are dropped and reported with
+    ``on_error``. Once the input ends, the last worker to finish forwards the
+    end marker, so the next stage only ends after all items were passed on.
+    """
+
+    def __init__(
+        self, name, func, workers, inbox, outbox=None, on_error=None, ledger=None, metrics=None
+    ):
+        """
+        Create the stage without starting its threads.
+
+        Args:
+            name (str): Name of the stage
+            func (callable): Called with each item
+            workers (int): Number of worker threads
+            inbox (queue.Queue): Input queue
+            outbox (queue.Queue, optional): Output queue. None for the last stage
+            on_error (callable, optional): Called with (stage_name, item, exception)
+            ledger (Ledger, optional): Records the result of each item under the
+                filename it had when entering the stage
+            metrics (Metrics, optional): Records the time spent on and the result of each item
+        """
+        self.name = name
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.on_error = on_error
+        self.ledger = ledger
+        self.metrics = metrics
+        self.counts = {"in": 0, "out": 0, "dropped": 0, "failed": 0}
+        self.busy = 0.0
+        self._active = max(1, workers)
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"{name}-{index}", daemon=True)
+            for index in range(self._active)
+        ]
+
+    def start(self):
+        """Start the worker threads."""
+        for thread in self._threads:
+            thread.start()
+
+    def join(self):
+        """Wait until all items were processed."""
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                # Leave the marker for the other workers of this stage
+                self.inbox.put(_DONE)
+                with self._lock:
+                    self._active -= 1
+                    last = self._active == 0
+                if last and self.outbox is not None:
+                    self.outbox.put(_DONE)
+                return
+
+            input_path = item.path
+            start = time.perf_counter()
+            error = None
+            try:
+                result = self.func(item)
+                status = "dropped" if result is None else "out"
+            except Exception as e:
+                result = None
+                status = "failed"
+                error = str(e)
+                if self.on_error is not None:
+                    self.on_error(self.name, item, e)
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.counts["in"] += 1
+                self.counts[status] += 1
+                self.busy += duration
+            if self.metrics is not None:
+                self.metrics.observe("stage_seconds", duration, stage=self.name, phase="stream")
+                self.metrics.count("images_total", stage=self.name, status=status)
+            if self.ledger is not None:
+                self.ledger.record(
+                    os.path.basename(input_path),
+                    self.name,
+                    "done" if status == "out" else status,
+                    duration,
+                    input_path,
+                    item.input_hash,
+                    error,
+                )
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)
+
+
+class StreamingWorkflow:
+    """
+    Pipelined workflow over the images of a base folder.
+
+    Writes the same folders and files as the step by step workflow (steps 0-3
+    and 5-7); the upload CSV and batch rows are in completion order rather
+    than sorted by filename.
+    """
+
+    def __init__(
+        self,
+        base_folder,
+        concurrency=1,
+        combined=False,
+        link_mode="copy",
+        workers=None,
+        queue_size=None,
+        batch_size=100,
+        region=None,
+        **options,
+    ):
+        """
+        Set up the folders, prompts and shared Bedrock resources.
+
+        Args:
+            base_folder (str): Base working directory containing 1_raw_export
+            concurrency (int, optional): Number of concurrent Bedrock requests
+            combined (bool, optional): Classify and generate tags in a single request
+            link_mode (str, optional): How images are placed in the result and batch folders
+            workers (int, optional): Number of HEIC conversion processes. Defaults to the CPU count
+            queue_size (int, optional): Capacity of the queues between stages.
+                Defaults to twice the concurrency, at least 8
+            batch_size (int, optional): Number of images per upload batch
+            region (str, optional): AWS region. Defaults to environment variable or us-east-1
+            **options: Other process_image keyword arguments: max_edge, quality,
+                cache, rate_limiter, backend, metrics, max_reasks and store, a Ledger as
+                ledger and structured to ask for JSON answers (see structured_output.py). Batch
+                inference options are not supported, since images are sent one at a time
+        """
+        self.base_folder = base_folder
+        self.raw_folder = os.path.join(base_folder, "1_raw_export")
+        self.label_folder = os.path.join(base_folder, "2_binary_output")
+        self.dest_folder = os.path.join(base_folder, "3_copied_dest")
+        self.tag_folder = os.path.join(base_folder, "5_tag_output")
+        self.csv_file = os.path.join(base_folder, "6_image_tags.csv")
+        self.batch_folder = os.path.join(base_folder, "7_batch_output")
+        self.error_file = os.path.join(base_folder, "error_log.txt")
+
+        self.concurrency = max(1, concurrency)
+        self.combined = combined
+        self.link_mode = link_mode
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size or max(8, 2 * self.concurrency)
+        self.batch_size = batch_size
+        self.region = region or get_aws_region()
+
+        self.rate_limiter = options.pop("rate_limiter", None) or RateLimiter(
+            max_concurrency=self.concurrency
+        )
+        self.cache = options.pop("cache", None)
+        self.ledger = options.pop("ledger", None)
+        self.metrics = options.get("metrics")
+        self.store = options.get("store")
+        options.pop("poll_interval", None)
+        if options.pop("batch", None) is not None:
+            raise ValueError("The streaming workflow cannot send images as batch jobs")
+        structured = options.pop("structured", False)
+        self.image_options = options
+
+        if combined:
+            classify_prompts = ("system_prompt_combined.txt", "prompt_combined.txt")
+            self.save_classification = partial(
+                binary_classifier.save_combined_response, tag_output_folder=self.tag_folder
+            )
+        else:
+            classify_prompts = ("system_prompt_binary.txt", "prompt_binary.txt")
+            self.save_classification = write_response
+        self.classify_prompts = tuple(
+            read_prompt(os.path.join(binary_classifier.CONFIG_DIR, name))
+            for name in classify_prompts
+        )
+        self.tag_prompts = tuple(
+            read_prompt(os.path.join(tag_generator.CONFIG_DIR, name))
+            for name in ("system_prompt.txt", "prompt.txt")
+        )
+        self.classify_schema = self.tag_schema = None
+        if structured:
+            self.classify_schema = ResponseSchema(COMBINED_FIELDS if combined else CLASSIFY_FIELDS)
+            self.tag_schema = ResponseSchema(TAG_FIELDS)
+
+        # Classification and tag requests share one client and one rate limiter
+        self.client = None
+        if self.image_options.get("backend") is None:
+            self.client = get_bedrock_client(
+                self.region, max_pool_connections=2 * self.concurrency
+            )
+        self.pool = None
+        self.csv = None
+        self.csv_writer = None
+        self.batches = None
+        self.skipped = {}
+        self.started_at = None
+        self.first_batch_after = None
+        self._lock = threading.Lock()
+
+    def log_error(self, stage, item, error):
+        """
+        Print and log an image that failed in a stage.
+
+        Args:
+            stage (str): Name of the stage
+            item (ImageItem): Image that failed
+            error (Exception): Error raised by the stage
+        """
+        err_msg = f"Error in {stage} for {item.name}: {error}"
+        print(err_msg)
+        with self._lock:
+            with open(self.error_file, "a") as ef:
+                ef.write(err_msg + "\n")
+
+    def skip(self, item, reason):
+        """
+        Drop an image from the workflow.
+
+        Args:
+            item (ImageItem): Image to drop
+            reason (str): Reason shown in the summary
+        """
+        print(f"Skipping {item.name}: {reason}")
+        with self._lock:
+            self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def convert(self, item):
+        """Convert HEIC/HEIF images to JPEG and normalize JPEG extensions to .jpeg."""
+        base, ext = os.path.splitext(item.path)
+        if is_convertible_format(item.path):
+            if self.pool is not None:
+                success, error = self.pool.submit(convert_file, item.path).result()
+            else:
+                success, error = convert_file(item.path)
+            if not success:
+                raise RuntimeError(error)
+            item.path = base + ".jpeg"
+        elif ext.lower() in [".jpg", ".jpeg"]:
+            if ext != ".jpeg":
+                os.rename(item.path, base + ".jpeg")
+                item.path = base + ".jpeg"
+        else:
+            self.skip(item, "unsupported format")
+            return None
+        return item
+
+    def validate(self, item):
+        """Drop images that are too small or too large for upload."""
+        record = check_image(item.path, os.path.getsize(item.path))
+        if record["delete"]:
+            self.skip(item, record["reason"])
+            return None
+        return item
+
+    def needs_request(self, item, stage, output_file):
+        """
+        Check whether an image needs a Bedrock request in a stage.
+
+        Args:
+            item (ImageItem): Image to check
+            stage (str): Name of the stage
+            output_file (str): Response file of the image
+
+        Returns:
+            bool: False if the response exists and, with a ledger, the image is unchanged
+        """
+        image = os.path.basename(item.path)
+        if self.ledger is None:
+            if self.store is not None:
+                return not self.store.has(image, stage)
+            return not os.path.exists(output_file)
+        up_to_date, item.input_hash = self.ledger.is_up_to_date(
+            image, stage, item.path, output_file, self.store
+        )
+        return not up_to_date
+
+    def classify(self, item):
+        """Classify an image with Bedrock unless it already has a classification."""
+        output_file = os.path.join(self.label_folder, f"{item.stem}_binary_response.txt")
+        if self.needs_request(item, "classify", output_file):
+            process_image(
+                item.path,
+                output_file,
+                *self.classify_prompts,
+                region=self.region,
+                client=self.client,
+                save_response=self.save_classification,
+                cache=self.cache,
+                rate_limiter=self.rate_limiter,
+                image_hash=item.input_hash,
+                stage="classify",
+                schema=self.classify_schema,
+                **self.image_options,
+            )
+        return item
+
+    def organize(self, item):
+        """Place an image in the result folders; only "high" images continue."""
+        label_file = os.path.join(self.label_folder, f"{item.stem}_binary_response.txt")
+        if self.store is not None:
+            content = self.store.get(os.path.basename(item.path), "classify")
+            classification = parse_classification(content) if content is not None else None
+        else:
+            classification = read_classification(label_file)
+        if classification is None:
+            raise ValueError(f"Insufficient classification data in {label_file}")
+        folders = organize_file(item.path, *classification, self.dest_folder, self.link_mode)
+        if "high" not in folders:
+            return None
+        item.path = os.path.join(self.dest_folder, "high", os.path.basename(item.path))
+        return item
+
+    def tag(self, item):
+        """Generate tags with Bedrock unless the image already has a tag response."""
+        output_file = os.path.join(self.tag_folder, f"{item.stem}_response.txt")
+        if self.needs_request(item, "tag", output_file):
+            process_image(
+                item.path,
+                output_file,
+                *self.tag_prompts,
+                region=self.region,
+                client=self.client,
+                cache=self.cache,
+                rate_limiter=self.rate_limiter,
+                image_hash=item.input_hash,
+                stage="tag",
+                schema=self.tag_schema,
+                **self.image_options,
+            )
+        return item
+
+    def write_row(self, item):
+        """Append the tag row of an image to the upload CSV and its batch."""
+        image = os.path.basename(item.path)
+        if self.store is not None:
+            content = self.store.get(image, "tag")
+            if content is None:
+                raise ValueError(f"No tag response for {image} in {self.store.path}")
+        else:
+            with open(os.path.join(self.tag_folder, f"{item.stem}_response.txt"), "r") as f:
+                content = f.read()
+        row = make_row(image, content.strip())
+        self.csv_writer.writerow(row)
+        self.csv.flush()
+        batch = self.batches.add(item.path, row)
+        if batch is not None:
+            self.batch_ready(batch)
+        return item
+
+    def batch_ready(self, batch):
+        """
+        Report a completed upload batch.
+
+        Args:
+            batch (int): Number of the batch
+        """
+        elapsed = time.perf_counter() - self.started_at
+        if self.first_batch_after is None:
+            self.first_batch_after = elapsed
+        print(f"Batch {batch} ready for upload after {elapsed:.1f}s")
+
+    def list_images(self):
+        """
+        List the files of the raw export folder.
+
+        Returns:
+            list: ImageItem of each file, sorted by filename
+        """
+        return [
+            ImageItem(entry.name, entry.path)
+            for entry in sorted(os.scandir(self.raw_folder), key=lambda entry: entry.name)
+            if entry.is_file() and not entry.name.startswith(".")
+        ]
+
+    def run(self):
+        """
+        Process all images of the raw export folder.
+
+        Returns:
+            StepResult: Result with the number of images leaving each stage,
+                skipped and failed images and upload batches
+        """
+        assert os.path.exists(self.raw_folder), f"Raw input path {self.raw_folder} does not exist."
+        for folder in [self.label_folder, self.tag_folder]:
+            os.makedirs(folder, exist_ok=True)
+            remove_temp_files(folder)
+        create_result_folders(self.dest_folder)
+
+        items = self.list_images()
+        print(f"Streaming {len(items)} files from {self.raw_folder}...")
+        self.started_at = time.perf_counter()
+
+        if self.workers > 1 and any(is_convertible_format(item.path) for item in items):
+            # Worker threads are already running when the pool starts processes,
+            # so do not fork
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        self.csv = open(self.csv_file, "w", newline="")
+        self.csv_writer = csv.DictWriter(
+            self.csv, fieldnames=CSV_COLUMNS, lineterminator=os.linesep
+        )
+        self.csv_writer.writeheader()
+        self.batches = BatchWriter(self.batch_folder, CSV_COLUMNS, self.batch_size, self.link_mode)
+
+        stages_spec = [
+            ("convert", self.convert, self.workers if self.pool is not None else 1),
+            ("validate", self.validate, 2),
+            ("classify", self.classify, self.concurrency),
+            ("organize", self.organize, 1),
+            ("tag", self.tag, self.concurrency),
+            ("write_row", self.write_row, 1),
+        ]
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in stages_spec]
+        stages = [
+            Stage(
+                name,
+                func,
+                workers,
+                queues[index],
+                queues[index + 1] if index + 1 < len(queues) else None,
+                self.log_error,
+                self.ledger,
+                self.metrics,
+            )
+            for index, (name, func, workers) in enumerate(stages_spec)
+        ]
+
+        try:
+            for stage in stages:
+                stage.start()
+            # Blocks while the first stage is busy, so files are read as they are needed
+            for item in items:
+                queues[0].put(item)
+            queues[0].put(_DONE)
+            for stage in stages:
+                stage.join()
+        finally:
+            batch = self.batches.close()
+            if batch is not None:
+                self.batch_ready(batch)
+            self.csv.close()
+            if self.ledger is not None:
+                self.ledger.flush()
+            if self.store is not None:
+                self.store.flush()
+            if self.pool is not None:
+                self.pool.shutdown()
+
+        counts = {stage.name: stage.counts["out"] for stage in stages}
+        counts["skipped"] = sum(self.skipped.values())
+        counts["failed"] = sum(stage.counts["failed"] for stage in stages)
+        counts["batches"] = self.batches.batches
+        counts["bytes_saved"] = self.batches.stats.bytes_saved
+        self.print_summary(stages)
+        return StepResult("streaming_workflow", counts=counts)
+
+    def print_summary(self, stages):
+        """
+        Print the images passed on, dropped and failed per stage and the time spent in each.
+
+        Args:
+            stages (list): Stage objects of the run
+        """
+        print("\nStreaming summary:")
+        for stage in stages:
+            counts = stage.counts
+            print(
+                f"  - {stage.name}: {counts['out']} passed, {counts['dropped']} dropped, "
+                f"{counts['failed']} failed ({stage.busy:.1f}s busy)"
+            )
+        for reason, count in sorted(self.skipped.items()):
+            print(f"  - skipped ({reason}): {count}")
+        print(f"  - upload batches: {self.batches.batches} ({self.batches.files} images)")
+        if self.first_batch_after is not None:
+            print(f"  - first batch ready after {self.first_batch_after:.1f}s")
+        print(f"Rows saved to {self.csv_file}")
+
+
+def run_pipeline(base_folder, **kwargs):
+    """
+    Run the streaming workflow as a single step.
+
+    Args:
+        base_folder (str): Base working directory containing 1_raw_export
+        **kwargs: StreamingWorkflow keyword arguments
+
+    Returns:
+        StepResult: Result of the run
+    """
+    return StreamingWorkflow(base_folder, **kwargs).run()
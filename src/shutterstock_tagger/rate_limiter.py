@@ -0,0 +1,325 @@
+"""
+Rate limiting module.
+
+Keeps AWS Bedrock requests under the account quota with token buckets for
+requests and tokens per minute, adapts the number of in-flight requests to
+throttling (additive increase, multiplicative decrease), and retries
+throttled or transient failures with jittered exponential backoff.
+"""
+
+import time
+import random
+import threading
+
+
+# Rough number of model tokens (input and output) used by one image request
+DEFAULT_TOKENS_PER_REQUEST = 2000
+
+DEFAULT_MAX_ATTEMPTS = 6
+
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+}
+
+TRANSIENT_ERROR_CODES = {
+    "InternalServerException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "RequestTimeout",
+}
+
+# Connection level botocore exceptions, matched by name to avoid importing botocore
+TRANSIENT_EXCEPTION_NAMES = {
+    "EndpointConnectionError",
+    "ConnectionClosedError",
+    "ConnectTimeoutError",
+    "ReadTimeoutError",
+}
+
+
+def get_error_code(exc):
+    """
+    Get the AWS error code and HTTP status of an exception.
+
+    Args:
+        exc (Exception): Exception raised by a request
+
+    Returns:
+        tuple: (error_code, http_status), either of which may be None
+    """
+    response = getattr(exc, "response", None)
+    if not isinstance(response, dict):
+        return None, None
+    code = response.get("Error", {}).get("Code")
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return code, status
+
+
+def is_throttling_error(exc):
+    """
+    Check if an exception signals that the request was throttled.
+
+    Args:
+        exc (Exception): Exception raised by a request
+
+    Returns:
+        bool: True if the request was throttled
+    """
+    code, status = get_error_code(exc)
+    return code in THROTTLING_ERROR_CODES or status == 429
+
+
+def is_retryable_error(exc):
+    """
+    Check if a failed request is worth retrying.
+
+    Args:
+        exc (Exception): Exception raised by a request
+
+    Returns:
+        bool: True for throttling, 5xx and connection errors
+    """
+    if is_throttling_error(exc):
+        return True
+    if type(exc).__name__ in TRANSIENT_EXCEPTION_NAMES:
+        return True
+    code, status = get_error_code(exc)
+    return code in TRANSIENT_ERROR_CODES or (status is not None and status >= 500)
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    """
+    Compute a jittered exponential backoff delay ("full jitter").
+
+    Args:
+        attempt (int): Number of failed attempts so far, starting at 1
+        base_delay (float, optional): Delay ceiling after the first failure in seconds
+        max_delay (float, optional): Maximum delay in seconds
+
+    Returns:
+        float: Delay in seconds
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at a per-minute rate.
+    """
+
+    def __init__(self, rate_per_minute, burst_seconds=10.0):
+        """
+        Create a full bucket.
+
+        Args:
+            rate_per_minute (float): Tokens added per minute
+            burst_seconds (float, optional): Capacity of the bucket in seconds of refill
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, amount=1.0):
+        """
+        Take tokens from the bucket, waiting until enough are available.
+
+        Args:
+            amount (float, optional): Number of tokens to take. Capped at the capacity
+        """
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount):
+        """
+        Correct an earlier estimate once the actual usage is known.
+
+        Args:
+            amount (float): Tokens to take (positive) or give back (negative).
+                The bucket may go negative, which delays later requests
+        """
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AdaptiveConcurrency:
+    """
+    Limit on in-flight requests adjusted by additive increase, multiplicative decrease.
+
+    Every successful request raises the limit by 1/limit, i.e. by one per
+    window of ``limit`` successes. A throttled request multiplies it by
+    ``decrease_factor``, at most once per ``cooldown`` seconds so that a burst
+    of throttling errors from the same window only counts once.
+    """
+
+    def __init__(self, max_limit, min_limit=1, decrease_factor=0.5, cooldown=5.0):
+        """
+        Create a controller starting at the maximum limit.
+
+        Args:
+            max_limit (int): Maximum number of in-flight requests
+            min_limit (int, optional): Minimum number of in-flight requests
+            decrease_factor (float, optional): Factor applied to the limit on throttling
+            cooldown (float, optional): Minimum seconds between two decreases
+        """
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free request slot."""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        """
+        Free a request slot and adjust the limit.
+
+        Args:
+            throttled (bool, optional): Whether the request was throttled
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+
+class RateLimiter:
+    """
+    Request policy combining quota buckets, adaptive concurrency and retries.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=1,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        tokens_per_request=DEFAULT_TOKENS_PER_REQUEST,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        base_delay=1.0,
+        max_delay=60.0,
+    ):
+        """
+        Create a rate limiter.
+
+        Args:
+            max_concurrency (int, optional): Maximum number of in-flight requests
+            requests_per_minute (float, optional): Request quota. None disables the limit
+            tokens_per_minute (float, optional): Token quota. None disables the limit
+            tokens_per_request (int, optional): Tokens charged per attempt until the
+                actual usage is reported with record_usage. Failed attempts get
+                their charge back
+            max_attempts (int, optional): Attempts per request, including the first
+            base_delay (float, optional): Backoff ceiling after the first failure in seconds
+            max_delay (float, optional): Maximum backoff delay in seconds
+        """
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.tokens_per_request = tokens_per_request
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def record_usage(self, tokens):
+        """
+        Report the actual number of tokens used by a request.
+
+        Corrects the estimate charged by call for the successful attempt.
+
+        Args:
+            tokens (int): Input and output tokens reported by the model
+        """
+        if self.token_bucket is not None:
+            self.token_bucket.adjust(tokens - self.tokens_per_request)
+
+    def call(self, func):
+        """
+        Call a request function under the rate limits, retrying failures.
+
+        Args:
+            func (callable): Function sending one request, called without arguments
+
+        Returns:
+            The return value of func
+
+        Raises:
+            Exception: The last error if the request is not retryable or all
+                attempts failed
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.request_bucket is not None:
+                self.request_bucket.acquire()
+            if self.token_bucket is not None:
+                self.token_bucket.acquire(self.tokens_per_request)
+
+            self.concurrency.acquire()
+            try:
+                result = func()
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                self.concurrency.release(throttled=throttled)
+                # A failed request used no model tokens
+                if self.token_bucket is not None:
+                    self.token_bucket.adjust(-self.tokens_per_request)
+                if not is_retryable_error(e) or attempt >= self.max_attempts:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                    self.throttles += int(throttled)
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                print(f"Retrying after {type(e).__name__} (attempt {attempt}) in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            self.concurrency.release()
+            return result
+
+    def stats(self):
+        """
+        Get rate limiter statistics.
+
+        Returns:
+            dict: Number of retries and throttled requests, and the current concurrency limit
+        """
+        with self._lock:
+            return {
+                "retries": self.retries,
+                "throttles": self.throttles,
+                "concurrency_limit": int(self.concurrency.limit),
+            }
@@ -0,0 +1,214 @@
+"""
+Response cache module.
+
+Stores AWS Bedrock responses in a local SQLite database keyed by the image
+content, prompts, model and inference parameters, so re-running a shoot or
+re-importing already processed images does not call Bedrock again.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "shutterstock_tagger", "responses.sqlite"
+)
+
+
+def hash_file(filepath, chunk_size=1024 * 1024):
+    """
+    Compute the SHA-256 hash of a file's content.
+
+    Args:
+        filepath (str): Path to the file
+        chunk_size (int, optional): Number of bytes read at a time
+
+    Returns:
+        str: Hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(image_hash, system_prompt, prompt, model_id, inference_params, **options):
+    """
+    Build the cache key for a request.
+
+    Args:
+        image_hash (str): Hash of the image file content
+        system_prompt (str): System prompt for the AI
+        prompt (str): User prompt for the AI
+        model_id (str): Model ID or ARN
+        inference_params (dict): Inference parameters of the request
+        **options: Other settings that change the request, e.g. image preprocessing
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    payload = json.dumps(
+        {
+            "image": image_hash,
+            "system": system_prompt,
+            "prompt": prompt,
+            "model": model_id,
+            "inference": inference_params,
+            "options": options,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent, thread-safe cache of Bedrock responses.
+
+    Entries are evicted when they are older than ``max_age_days`` or, once the
+    cache holds more than ``max_entries`` entries, least recently used first.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=100_000, max_age_days=90):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path (str, optional): Path of the SQLite database file
+            max_entries (int, optional): Maximum number of entries kept. None disables the limit
+            max_age_days (float, optional): Maximum age of entries in days. None disables the limit
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key):
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): Cache key from make_cache_key
+
+        Returns:
+            str: Cached response text, or None on a miss
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, response):
+        """
+        Store a response.
+
+        Args:
+            key (str): Cache key from make_cache_key
+            response (str): Response text from the API
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._conn.commit()
+
+    def evict(self):
+        """
+        Remove expired entries and trim the cache to its maximum size.
+
+        Returns:
+            int: Number of entries removed
+        """
+        removed = 0
+        with self._lock:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute(
+                    "DELETE FROM responses WHERE created_at < ?", (cutoff,)
+                ).rowcount
+            if self.max_entries is not None:
+                removed += self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                ).rowcount
+            self._conn.commit()
+        return removed
+
+    def stats(self):
+        """
+        Get cache statistics.
+
+        Returns:
+            dict: Number of entries, hits and misses since the cache was opened, and hit rate
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    """Main entry point for the response cache script."""
+    parser = argparse.ArgumentParser(
+        description="Apply eviction to the Bedrock response cache and show its size"
+    )
+    parser.add_argument("--cache_path", default=DEFAULT_CACHE_PATH, help="Cache database file")
+    parser.add_argument("--max_entries", type=int, default=100_000, help="Maximum entries to keep")
+    parser.add_argument(
+        "--max_age_days", type=float, default=90, help="Maximum age of entries in days"
+    )
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.cache_path, args.max_entries, args.max_age_days)
+    print(f"Cache: {args.cache_path}")
+    print(f"Entries: {cache.stats()['entries']}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+"""
+Response store module.
+
+Keeps the model responses of a shoot in a single SQLite database instead of
+one ``_binary_response.txt`` or ``_response.txt`` file per image, which at
+tens of thousands of images means as many tiny files to create, stat and
+open again. Each record holds the image filename, the stage ("classify" or
+"tag"), a hash of the prompts, the response, the token usage and the
+request latency. Records are indexed by stage and image, so the readers
+look up a response or list the responses of a stage without touching the
+file system.
+
+The response is stored as the text a response file would hold (a JSON
+string, or a JSON object in structured mode), so the exporter writes the
+legacy per-file layout byte for byte and the readers parse both alike.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+import threading
+
+
+RESPONSE_STORE_FILE = "responses.sqlite"
+
+# Response file suffix and workflow folder of each stage in the per-file layout
+STAGE_SUFFIXES = {"classify": "_binary_response.txt", "tag": "_response.txt"}
+STAGE_FOLDERS = {"classify": "2_binary_output", "tag": "5_tag_output"}
+
+
+def hash_prompt(system_prompt, prompt):
+    """
+    Hash the prompts of a request.
+
+    Args:
+        system_prompt (str): System prompt for the AI
+        prompt (str): User prompt for the AI, including any output instructions
+
+    Returns:
+        str: SHA-256 hex digest of the prompts
+    """
+    payload = json.dumps({"system": system_prompt, "prompt": prompt})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseStore:
+    """
+    Thread-safe store of the model responses of a shoot.
+
+    Records are committed in batches of ``commit_every`` records or every
+    ``commit_interval`` seconds, whichever comes first, like the ledger.
+    """
+
+    def __init__(self, path, commit_every=50, commit_interval=1.0):
+        """
+        Open (or create) the store database.
+
+        Args:
+            path (str): Path of the SQLite database file
+            commit_every (int, optional): Maximum number of uncommitted records
+            commit_interval (float, optional): Maximum seconds between commits
+        """
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self._pending = 0
+        self._committed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "stage TEXT NOT NULL, image TEXT NOT NULL, prompt_hash TEXT, "
+            "response TEXT NOT NULL, input_tokens INTEGER, output_tokens INTEGER, "
+            "latency REAL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (stage, image))"
+        )
+        self._conn.commit()
+
+    def _commit_if_due(self):
+        self._pending += 1
+        now = time.monotonic()
+        if self._pending >= self.commit_every or now - self._committed_at >= self.commit_interval:
+            self._conn.commit()
+            self._pending = 0
+            self._committed_at = now
+
+    def put(
+        self,
+        image,
+        stage,
+        response,
+        prompt_hash=None,
+        input_tokens=None,
+        output_tokens=None,
+        latency=None,
+    ):
+        """
+        Store the response of an image in a stage, replacing any earlier one.
+
+        Args:
+            image (str): Filename of the image
+            stage (str): Name of the stage, e.g. "classify"
+            response (str or dict): Response text, or the validated object in
+                structured mode
+            prompt_hash (str, optional): Hash of the prompts from hash_prompt
+            input_tokens (int, optional): Input tokens of the request
+            output_tokens (int, optional): Output tokens of the request
+            latency (float, optional): Seconds spent waiting for the model
+        """
+        content = json.dumps(response, indent=2)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (stage, image, prompt_hash, response, "
+                "input_tokens, output_tokens, latency, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    stage,
+                    image,
+                    prompt_hash,
+                    content,
+                    input_tokens,
+                    output_tokens,
+                    latency,
+                    time.time(),
+                ),
+            )
+            self._commit_if_due()
+
+    def get(self, image, stage):
+        """
+        Look up the response of an image in a stage.
+
+        Args:
+            image (str): Filename of the image
+            stage (str): Name of the stage
+
+        Returns:
+            str: Content the response file would hold, or None if there is no response
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE stage = ? AND image = ?", (stage, image)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_record(self, image, stage):
+        """
+        Look up the record of an image in a stage.
+
+        Args:
+            image (str): Filename of the image
+            stage (str): Name of the stage
+
+        Returns:
+            dict: The record's columns, or None if there is no response
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT * FROM responses WHERE stage = ? AND image = ?", (stage, image)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def has(self, image, stage):
+        """
+        Check whether an image has a response in a stage.
+
+        Args:
+            image (str): Filename of the image
+            stage (str): Name of the stage
+
+        Returns:
+            bool: True if the response exists
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM responses WHERE stage = ? AND image = ?", (stage, image)
+            ).fetchone() is not None
+
+    def images(self, stage, updated_after=None):
+        """
+        List the images with a response in a stage.
+
+        Args:
+            stage (str): Name of the stage
+            updated_after (float, optional): Only list responses stored after this
+                Unix timestamp
+
+        Returns:
+            list: Filenames of the images, sorted
+        """
+        query = "SELECT image FROM responses WHERE stage = ?"
+        params = [stage]
+        if updated_after is not None:
+            query += " AND updated_at > ?"
+            params.append(updated_after)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY image", params).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_responses(self, stage):
+        """
+        Iterate over the responses of a stage in image order.
+
+        Args:
+            stage (str): Name of the stage
+
+        Yields:
+            tuple: (image, content) for each response
+        """
+        last = ""
+        while True:
+            # Read in pages, so other threads can use the store meanwhile
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT image, response FROM responses WHERE stage = ? AND image > ? "
+                    "ORDER BY image LIMIT 1000",
+                    (stage, last),
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][0]
+
+    def remove(self, stems):
+        """
+        Remove the responses of images, in every stage.
+
+        Images are matched by filename without extension, like Ledger.forget.
+
+        Args:
+            stems (iterable): Filenames without extension
+
+        Returns:
+            int: Number of responses removed
+        """
+        stems = set(stems)
+        with self._lock:
+            images = [
+                row[0]
+                for row in self._conn.execute("SELECT DISTINCT image FROM responses").fetchall()
+                if os.path.splitext(row[0])[0] in stems
+            ]
+            removed = 0
+            for image in images:
+                removed += self._conn.execute(
+                    "DELETE FROM responses WHERE image = ?", (image,)
+                ).rowcount
+            self._conn.commit()
+        return removed
+
+    def summary(self):
+        """
+        Count the responses and sum the usage of each stage.
+
+        Returns:
+            dict: Mapping of stage name to responses, input and output tokens
+                and mean latency
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, COUNT(*), SUM(input_tokens), SUM(output_tokens), AVG(latency) "
+                "FROM responses GROUP BY stage"
+            ).fetchall()
+        return {
+            stage: {
+                "responses": count,
+                "input_tokens": input_tokens or 0,
+                "output_tokens": output_tokens or 0,
+                "mean_latency": latency,
+            }
+            for stage, count, input_tokens, output_tokens, latency in rows
+        }
+
+    def export(self, stage, folder, suffix=None):
+        """
+        Write the responses of a stage as response files, the per-file layout.
+
+        Files are written like bedrock_client.write_response, to a temporary
+        file renamed into place.
+
+        Args:
+            stage (str): Name of the stage
+            folder (str): Folder of the response files
+            suffix (str, optional): Response file suffix. Defaults to the stage's
+                suffix in STAGE_SUFFIXES
+
+        Returns:
+            int: Number of files written
+        """
+        suffix = suffix or STAGE_SUFFIXES[stage]
+        os.makedirs(folder, exist_ok=True)
+        written = 0
+        for image, content in self.iter_responses(stage):
+            output_file = os.path.join(folder, f"{os.path.splitext(image)[0]}{suffix}")
+            fd, temp_file = tempfile.mkstemp(
+                dir=folder, prefix=f".{os.path.basename(output_file)}.", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(content)
+                os.replace(temp_file, output_file)
+            except BaseException:
+                os.remove(temp_file)
+                raise
+            written += 1
+        return written
+
+    def import_files(self, stage, folder, image_folder=None, suffix=None):
+        """
+        Store the response files of a stage written in the per-file layout.
+
+        Args:
+            stage (str): Name of the stage
+            folder (str): Folder of the response files
+            image_folder (str, optional): Folder of the images, used to recover
+                their extensions. Images not found there are named ``.jpeg``, as
+                result_analyzer names them
+            suffix (str, optional): Response file suffix. Defaults to the stage's
+                suffix in STAGE_SUFFIXES
+
+        Returns:
+            int: Number of responses stored
+        """
+        suffix = suffix or STAGE_SUFFIXES[stage]
+        images = {}
+        if image_folder and os.path.isdir(image_folder):
+            images = {os.path.splitext(name)[0]: name for name in os.listdir(image_folder)}
+        imported = 0
+        for file_name in sorted(os.listdir(folder)):
+            if not file_name.endswith(suffix) or file_name.startswith("."):
+                continue
+            stem = file_name[:-len(suffix)]
+            with open(os.path.join(folder, file_name), "r") as f:
+                content = f.read()
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (stage, image, response, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (stage, images.get(stem, f"{stem}.jpeg"), content, time.time()),
+                )
+                self._commit_if_due()
+            imported += 1
+        self.flush()
+        return imported
+
+    def flush(self):
+        """Commit pending records."""
+        with self._lock:
+            self._conn.commit()
+            self._pending = 0
+            self._committed_at = time.monotonic()
+
+    def close(self):
+        """Commit pending records and close the database connection."""
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+def main():
+    """Main entry point for the response store script."""
+    parser = argparse.ArgumentParser(
+        description="Show the response store of a shoot, or convert it to and from "
+        "one response file per image"
+    )
+    parser.add_argument("--base_folder", required=True, help="Base folder of the shoot")
+    parser.add_argument(
+        "--store", help=f"Store database file. Defaults to {RESPONSE_STORE_FILE} in the base folder"
+    )
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument(
+        "--export",
+        action="store_true",
+        help="Write the responses to 2_binary_output and 5_tag_output as response files",
+    )
+    action.add_argument(
+        "--import",
+        dest="import_files",
+        action="store_true",
+        help="Store the response files of 2_binary_output and 5_tag_output",
+    )
+    args = parser.parse_args()
+
+    path = args.store or os.path.join(args.base_folder, RESPONSE_STORE_FILE)
+    if not args.import_files and not os.path.exists(path):
+        print(f"No response store found at {path}")
+        return
+    store = ResponseStore(path)
+    for stage, folder in STAGE_FOLDERS.items():
+        folder = os.path.join(args.base_folder, folder)
+        if args.export:
+            print(f"Exported {store.export(stage, folder)} {stage} responses to {folder}")
+        elif args.import_files and os.path.isdir(folder):
+            image_folder = os.path.join(
+                args.base_folder, "1_raw_export" if stage == "classify" else "3_copied_dest/high"
+            )
+            imported = store.import_files(stage, folder, image_folder)
+            print(f"Imported {imported} {stage} responses from {folder}")
+    print(f"Responses in {path}:")
+    for stage, summary in sorted(store.summary().items()):
+        latency = summary["mean_latency"]
+        print(
+            f"  - {stage}: {summary['responses']} responses, {summary['input_tokens']} input "
+            f"and {summary['output_tokens']} output tokens"
+            + (f", mean latency {latency:.2f}s" if latency is not None else "")
+        )
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,35 @@ Processes AI-generated tags and creates CSV files for Shutterstock upload.
 """
 
 import os
-import pandas as pd
+import csv
+import json
+import tempfile
 import argparse
+from functools import partial
+from itertools import starmap
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .step_result import StepResult
+from .structured_output import load_response
+
+
+CSV_COLUMNS = [
+    "Filename",
+    "Description",
+    "Keywords",
+    "Categories",
+    "Editorial",
+    "Mature content",
+    "illustration",
+]
+
+# Response files read and parsed at a time in parallel mode
+PARSE_CHUNK_SIZE = 2000
+
+# Response files read by one task of the reader threads
+READ_GROUP_SIZE = 16
+
+# Fewest response files for which parsing in worker processes pays off
+PARALLEL_MIN_FILES = 500
 
 
 def get_content_after_colon(text):
@@ -96,63 +123,444 @@ def extract_content_sections(text):
     return title, tags, category
 
 
-def analyze_output_files(folder_path, output_file):
+def extract_structured_sections(data):
+    """
+    Extract the title, tags, and category from a structured response.
+
+    The values are normalized like those of a text response.
+
+    Args:
+        data (dict): Structured response with title, keywords and categories
+
+    Returns:
+        tuple: (title, tags, category) as strings
+
+    Raises:
+        ValueError: If a field is missing
+    """
+    missing = [name for name in ("title", "keywords", "categories") if name not in data]
+    if missing:
+        raise ValueError(f"Missing fields in the structured response: {', '.join(missing)}")
+
+    title = data["title"].strip()
+    tags = ", ".join(sorted(set(tag.strip() for tag in data["keywords"])))
+    category = ", ".join(data["categories"])
+
+    # If the title is too short, duplicate it for better SEO
+    if len(title.split()) < 5:
+        title = title + " - " + title
+
+    return title, tags, category
+
+
+def make_row(image_file, content):
+    """
+    Build the upload CSV row of an image from its tag response.
+
+    Args:
+        image_file (str): Filename of the image
+        content (str): Content of the response file, text or a structured response
+
+    Returns:
+        dict: Row with a value for each of CSV_COLUMNS
+
+    Raises:
+        ValueError: If the response cannot be parsed
+    """
+    # Extract the title, tags, and category
+    data = load_response(content)
+    if data is not None:
+        title, tags, category = extract_structured_sections(data)
+    else:
+        title, tags, category = extract_content_sections(content)
+    return {
+        "Filename": image_file,
+        "Description": title,
+        "Keywords": tags,
+        "Categories": category,
+        "Editorial": "no",
+        "Mature content": "no",
+        "illustration": "no",
+    }
+
+
+def read_response(file_path):
+    """
+    Read a tag response file.
+
+    Args:
+        file_path (str): Path of the response file
+
+    Returns:
+        tuple: (content, error) - content is None and error the exception if
+            the file could not be read
+    """
+    try:
+        with open(file_path, "r") as f:
+            return f.read().strip(), None
+    except Exception as e:
+        return None, e
+
+
+def parse_response(image_file, content):
+    """
+    Parse the content of a tag response file into a CSV row.
+
+    Module-level so that it can run in worker processes.
+
+    Args:
+        image_file (str): Filename of the image
+        content (str): Raw response text from AI
+
+    Returns:
+        tuple: (row, error) - error is None on success, otherwise row is None
+    """
+    try:
+        return make_row(image_file, content), None
+    except Exception as e:
+        return None, e
+
+
+def read_row(file_path, image_file):
+    """
+    Parse a tag response file into a CSV row, printing parse errors.
+
+    Args:
+        file_path (str): Path of the response file
+        image_file (str): Filename of the image
+
+    Returns:
+        dict: Row of the image, or None if the response could not be parsed
+    """
+    content, error = read_response(file_path)
+    if error is None:
+        row, error = parse_response(image_file, content)
+    if error is not None:
+        print(f"Error processing file {os.path.basename(file_path)}: {error}")
+        return None
+    return row
+
+
+def iter_parsed(items, workers=1, processes=1, read=read_response):
+    """
+    Read and parse response files, yielding the results in the order given.
+
+    With more than one worker, files are read by a thread pool, which hides
+    open and read latency on slow disks, and parsed by a process pool. Files
+    are handled in chunks of PARSE_CHUNK_SIZE, reading the next chunk while
+    the current one is parsed, so memory does not grow with the number of
+    files.
+
+    Args:
+        items (list): (image_file, file_path) pairs
+        workers (int, optional): Number of threads reading response files
+        processes (int, optional): Number of processes parsing responses. Not
+            used for fewer than PARALLEL_MIN_FILES files, where starting the
+            processes takes longer than parsing
+        read (callable, optional): Called with a file_path of items to read the
+            response, returning (content, error) like read_response
+
+    Yields:
+        tuple: (image_file, file_path, row, error) - error is None on success,
+            otherwise row is None
+    """
+    if workers <= 1 and processes <= 1:
+        for image_file, file_path in items:
+            row = None
+            content, error = read(file_path)
+            if error is None:
+                row, error = parse_response(image_file, content)
+            yield image_file, file_path, row, error
+        return
+
+    if not items:
+        return
+    parsers = None
+    if processes > 1 and len(items) >= PARALLEL_MIN_FILES:
+        parsers = ProcessPoolExecutor(max_workers=processes)
+        # Start the worker processes before the reader threads, so that they
+        # are not forked while a thread holds a lock
+        parsers.submit(os.getpid).result()
+    chunks = [
+        items[start:start + PARSE_CHUNK_SIZE]
+        for start in range(0, len(items), PARSE_CHUNK_SIZE)
+    ]
+
+    def read_chunk(readers, chunk):
+        # Each task reads a few files, as a future per file costs about as
+        # much as reading a small cached file
+        paths = [path for _, path in chunk]
+        groups = [
+            paths[start:start + READ_GROUP_SIZE]
+            for start in range(0, len(paths), READ_GROUP_SIZE)
+        ]
+        return readers.map(lambda group: [read(path) for path in group], groups)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as readers:
+            pending = read_chunk(readers, chunks[0])
+            for index, chunk in enumerate(chunks):
+                contents = [content for group in pending for content in group]
+                # Read the next chunk while this one is parsed
+                if index + 1 < len(chunks):
+                    pending = read_chunk(readers, chunks[index + 1])
+
+                readable = [
+                    (image_file, content)
+                    for (image_file, _), (content, error) in zip(chunk, contents)
+                    if error is None
+                ]
+                if parsers is not None and readable:
+                    parsed = parsers.map(
+                        parse_response,
+                        *zip(*readable),
+                        chunksize=max(1, len(readable) // (processes * 4)),
+                    )
+                else:
+                    parsed = starmap(parse_response, readable)
+
+                for (image_file, file_path), (_, error) in zip(chunk, contents):
+                    row = None
+                    if error is None:
+                        row, error = next(parsed)
+                    yield image_file, file_path, row, error
+    finally:
+        if parsers is not None:
+            parsers.shutdown()
+
+
+def read_stored_response(store, image_file):
+    """
+    Read a tag response from a response store.
+
+    Args:
+        store (ResponseStore): Store holding the responses
+        image_file (str): Filename of the image
+
+    Returns:
+        tuple: (content, error) like read_response
+    """
+    content = store.get(image_file, "tag")
+    if content is None:
+        return None, KeyError(f"No tag response for {image_file} in {store.path}")
+    return content.strip(), None
+
+
+def write_errors(errors, error_file):
+    """
+    Write the response files that could not be read or parsed as JSON.
+
+    Args:
+        errors (list): Dicts with the image, response file, error type and message
+        error_file (str): Path of the JSON file
+    """
+    with open(error_file, "w") as f:
+        json.dump(errors, f, indent=2)
+    if errors:
+        print(f"{len(errors)} parse errors saved to {error_file}")
+
+
+def open_csv_writer(output_file):
+    """
+    Open a temporary CSV file next to the output file and write the header.
+
+    Rows are written in the format pandas ``to_csv`` used before: minimal
+    quoting and ``os.linesep`` line endings, so files from earlier runs
+    compare equal to rewritten ones.
+
+    Args:
+        output_file (str): Path the CSV file will be moved to
+
+    Returns:
+        tuple: (file, csv.DictWriter, temporary path)
+    """
+    folder, name = os.path.split(output_file)
+    fd, tmp_path = tempfile.mkstemp(dir=folder or ".", prefix=f".{name}.", suffix=".tmp")
+    f = os.fdopen(fd, "w", newline="")
+    writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS, lineterminator=os.linesep)
+    writer.writeheader()
+    return f, writer, tmp_path
+
+
+def analyze_output_files(
+    folder_path, output_file, merge=False, workers=1, processes=1, error_file=None, store=None
+):
     """
     Process all text files in the specified folder and create a CSV table.
+
+    Responses are processed in filename order, each row being written as
+    soon as its response is parsed, so memory does not grow with the number
+    of images. The file is written under a temporary name and moved into
+    place once complete. With more than one worker, files are read and
+    parsed in parallel (see iter_parsed); the output is the same.
+
+    With merge, the rows of an existing output file are kept in their order:
+    rows of images without a response are removed, rows whose response is
+    newer than the output file are parsed again and new responses are
+    appended in filename order. Other rows, including manual edits, are
+    kept as they are.
+
+    With a response store, the tag responses are read from the store
+    instead of folder_path, and the store's record of when each response
+    was saved tells which rows to parse again when merging.
     
     Args:
         folder_path (str): Folder containing AI response text files
         output_file (str): Path to save the output CSV file
-    """
-    results = []
+        merge (bool, optional): Merge the responses into an existing output file
+        workers (int, optional): Number of threads reading response files
+        processes (int, optional): Number of processes parsing responses
+        error_file (str, optional): Write the responses that could not be read or
+            parsed to this JSON file
+        store (ResponseStore, optional): Store holding the tag responses
 
-    # Check if the directory exists
-    if not os.path.isdir(folder_path):
+    Returns:
+        dict: Number of rows written and files that could not be parsed, and
+            when merging, the number of rows added, updated and removed
+    """
+    rows = 0
+    error_records = []
+
+    read = read_response
+    if store is not None:
+        # Responses are looked up by image in the store
+        read = partial(read_stored_response, store)
+        responses = {image_file: image_file for image_file in store.images("tag")}
+    elif not os.path.isdir(folder_path):
         print(f"Directory not found: {folder_path}")
-        return
-
-    # Process each text file in the folder
-    for file_name in os.listdir(folder_path):
-        if file_name.endswith(".txt"):
-            file_path = os.path.join(folder_path, file_name)
-
-            try:
-                # Read the text file
-                with open(file_path, "r") as f:
-                    content = f.read().strip()
-
-                # Extract the title, tags, and category
-                title, tags, category = extract_content_sections(content)
-
-                # Add to results
-                results.append(
-                    {
-                        "Filename": file_name[:-13] + ".jpeg",  # Remove _response.txt
-                        "Description": title,
-                        "Keywords": tags,
-                        "Categories": category,
-                        "Editorial": "no",
-                        "Mature content": "no",
-                        "illustration": "no",
-                    }
-                )
-
-            except Exception as e:
-                print(f"Error processing file {file_name}: {e}")
-
-    # Create a DataFrame and save results
-    if results:
-        df = pd.DataFrame(results)
-
-        print("\nAnalysis Results:")
-        print(df.shape)
-
-        # Save to CSV
-        csv_path = output_file
-        df.to_csv(csv_path, index=False)
-        print(f"\nResults saved to {csv_path}")
+        return None
+    else:
+        # Map each image to its response file (remove _response.txt)
+        responses = {
+            file_name[:-13] + ".jpeg": os.path.join(folder_path, file_name)
+            for file_name in sorted(os.listdir(folder_path))
+            if file_name.endswith(".txt")
+        }
+
+    counts = {}
+    updated = set()
+    items = []
+    if merge and os.path.exists(output_file):
+        counts = {"added": 0, "updated": 0, "removed": 0}
+        output_mtime = os.stat(output_file).st_mtime_ns
+        if store is not None:
+            changed = set(store.images("tag", updated_after=output_mtime / 1e9))
+        else:
+            changed = {
+                image_file
+                for image_file, file_path in responses.items()
+                if os.stat(file_path).st_mtime_ns > output_mtime
+            }
+        # First pass: find the rows whose response changed, to parse them
+        # together with the new responses
+        remaining = dict(responses)
+        with open(output_file, "r", newline="") as existing:
+            for row in csv.DictReader(existing):
+                file_path = remaining.pop(row["Filename"], None)
+                if file_path is not None and row["Filename"] in changed:
+                    updated.add(row["Filename"])
+                    items.append((row["Filename"], file_path))
+        items.extend(remaining.items())
     else:
-        print("No results found.")
+        items = list(responses.items())
+
+    parsed = iter_parsed(items, workers, processes, read)
+
+    def next_row():
+        image_file, file_path, row, error = next(parsed)
+        if error is not None:
+            print(f"Error processing file {os.path.basename(file_path)}: {error}")
+            error_records.append({
+                "image": image_file,
+                "file": file_path,
+                "type": type(error).__name__,
+                "error": str(error),
+            })
+        return row
+
+    f, writer, tmp_path = open_csv_writer(output_file)
+    try:
+        if counts:
+            with open(output_file, "r", newline="") as existing:
+                for row in csv.DictReader(existing):
+                    file_path = responses.pop(row["Filename"], None)
+                    if file_path is None:
+                        counts["removed"] += 1
+                        continue
+                    if row["Filename"] in updated:
+                        row = next_row()
+                        if row is None:
+                            continue
+                        counts["updated"] += 1
+                    writer.writerow({column: row.get(column) for column in CSV_COLUMNS})
+                    rows += 1
+
+        # Process each new response
+        for _ in range(len(items) - len(updated)):
+            row = next_row()
+            if row is None:
+                continue
+            writer.writerow(row)
+            rows += 1
+            if counts:
+                counts["added"] += 1
+        f.close()
+
+        if not rows and not counts:
+            os.remove(tmp_path)
+            print("No results found.")
+        else:
+            os.replace(tmp_path, output_file)
+    except BaseException:
+        f.close()
+        os.remove(tmp_path)
+        raise
+    finally:
+        parsed.close()
+
+    if error_file:
+        write_errors(error_records, error_file)
+    if not rows and not counts:
+        return {"rows": rows, "errors": len(error_records)}
+
+    print("\nAnalysis Results:")
+    print(f"{rows} rows, {len(CSV_COLUMNS)} columns")
+    if counts:
+        print(
+            f"Merged: {counts['added']} added, {counts['updated']} updated, "
+            f"{counts['removed']} removed"
+        )
+    print(f"\nResults saved to {output_file}")
+    return {"rows": rows, "errors": len(error_records), **counts}
+
+
+def run_step(
+    folder_path, output_file, merge=False, workers=1, processes=1, error_file=None, store=None
+):
+    """
+    Run the result analysis as a workflow step.
+
+    Args:
+        folder_path (str): Folder containing AI response text files
+        output_file (str): Path to save the output CSV file
+        merge (bool, optional): Merge the responses into an existing output file
+        workers (int, optional): Number of threads reading response files
+        processes (int, optional): Number of processes parsing responses
+        error_file (str, optional): Write the responses that could not be read or
+            parsed to this JSON file
+        store (ResponseStore, optional): Store holding the tag responses
+
+    Returns:
+        StepResult: Result with the number of rows written and unparsable files
+    """
+    counts = analyze_output_files(
+        folder_path, output_file, merge, workers, processes, error_file, store
+    )
+    if counts is None:
+        return StepResult(
+            "result_analyzer", success=False, error=f"Directory not found: {folder_path}"
+        )
+    return StepResult("result_analyzer", counts=counts)
 
 
 def main():
@@ -166,11 +574,51 @@ def main():
     parser.add_argument(
         "--output_file", default="6_image_tags.csv", help="Output CSV file name"
     )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="Keep the rows of an existing output file and only add, update and remove "
+        "the rows of changed responses",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=16, help="Number of threads reading response files"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help=f"Number of processes parsing responses, used from {PARALLEL_MIN_FILES} files "
+        "(1 parses in this process)",
+    )
+    parser.add_argument(
+        "--error_file",
+        default="6_image_tags_errors.json",
+        help="JSON file name listing the responses that could not be parsed",
+    )
+    parser.add_argument(
+        "--response_store",
+        help="SQLite file holding the tag responses instead of the folder "
+        "(see response_store.py)",
+    )
     args = parser.parse_args()
     
-    output_file_path = os.path.join(os.path.dirname(args.folder_path), args.output_file)
+    output_dir = os.path.dirname(args.folder_path)
+    output_file_path = os.path.join(output_dir, args.output_file)
+    store = None
+    if args.response_store:
+        from .response_store import ResponseStore
+
+        store = ResponseStore(args.response_store)
     print(f"Analyzing output files in: {args.folder_path}")
-    analyze_output_files(args.folder_path, output_file_path)
+    analyze_output_files(
+        args.folder_path,
+        output_file_path,
+        args.merge,
+        args.workers,
+        args.processes,
+        os.path.join(output_dir, args.error_file),
+        store,
+    )
     print(f"Output CSV file: {output_file_path}")
 
 
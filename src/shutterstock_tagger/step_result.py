@@ -0,0 +1,33 @@
+"""
+Step result module.
+
+Defines the result object returned by the workflow steps.
+"""
+
+from dataclasses import dataclass, field
+
+
+@dataclass
+class StepResult:
+    """
+    Outcome of a workflow step.
+
+    Evaluates as True when the step succeeded, so callers can keep testing
+    step results like the booleans the step functions used to return.
+
+    Attributes:
+        name (str): Name of the step
+        success (bool): Whether the step completed
+        counts (dict): Step specific counters, e.g. number of converted files
+        duration (float): Wall-clock duration of the step in seconds
+        error (str): Error message if the step failed
+    """
+
+    name: str
+    success: bool = True
+    counts: dict = field(default_factory=dict)
+    duration: float = 0.0
+    error: str = None
+
+    def __bool__(self):
+        return self.success
@@ -0,0 +1,217 @@
+"""
+Structured output module.
+
+In structured mode the prompts ask the model to answer with a JSON object
+matching a schema (upload decision, likelihood of acceptance, title,
+keywords and categories) instead of free text. Answers are validated
+against the schema, answers that do not match are asked again with the
+violation spelled out, and the validated object is saved as the response
+file. Readers tell the two formats apart with load_response: a structured
+response file holds a JSON object, a text response file a JSON string.
+
+JSON is parsed with orjson when it is installed, and with the json module
+otherwise.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Answers sent again per image when they do not match the schema
+DEFAULT_MAX_REASKS = 2
+
+# JSON schema of each field of a structured answer
+FIELD_SCHEMAS = {
+    "decision": {"type": "string", "enum": ["YES", "NO"]},
+    "likelihood": {"type": "string", "enum": ["LOW", "MEDIUM", "HIGH"]},
+    "title": {"type": "string", "minLength": 1},
+    "keywords": {
+        "type": "array",
+        "items": {"type": "string", "minLength": 1},
+        "minItems": 1,
+    },
+    "categories": {
+        "type": "array",
+        "items": {"type": "string", "minLength": 1},
+        "minItems": 1,
+        "maxItems": 2,
+    },
+}
+
+# Fields asked for by the classification, tag and combined prompts
+CLASSIFY_FIELDS = ["decision", "likelihood"]
+TAG_FIELDS = ["title", "keywords", "categories"]
+COMBINED_FIELDS = CLASSIFY_FIELDS + TAG_FIELDS
+
+
+class SchemaError(ValueError):
+    """Raised when a model answer is not a JSON object matching the schema."""
+
+
+def loads(text):
+    """
+    Parse JSON text, with orjson if available.
+
+    Args:
+        text (str or bytes): JSON text
+
+    Returns:
+        Decoded value
+
+    Raises:
+        ValueError: If the text is not valid JSON
+    """
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def load_response(content):
+    """
+    Decode the content of a response file if it holds a structured response.
+
+    Args:
+        content (str): Content of a response file
+
+    Returns:
+        dict: The structured response, or None if the file holds a text response
+    """
+    content = content.strip()
+    if not content.startswith("{"):
+        return None
+    return loads(content)
+
+
+def validate_field(name, value):
+    """
+    Check one field of an answer against its schema.
+
+    Args:
+        name (str): Field name, a key of FIELD_SCHEMAS
+        value: Value of the field in the answer
+
+    Returns:
+        Normalized value: enum values in upper case, strings stripped
+
+    Raises:
+        SchemaError: If the value does not match the schema
+    """
+    schema = FIELD_SCHEMAS[name]
+    if schema["type"] == "string":
+        if not isinstance(value, str) or not value.strip():
+            raise SchemaError(f"'{name}' must be a non-empty string")
+        value = value.strip()
+        if "enum" in schema:
+            value = value.upper()
+            if value not in schema["enum"]:
+                raise SchemaError(f"'{name}' must be one of {', '.join(schema['enum'])}")
+        return value
+
+    if not isinstance(value, list) or not all(
+        isinstance(item, str) and item.strip() for item in value
+    ):
+        raise SchemaError(f"'{name}' must be a list of non-empty strings")
+    value = [item.strip() for item in value]
+    if len(value) < schema["minItems"]:
+        raise SchemaError(f"'{name}' must have at least {schema['minItems']} items")
+    if len(value) > schema.get("maxItems", len(value)):
+        raise SchemaError(f"'{name}' must have at most {schema['maxItems']} items")
+    return value
+
+
+class ResponseSchema:
+    """
+    Schema of the structured answer to a prompt.
+
+    Attributes:
+        fields (list): Names of the fields the answer must have
+    """
+
+    def __init__(self, fields):
+        """
+        Create a schema.
+
+        Args:
+            fields (list): Names of the fields, keys of FIELD_SCHEMAS
+        """
+        self.fields = list(fields)
+
+    def to_json_schema(self):
+        """
+        Describe the answer as a JSON schema.
+
+        Returns:
+            dict: JSON schema of the answer object
+        """
+        return {
+            "type": "object",
+            "properties": {name: FIELD_SCHEMAS[name] for name in self.fields},
+            "required": self.fields,
+            "additionalProperties": False,
+        }
+
+    def prompt(self, prompt):
+        """
+        Add the output instructions to a prompt.
+
+        Args:
+            prompt (str): User prompt for the AI
+
+        Returns:
+            str: Prompt asking for a JSON object matching the schema
+        """
+        return (
+            f"{prompt}\n\nAnswer with only a JSON object, without code fences or other "
+            f"text, that matches this JSON schema:\n{json.dumps(self.to_json_schema())}"
+        )
+
+    def reask_prompt(self, prompt, error):
+        """
+        Build the prompt of a request asked again after an invalid answer.
+
+        Args:
+            prompt (str): User prompt for the AI
+            error (SchemaError): Why the previous answer was rejected
+
+        Returns:
+            str: Prompt with the output instructions and the violation
+        """
+        return (
+            f"{self.prompt(prompt)}\n\nA previous answer to this request was rejected: "
+            f"{error}. Answer again with only the JSON object."
+        )
+
+    def parse(self, text):
+        """
+        Decode and validate a model answer.
+
+        Code fences and text around the outermost braces are ignored, since
+        models add them despite the instructions.
+
+        Args:
+            text (str): Response text of the model
+
+        Returns:
+            dict: The fields of the schema, normalized (see validate_field)
+
+        Raises:
+            SchemaError: If the answer is not a JSON object matching the schema
+        """
+        start = text.find("{")
+        end = text.rfind("}")
+        if start < 0 or end < start:
+            raise SchemaError("the answer is not a JSON object")
+        try:
+            data = loads(text[start:end + 1])
+        except ValueError as e:
+            raise SchemaError(f"the answer is not valid JSON ({e})") from None
+        if not isinstance(data, dict):
+            raise SchemaError("the answer is not a JSON object")
+        missing = [name for name in self.fields if name not in data]
+        if missing:
+            raise SchemaError(f"missing fields: {', '.join(missing)}")
+        return {name: validate_field(name, data[name]) for name in self.fields}
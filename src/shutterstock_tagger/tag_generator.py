@@ -6,30 +6,89 @@ Uses AWS Bedrock to generate titles, keywords, and categories for stock photogra
 
 import os
 import argparse
-from .bedrock_client import read_prompt, process_images, get_aws_region
+from .step_result import StepResult
+from .bedrock_client import (
+    add_processing_arguments,
+    count_results,
+    get_processing_options,
+    read_prompt,
+    process_images,
+    get_aws_region,
+)
+from .structured_output import TAG_FIELDS, ResponseSchema
+
+
+# Prompt files live in the config directory at the repository root
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "config")
+
+
+def run_step(
+    image_folder, output_folder, region=None, overwrite=False, structured=False, **options
+):
+    """
+    Run the tag generation as a workflow step.
+
+    Images that already have a response are skipped unless overwrite is set.
+
+    Args:
+        image_folder (str): Folder containing images
+        output_folder (str): Folder to save responses
+        region (str, optional): AWS region. Defaults to environment variable or us-east-1
+        overwrite (bool, optional): Reprocess images that already have a response
+        structured (bool, optional): Ask for JSON answers validated against a schema
+            and save them as JSON objects (see structured_output.py)
+        **options: Keyword arguments passed to process_images, e.g. concurrency
+
+    Returns:
+        StepResult: Result with the number of processed, skipped and failed images
+    """
+    if region is None:
+        region = get_aws_region()
+    if structured:
+        options["schema"] = ResponseSchema(TAG_FIELDS)
+
+    system_prompt = read_prompt(os.path.join(CONFIG_DIR, "system_prompt.txt"))
+    prompt = read_prompt(os.path.join(CONFIG_DIR, "prompt.txt"))
+
+    results = process_images(
+        image_folder,
+        output_folder,
+        system_prompt,
+        prompt,
+        region,
+        skip_existing=not overwrite,
+        stage="tag",
+        **options,
+    )
+    return StepResult("tag_generator", counts=count_results(results))
 
 
 def main():
     """Main entry point for the tag generator script."""
-    # Get config directory relative to this file
-    config_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "config")
-    
-    system_prompt_file = os.path.join(config_dir, "system_prompt.txt")
-    prompt_file = os.path.join(config_dir, "prompt.txt")
     region = get_aws_region()
 
     parser = argparse.ArgumentParser(description="Generate tags for images using AWS Bedrock")
     parser.add_argument("--image_folder", required=True, help="Folder containing images")
     parser.add_argument("--output_folder", required=True, help="Folder to save responses")
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Reprocess images that already have a response file instead of resuming",
+    )
+    add_processing_arguments(parser)
 
     args = parser.parse_args()
 
-    system_prompt = read_prompt(system_prompt_file)
-    prompt = read_prompt(prompt_file)
-
-    process_images(args.image_folder, args.output_folder, system_prompt, prompt, region)
+    options = get_processing_options(args)
+    run_step(
+        args.image_folder,
+        args.output_folder,
+        region,
+        overwrite=args.overwrite,
+        **options,
+    )
+    options["metrics"].report(args.metrics_file)
 
 
 if __name__ == "__main__":
     main()
-
@@ -5,11 +5,32 @@ Manages the complete pipeline from raw images to upload-ready batches.
 """
 
 import os
+import sys
+import time
+import shlex
 import argparse
+from .bedrock_client import add_processing_arguments, get_processing_options
+from .ledger import LEDGER_FILE, Ledger
+from .incremental import archive_inputs, detect_changes, record_inputs, remove_outputs
+from .metrics import Metrics
+from .response_store import ResponseStore
+from .step_result import StepResult
 
 
 RAW_EXPORT_PATH = "1_raw_export"
 LABEL_FOLDER = "2_binary_output"
+TAG_OUTPUT_FOLDER = "5_tag_output"
+
+STEP_NAMES = [
+    "convert_images",
+    "clean_files",
+    "binary_classifier",
+    "file_organizer",
+    "folder_cleanup",
+    "tag_generator",
+    "result_analyzer",
+    "batch_splitter",
+]
 
 
 def get_state_completed(state_file):
@@ -42,85 +63,232 @@ def update_state_completed(state_file, state):
     print(f"State updated to {state} in {state_file}.")
 
 
-def step_0_convert_images(base_folder):
+def run_module(module, *args):
+    """
+    Run a shutterstock_tagger module in a separate Python process.
+
+    Args:
+        module (str): Module name, e.g. "convert_images"
+        *args: Command line arguments, quoted for the shell
+
+    Returns:
+        bool: True if the process exited successfully
+    """
+    command = " ".join(
+        [shlex.quote(sys.executable), "-m", f"shutterstock_tagger.{module}"]
+        + [shlex.quote(str(arg)) for arg in args]
+    )
+    return os.system(command) == 0
+
+
+def get_step_arguments(args):
+    """
+    Build the Bedrock processing options forwarded to step processes.
+
+    Args:
+        args (argparse.Namespace): Parsed workflow command line
+
+    Returns:
+        list: Command line options for binary_classifier and tag_generator
+    """
+    step_args = [
+        "--max_edge", args.max_edge,
+        "--jpeg_quality", args.jpeg_quality,
+        "--tokens_per_request", args.tokens_per_request,
+        "--max_attempts", args.max_attempts,
+        "--cache_path", args.cache_path,
+    ]
+    if args.requests_per_minute:
+        step_args += ["--requests_per_minute", args.requests_per_minute]
+    if args.tokens_per_minute:
+        step_args += ["--tokens_per_minute", args.tokens_per_minute]
+    if args.no_cache:
+        step_args.append("--no_cache")
+    return step_args
+
+
+def get_subprocess_arguments(module, options):
+    """
+    Build the command line options of a Bedrock step run in a separate process.
+
+    A step process exports its metrics next to the workflow's metrics file,
+    e.g. run.binary_classifier.prom for run.prom.
+
+    Args:
+        module (str): Module name, "binary_classifier" or "tag_generator"
+        options (dict): process_images keyword arguments of the step, with the
+            forwarded command line options as step_args
+
+    Returns:
+        list: Command line options
+    """
+    args = list(options.get("step_args", []))
+    if options.get("ledger") is not None:
+        args += ["--ledger", options["ledger"].path]
+    if options.get("store") is not None:
+        args += ["--response_store", options["store"].path]
+    if options.get("metrics_file"):
+        root, ext = os.path.splitext(options["metrics_file"])
+        args += ["--metrics_file", f"{root}.{module}{ext}"]
+    return args
+
+
+def run_in_process(name, step, *args, **kwargs):
+    """
+    Call a module's run_step function, turning exceptions into a failed result.
+
+    Args:
+        name (str): Name of the step
+        step (callable): run_step function of the module
+        *args: Positional arguments for the step
+        **kwargs: Keyword arguments for the step
+
+    Returns:
+        StepResult: Result of the step
+    """
+    try:
+        return step(*args, **kwargs)
+    except Exception as e:
+        print(f"Error: {name} failed: {e}")
+        return StepResult(name, success=False, error=str(e))
+
+
+def step_0_convert_images(base_folder, use_subprocess=False, metrics=None):
     """
     Step 0: Convert HEIC/HEIF images to JPEG format.
     
     Args:
         base_folder (str): Base working directory
+        use_subprocess (bool, optional): Run the step in a separate Python process
+        metrics (Metrics, optional): Records the conversion of each image when run
+            in this process
         
     Returns:
-        bool: True if successful, False otherwise
+        StepResult: Result of the step, true if successful
     """
     raw_input_path = os.path.join(base_folder, RAW_EXPORT_PATH)
     assert os.path.exists(raw_input_path), f"Raw input path {raw_input_path} does not exist."
     print(f"Converting images in {raw_input_path}...")
 
-    command = f"python -m shutterstock_tagger.convert_images '{raw_input_path}'"
-    ret = os.system(command)
-    if ret != 0:
+    if use_subprocess:
+        result = StepResult("convert_images", run_module("convert_images", raw_input_path))
+    else:
+        from . import convert_images
+
+        result = run_in_process(
+            "convert_images",
+            convert_images.run_step,
+            raw_input_path,
+            os.cpu_count() or 1,
+            metrics,
+        )
+    if not result:
         print(f"Error: Failed to convert files in {raw_input_path}.")
-        return False
+        return result
     print("Step 0: Convert files done.")
-    return True
+    return result
 
 
-def step_1_clean_files(base_folder):
+def step_1_clean_files(base_folder, use_subprocess=False):
     """
     Step 1: Clean files by removing images that don't meet requirements.
     
     Args:
         base_folder (str): Base working directory
+        use_subprocess (bool, optional): Run the step in a separate Python process
         
     Returns:
-        bool: True if successful, False otherwise
+        StepResult: Result of the step, true if successful
     """
     raw_input_path = os.path.join(base_folder, RAW_EXPORT_PATH)
     assert os.path.exists(raw_input_path), f"Raw input path {raw_input_path} does not exist."
     print(f"Processing images in {raw_input_path}...")
 
-    command = f"python -m shutterstock_tagger.clean_files '{raw_input_path}'"
-    ret = os.system(command)
-    if ret != 0:
+    if use_subprocess:
+        result = StepResult("clean_files", run_module("clean_files", raw_input_path))
+    else:
+        from . import clean_files
+
+        result = run_in_process("clean_files", clean_files.run_step, raw_input_path)
+    if not result:
         print(f"Error: Failed to clean files in {raw_input_path}.")
-        return False
+        return result
     print("Step 1: Cleaned files done.")
-    return True
+    return result
 
 
-def step_2_get_images_binary(base_folder):
+def step_2_get_images_binary(
+    base_folder, concurrency=1, combined=False, use_subprocess=False, **options
+):
     """
     Step 2: Classify images for suitability using AWS Bedrock.
+
+    In combined mode the tags for step 5 are generated by the same request.
     
     Args:
         base_folder (str): Base working directory
+        concurrency (int, optional): Number of concurrent Bedrock requests
+        combined (bool, optional): Classify and generate tags in a single request
+        use_subprocess (bool, optional): Run the step in a separate Python process
+        **options: Other process_images keyword arguments. A subprocess receives the
+            command line options in step_args, the paths of the ledger and the
+            response store, and a metrics file derived from metrics_file
         
     Returns:
-        bool: True if successful, False otherwise
+        StepResult: Result of the step, true if successful
     """
     raw_input_path = os.path.join(base_folder, RAW_EXPORT_PATH)
     label_folder = os.path.join(base_folder, LABEL_FOLDER)
+    tag_output_folder = os.path.join(base_folder, TAG_OUTPUT_FOLDER) if combined else None
     assert os.path.exists(raw_input_path), f"Raw input path {raw_input_path} does not exist."
     print(f"Processing images in {raw_input_path}...")
 
-    command = f"python -m shutterstock_tagger.binary_classifier --image_folder '{raw_input_path}' --output_folder '{label_folder}'"
-    ret = os.system(command)
-    if ret != 0:
+    if use_subprocess:
+        args = [
+            "--image_folder", raw_input_path,
+            "--output_folder", label_folder,
+            "--concurrency", concurrency,
+        ]
+        if combined:
+            args += ["--combined", "--tag_output_folder", tag_output_folder]
+        args += get_subprocess_arguments("binary_classifier", options)
+        result = StepResult("binary_classifier", run_module("binary_classifier", *args))
+    else:
+        from . import binary_classifier
+
+        result = run_in_process(
+            "binary_classifier",
+            binary_classifier.run_step,
+            raw_input_path,
+            label_folder,
+            tag_output_folder,
+            concurrency=concurrency,
+            **options,
+        )
+    if not result:
         print(f"Error: Failed to get images binary in {raw_input_path}.")
-        return False
+        return result
     print("Step 2: Get images binary done.")
-    return True
+    return result
 
 
-def step_3_move_files(base_folder):
+def step_3_move_files(
+    base_folder, link_mode="copy", use_subprocess=False, metrics=None, store=None
+):
     """
     Step 3: Organize files based on classification results.
     
     Args:
         base_folder (str): Base working directory
+        link_mode (str, optional): One of "hardlink", "reflink" or "copy". Symlinks
+            are not suitable because step 4 deletes the source folder
+        use_subprocess (bool, optional): Run the step in a separate Python process
+        metrics (Metrics, optional): Records the placement of each image when run
+            in this process
+        store (ResponseStore, optional): Store holding the classifications
         
     Returns:
-        bool: True if successful, False otherwise
+        StepResult: Result of the step, true if successful
     """
     raw_input_path = os.path.join(base_folder, RAW_EXPORT_PATH)
     label_folder = os.path.join(base_folder, LABEL_FOLDER)
@@ -128,91 +296,174 @@ def step_3_move_files(base_folder):
     copied_dest_folder = os.path.join(base_folder, "3_copied_dest")
     print(f"Copying images in {raw_input_path} to {copied_dest_folder}...")
 
-    command = f"python -m shutterstock_tagger.file_organizer --source_dir '{raw_input_path}' --label_dir '{label_folder}' --results_dir '{copied_dest_folder}'"
-    ret = os.system(command)
-    if ret != 0:
+    if use_subprocess:
+        result = StepResult(
+            "file_organizer",
+            run_module(
+                "file_organizer",
+                "--source_dir", raw_input_path,
+                "--label_dir", label_folder,
+                "--results_dir", copied_dest_folder,
+                "--link_mode", link_mode,
+                *(["--response_store", store.path] if store is not None else []),
+            ),
+        )
+    else:
+        from . import file_organizer
+
+        result = run_in_process(
+            "file_organizer",
+            file_organizer.run_step,
+            raw_input_path,
+            label_folder,
+            copied_dest_folder,
+            link_mode,
+            metrics,
+            store,
+        )
+    if not result:
         print(f"Error: Failed to move files from {raw_input_path} to {copied_dest_folder}.")
-        return False
+        return result
 
     print("Step 3: Move files done.")
-    return True
+    return result
 
 
-def step_4_delete_folders(base_folder):
+def step_4_delete_folders(base_folder, use_subprocess=False):
     """
     Step 4: Clean up temporary folders.
     
     Args:
         base_folder (str): Base working directory
+        use_subprocess (bool, optional): Run the step in a separate Python process
         
     Returns:
-        bool: True if successful, False otherwise
+        StepResult: Result of the step, true if successful
     """
-    command = f"python -m shutterstock_tagger.folder_cleanup --base_folder '{base_folder}'"
-    ret = os.system(command)
-    if ret != 0:
+    if use_subprocess:
+        result = StepResult(
+            "folder_cleanup", run_module("folder_cleanup", "--base_folder", base_folder)
+        )
+    else:
+        from . import folder_cleanup
+
+        result = run_in_process("folder_cleanup", folder_cleanup.run_step, base_folder)
+    if not result:
         print(f"Error: Failed to delete folders in {base_folder}.")
-        return False
+        return result
     print("Step 4: Delete folders done.")
-    return True
+    return result
 
 
-def step_5_generate_tags(base_folder):
+def step_5_generate_tags(base_folder, concurrency=1, use_subprocess=False, **options):
     """
     Step 5: Generate tags, titles, and categories using AWS Bedrock.
     
     Args:
         base_folder (str): Base working directory
+        concurrency (int, optional): Number of concurrent Bedrock requests
+        use_subprocess (bool, optional): Run the step in a separate Python process
+        **options: Other process_images keyword arguments. A subprocess receives the
+            command line options in step_args, the paths of the ledger and the
+            response store, and a metrics file derived from metrics_file
         
     Returns:
-        bool: True if successful, False otherwise
+        StepResult: Result of the step, true if successful
     """
     copied_dest_folder = os.path.join(base_folder, "3_copied_dest/high")
-    tag_output_folder = os.path.join(base_folder, "5_tag_output")
+    tag_output_folder = os.path.join(base_folder, TAG_OUTPUT_FOLDER)
     assert os.path.exists(copied_dest_folder), f"Copied destination folder {copied_dest_folder} does not exist."
     print(f"Processing images in {copied_dest_folder}...")
 
-    command = f"python -m shutterstock_tagger.tag_generator --image_folder '{copied_dest_folder}' --output_folder '{tag_output_folder}'"
-    ret = os.system(command)
-    if ret != 0:
+    if use_subprocess:
+        args = [
+            "--image_folder", copied_dest_folder,
+            "--output_folder", tag_output_folder,
+            "--concurrency", concurrency,
+        ]
+        args += get_subprocess_arguments("tag_generator", options)
+        result = StepResult("tag_generator", run_module("tag_generator", *args))
+    else:
+        from . import tag_generator
+
+        result = run_in_process(
+            "tag_generator",
+            tag_generator.run_step,
+            copied_dest_folder,
+            tag_output_folder,
+            concurrency=concurrency,
+            **options,
+        )
+    if not result:
         print(f"Error: Failed to run tag_generator on images in {copied_dest_folder}.")
-        return False
+        return result
     print("Step 5: Generate tags done.")
-    return True
+    return result
 
 
-def step_6_analyze_results(base_folder):
+def step_6_analyze_results(base_folder, merge=False, use_subprocess=False, store=None):
     """
     Step 6: Analyze results and create CSV for upload.
+
+    Responses are read and parsed in parallel, and the responses that could
+    not be parsed are listed in 6_image_tags_errors.json.
     
     Args:
         base_folder (str): Base working directory
+        merge (bool, optional): Update the rows of an existing CSV instead of rewriting it
+        use_subprocess (bool, optional): Run the step in a separate Python process
+        store (ResponseStore, optional): Store holding the tag responses
         
     Returns:
-        bool: True if successful, False otherwise
+        StepResult: Result of the step, true if successful
     """
-    tag_output_folder = os.path.join(base_folder, "5_tag_output")
+    tag_output_folder = os.path.join(base_folder, TAG_OUTPUT_FOLDER)
     assert os.path.exists(tag_output_folder), f"Tag output folder {tag_output_folder} does not exist."
     print(f"Analyzing results in {tag_output_folder}...")
 
-    command = f"python -m shutterstock_tagger.result_analyzer --folder_path '{tag_output_folder}'"
-    ret = os.system(command)
-    if ret != 0:
+    if use_subprocess:
+        result = StepResult(
+            "result_analyzer",
+            run_module(
+                "result_analyzer",
+                "--folder_path",
+                tag_output_folder,
+                *(["--merge"] if merge else []),
+                *(["--response_store", store.path] if store is not None else []),
+            ),
+        )
+    else:
+        from . import result_analyzer
+
+        result = run_in_process(
+            "result_analyzer",
+            result_analyzer.run_step,
+            tag_output_folder,
+            os.path.join(base_folder, "6_image_tags.csv"),
+            merge,
+            16,
+            os.cpu_count() or 1,
+            os.path.join(base_folder, "6_image_tags_errors.json"),
+            store,
+        )
+    if not result:
         print(f"Error: Failed to analyze results in {tag_output_folder}.")
-        return False
+        return result
     print("Step 6: Analyze results done.")
-    return True
+    return result
 
 
-def step_7_split_upload_batch(base_folder):
+def step_7_split_upload_batch(base_folder, link_mode="copy", use_subprocess=False):
     """
     Step 7: Split images into upload batches of 100.
     
     Args:
         base_folder (str): Base working directory
+        link_mode (str, optional): One of "hardlink", "reflink", "symlink" or "copy"
+        use_subprocess (bool, optional): Run the step in a separate Python process
         
     Returns:
-        bool: True if successful, False otherwise
+        StepResult: Result of the step, true if successful
     """
     single_output_folder = os.path.join(base_folder, "3_copied_dest/high")
     batch_output_folder = os.path.join(base_folder, "7_batch_output")
@@ -221,72 +472,293 @@ def step_7_split_upload_batch(base_folder):
     assert os.path.exists(single_output_folder), f"Tag output folder {single_output_folder} does not exist."
     print(f"Splitting upload batches in {single_output_folder}...")
     tag_file = os.path.join(base_folder, "6_image_tags.csv")
-    command = f"python -m shutterstock_tagger.batch_splitter --single_output_folder '{single_output_folder}' --tag_files '{tag_file}' --batch_output_folder '{batch_output_folder}'"
-    ret = os.system(command)
-    if ret != 0:
+    if use_subprocess:
+        result = StepResult(
+            "batch_splitter",
+            run_module(
+                "batch_splitter",
+                "--single_output_folder", single_output_folder,
+                "--tag_files", tag_file,
+                "--batch_output_folder", batch_output_folder,
+                "--link_mode", link_mode,
+            ),
+        )
+    else:
+        from . import batch_splitter
+
+        result = run_in_process(
+            "batch_splitter",
+            batch_splitter.run_step,
+            single_output_folder,
+            tag_file,
+            batch_output_folder,
+            link_mode,
+        )
+    if not result:
         print(f"Error: Failed to split upload batches in {single_output_folder}.")
-        return False
+        return result
     print("Step 7: Split upload batches done.")
-    return True
+    return result
 
 
-def process_images(base_folder):
+def step_stream(
+    base_folder,
+    concurrency=1,
+    combined=False,
+    link_mode="copy",
+    use_subprocess=False,
+    **options,
+):
     """
-    Main workflow orchestrator. Executes all steps in sequence.
-    
+    Steps 0-3 and 5-7 as a streaming pipeline over individual images.
+
     Args:
         base_folder (str): Base working directory
+        concurrency (int, optional): Number of concurrent Bedrock requests
+        combined (bool, optional): Classify and generate tags in a single request
+        link_mode (str, optional): How images are placed in the result and batch folders
+        use_subprocess (bool, optional): Not supported, the pipeline always runs in process
+        **options: Other StreamingWorkflow keyword arguments, e.g. cache
+
+    Returns:
+        StepResult: Result of the pipeline, true if successful
     """
-    state_file_path = os.path.join(base_folder, "state.txt")
+    assert not use_subprocess, "The streaming workflow cannot run steps in subprocesses."
+    from . import pipeline
+
+    result = run_in_process(
+        "streaming_workflow",
+        pipeline.run_pipeline,
+        base_folder,
+        concurrency=concurrency,
+        combined=combined,
+        link_mode=link_mode,
+        **options,
+    )
+    if not result:
+        print(f"Error: Streaming workflow failed in {base_folder}.")
+        return result
+    print("Streaming steps 0-3 and 5-7 done.")
+    return result
 
-    if not os.path.exists(state_file_path):
-        print(f"State file {state_file_path} does not exist. Initializing state to -1.")
-        update_state_completed(state_file_path, -1)
 
-    state_completed = get_state_completed(state_file_path)
-    
-    # Execute each step in sequence
-    if state_completed == -1:
-        if step_0_convert_images(base_folder):
-            update_state_completed(state_file_path, 0)
+def print_step_timings(results):
+    """
+    Print the duration of each step that ran.
+
+    Args:
+        results (list): StepResult of each step
+    """
+    if not results:
+        return
+    print("\nStep timings:")
+    for result in results:
+        failed = result.counts.get("failed", 0)
+        status = " (failed)" if not result else f" ({failed} images failed)" if failed else ""
+        print(f"  - {result.name}: {result.duration:.1f}s{status}")
+    print(f"  - total: {sum(result.duration for result in results):.1f}s")
 
-    state_completed = get_state_completed(state_file_path)
-    if state_completed == 0:
-        if step_1_clean_files(base_folder):
-            update_state_completed(state_file_path, 1)
 
-    state_completed = get_state_completed(state_file_path)
-    if state_completed == 1:
-        if step_2_get_images_binary(base_folder):
-            update_state_completed(state_file_path, 2)
+def import_state_file(ledger, state_file):
+    """
+    Import a state file into the ledger.
 
-    state_completed = get_state_completed(state_file_path)
-    if state_completed == 2:
-        if step_3_move_files(base_folder):
-            update_state_completed(state_file_path, 3)
+    Used for workflows started before the ledger existed and to skip steps
+    manually: the steps up to the one in state.txt are recorded as done, the
+    later ones as not run, and the state file is removed.
 
-    state_completed = get_state_completed(state_file_path)
-    if state_completed == 3:
-        if step_4_delete_folders(base_folder):
-            update_state_completed(state_file_path, 4)
+    Args:
+        ledger (Ledger): Ledger of the shoot
+        state_file (str): Path to the state file
+    """
+    if not os.path.exists(state_file):
+        return
+    state = get_state_completed(state_file)
+    ledger.reset_steps()
+    for number in range(state + 1):
+        ledger.record_step(number, STEP_NAMES[number], "done")
+    os.remove(state_file)
+    print(f"Imported state {state} from {state_file} into {ledger.path}.")
+
+
+def process_images(
+    base_folder,
+    concurrency=1,
+    combined=False,
+    link_mode="copy",
+    stream=False,
+    use_subprocess=False,
+    metrics_file=None,
+    **options,
+):
+    """
+    Main workflow orchestrator. Executes all steps in sequence.
 
-    state_completed = get_state_completed(state_file_path)
-    if state_completed == 4:
-        if step_5_generate_tags(base_folder):
-            update_state_completed(state_file_path, 5)
+    Steps run in this process by default; use_subprocess runs each step as
+    ``python -m shutterstock_tagger.<module>`` instead. With stream, a new
+    shoot is processed image by image through a pipeline of steps 0-3 and
+    5-7, followed by the folder cleanup of step 4.
+
+    Progress is kept in the ledger of the base folder (ledger.sqlite). A step
+    that fails stops the workflow and runs again on the next run, where
+    images that are already done are skipped. A step in which some images
+    fail is recorded as partial and the workflow continues with the other
+    images, keeping the raw export folder (step 4) while images of steps 0-3
+    failed. The next run retries the failed images and runs the later steps
+    again.
+    Files added to, modified in or deleted from the raw export folder since
+    the last run are detected from fingerprints in the ledger: the outputs
+    of modified and deleted images are removed and all steps run again,
+    step by step, redoing the work only for the changed images.
+
+    Timings, bytes, tokens and errors are collected in a Metrics registry,
+    summarized at the end of the run and optionally exported. Steps run in
+    subprocesses only contribute their durations; the Bedrock steps export
+    their own metrics next to metrics_file.
+    
+    Args:
+        base_folder (str): Base working directory
+        concurrency (int, optional): Number of concurrent Bedrock requests
+        combined (bool, optional): Classify and generate tags in a single request in step 2
+        link_mode (str, optional): How steps 3 and 7 place images: "hardlink", "reflink"
+            or "copy"
+        stream (bool, optional): Run steps 0-3 and 5-7 as a streaming pipeline. Only
+            used when the workflow has not started yet and no batch backend is given
+        use_subprocess (bool, optional): Run each step in a separate Python process
+        metrics_file (str, optional): Export the metrics of the run to this file,
+            see Metrics.write
+        **options: Other process_images keyword arguments for steps 2 and 5, e.g. cache.
+            Defaults the ledger to ledger.sqlite in the base folder and the metrics
+            to a new registry. A response store given as store is also read by
+            steps 3 and 6
 
-    state_completed = get_state_completed(state_file_path)
-    if state_completed == 5:
-        if step_6_analyze_results(base_folder):
-            update_state_completed(state_file_path, 6)
+    Returns:
+        list: StepResult of each step that ran
+    """
+    ledger = options.get("ledger") or Ledger(os.path.join(base_folder, LEDGER_FILE))
+    options["ledger"] = ledger
+    metrics = options.get("metrics") or Metrics()
+    options["metrics"] = metrics
+    store = options.get("store")
+    if use_subprocess and metrics_file:
+        options["metrics_file"] = metrics_file
+    results = []
+
+    def run(step, *args, **kwargs):
+        start = time.perf_counter()
+        result = step(*args, use_subprocess=use_subprocess, **kwargs)
+        result.duration = time.perf_counter() - start
+        metrics.observe("step_seconds", result.duration, step=result.name)
+        results.append(result)
+        return result
+
+    def check(number, result):
+        failed = result.counts.get("failed", 0)
+        if not result:
+            error = result.error or f"{failed} images failed"
+            result.error = error
+            ledger.record_step(number, result.name, "failed", result.duration, error)
+            print(f"Error: {result.name} did not complete: {error}.")
+            print("Run the workflow again to retry; images that are done will be skipped.")
+            return False
+        if failed:
+            # Keep going with the other images, the next run retries the failed ones
+            error = f"{failed} images failed"
+            ledger.record_step(number, result.name, "partial", result.duration, error)
+            print(f"Warning: {failed} images failed in {result.name}, continuing without them.")
+            return True
+        ledger.record_step(number, result.name, "done", result.duration)
+        return True
+
+    def has_partial(numbers):
+        return any(ledger.step_status(number) == "partial" for number in numbers)
+
+    import_state_file(ledger, os.path.join(base_folder, "state.txt"))
 
-    state_completed = get_state_completed(state_file_path)
-    if state_completed == 6:
-        if step_7_split_upload_batch(base_folder):
-            update_state_completed(state_file_path, 7)
+    raw_input_path = os.path.join(base_folder, RAW_EXPORT_PATH)
+    if ledger.has_steps():
+        changes = detect_changes(ledger, raw_input_path)
+        if changes:
+            print(
+                f"Found changes in {RAW_EXPORT_PATH}: {len(changes.added)} added, "
+                f"{len(changes.modified)} modified, {len(changes.deleted)} deleted. "
+                "Running all steps again for the changed images."
+            )
+            removed = remove_outputs(
+                ledger, base_folder, changes.modified + changes.deleted, store
+            )
+            if removed:
+                print(f"Removed {removed} outputs of modified and deleted images.")
+            ledger.reset_steps()
+            if stream:
+                # The pipeline only sees the raw export folder, which no longer
+                # holds the images of the earlier runs
+                print("Processing the changes step by step.")
+                stream = False
+
+    # Steps with failed images run again, and so do the steps after them
+    partial = [
+        number for number, _, status, _, _ in ledger.steps() if number >= 0 and status == "partial"
+    ]
+    if partial:
+        print(f"Retrying the images that failed in step {partial[0]} and the steps after it.")
+
+    steps = [
+        (0, step_0_convert_images, [base_folder], {"metrics": metrics}),
+        (1, step_1_clean_files, [base_folder], {}),
+        (2, step_2_get_images_binary, [base_folder, concurrency, combined], options),
+        (3, step_3_move_files, [base_folder, link_mode], {"metrics": metrics, "store": store}),
+        (4, step_4_delete_folders, [base_folder], {}),
+        (5, step_5_generate_tags, [base_folder, concurrency], options),
+        (6, step_6_analyze_results, [base_folder], {"merge": True, "store": store}),
+        (7, step_7_split_upload_batch, [base_folder, link_mode], {}),
+    ]
+
+    if stream and options.get("batch") is not None:
+        print("Batch jobs cover all images of a step, processing step by step.")
+        stream = False
+
+    completed = True
+    if stream and ledger.step_status(0) is not None:
+        print("Workflow already started, continuing step by step.")
+    elif stream:
+        result = run(step_stream, base_folder, concurrency, combined, link_mode, **options)
+        # The pipeline covers every step except the folder cleanup
+        completed = check(-1, result)
+        if completed:
+            record_inputs(ledger, raw_input_path)
+            # The next run retries failed images step by step
+            status = "partial" if result.counts.get("failed") else "done"
+            for number, name in enumerate(STEP_NAMES):
+                if number != 4:
+                    ledger.record_step(number, name, status)
 
-    print("All steps completed successfully.")
-    print(f"Folder of images to submit: {os.path.join(base_folder, '7_batch_output')}")
+    # Execute each step in sequence
+    for number, step, args, kwargs in steps:
+        if not completed:
+            break
+        if number == 4 and has_partial(range(4)):
+            print("Step 4: Keeping the folders, so that the failed images can be retried.")
+            continue
+        rerun = partial and number >= partial[0]
+        if rerun or ledger.step_status(number) not in ("done", "partial"):
+            completed = check(number, run(step, *args, **kwargs))
+            if completed and number == 1:
+                # Fingerprint the cleaned images to detect changes on the next run
+                record_inputs(ledger, raw_input_path)
+            elif completed and number == 4 and not os.path.exists(raw_input_path):
+                archive_inputs(ledger)
+
+    print_step_timings(results)
+    metrics.report(metrics_file)
+    if completed and has_partial(range(len(STEP_NAMES))):
+        print("All steps completed, but some images failed. Run the workflow again to retry them.")
+        print(f"Failed images: python -m shutterstock_tagger.ledger --base_folder {base_folder}")
+    elif completed:
+        print("All steps completed successfully.")
+        print(f"Folder of images to submit: {os.path.join(base_folder, '7_batch_output')}")
+    ledger.close()
+    return results
 
 
 def main():
@@ -298,11 +770,62 @@ def main():
         required=True,
         help="Path to the folder containing images.",
     )
+    parser.add_argument(
+        "--combined",
+        action="store_true",
+        help="Classify and generate tags with a single Bedrock request per image.",
+    )
+    parser.add_argument(
+        "--link_mode",
+        choices=["hardlink", "reflink", "copy"],
+        default="copy",
+        help="How images are placed in the result and batch folders. hardlink and reflink "
+        "save disk writes; hard links share their content with the source, so editing "
+        "one edits the other. Falls back to copy when linking fails.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Move each image through conversion, classification, tagging and batching "
+        "as soon as it is ready, instead of running each step over all images.",
+    )
+    parser.add_argument(
+        "--subprocess",
+        action="store_true",
+        help="Run each step in a separate Python process instead of in this process.",
+    )
+    add_processing_arguments(parser)
 
     args = parser.parse_args()
-    process_images(args.base_folder)
+    if args.stream and args.subprocess:
+        parser.error("--stream runs in a single process and cannot be used with --subprocess")
+    if args.subprocess and (args.batch or args.backend != "bedrock" or args.structured):
+        parser.error(
+            "--batch, --backend and --structured are not forwarded to step processes; "
+            "run without --subprocess"
+        )
+    if args.subprocess:
+        # Step processes parse their own options, so the processing options are
+        # forwarded on their command lines
+        options = {"step_args": get_step_arguments(args)}
+        if args.ledger:
+            options["ledger"] = Ledger(args.ledger)
+        if args.response_store:
+            options["store"] = ResponseStore(args.response_store)
+    else:
+        options = get_processing_options(args)
+        del options["concurrency"]
+    process_images(
+        args.base_folder,
+        concurrency=args.concurrency,
+        combined=args.combined,
+        link_mode=args.link_mode,
+        stream=args.stream,
+        use_subprocess=args.subprocess,
+        metrics_file=args.metrics_file,
+        **options,
+    )
 
 
 if __name__ == "__main__":
     main()
-